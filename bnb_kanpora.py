@@ -9,9 +9,11 @@ import argparse
 import sys
 from bnb_kanpora.config import Config
 
-from bnb_kanpora.controllers import DatabaseController, SearchAreaController, SearchSurveyController
-from bnb_kanpora.views import ABSearchAreaViewer, ABSurveyViewer
-from bnb_kanpora.utils import GeoBox
+# controllers (requests, lxml, ...) are imported by the commands that need them,
+# so that listing commands start fast
+from bnb_kanpora.views import ABViewer, ABSearchAreaViewer, ABSurveyViewer, ABRoomViewer, OUTPUT_FORMATS
+from bnb_kanpora.utils import GeoBox, stay_dates
+from datetime import date, timedelta
 
 SCRIPT_VERSION_NUMBER = "0.1.0"
  
@@ -30,15 +32,21 @@ class ABCollectorApp:
         
             Available commands:
 
-                survey [run|delete|list|run_extra|export]
+                survey [run|delete|list|run_extra|run_hosts|sweep|export|aggregate|tiles|metrics|reparse|normalize|purge]
                 search_area [add|delete|list]
-                db [check]
+                room [search]
+                db [check|migrate|compact]
 
             Optional args:
                 -v | --verbose
                 -c | --config file <config_file>
+                -f | --format [text|json|ndjson]
+                -y | --yes (do not ask for confirmation)
                 -V | --version
                 -? | --help
+
+            Every value asked interactively can be given as a flag
+            (see <command> -?), for use in scripts.
     ''')
 
         parser.add_argument('command', help='Command to run')
@@ -60,6 +68,13 @@ class ABCollectorApp:
                             metavar="config_file", action="store", default="./app.config",
                             help="""explicitly set configuration file, instead of
                             using the default <username>.config""")
+        parser.add_argument("-f", "--format",
+                            choices=OUTPUT_FORMATS, default="text",
+                            help="""output format: text, a JSON document or
+                            one JSON object per line (ndjson)""")
+        parser.add_argument("-y", "--yes",
+                            action="store_true", default=False,
+                            help="""do not ask for confirmation""")
         parser.add_argument('-V', '--version',
                             action='version',
                             version='%(prog)s, version ' +
@@ -73,25 +88,69 @@ class ABCollectorApp:
         if(args.verbose):
             logger.setLevel(logging.DEBUG)
         if(args.config_file):
-            print(f"with config {args.config_file}")
+            logger.debug(f"with config {args.config_file}")
         
         return args
 
+    def get_config(self, args, check_schema=True) -> Config:
+        config = Config(args.config_file)
+        if check_schema:
+            from bnb_kanpora.db import DBUtils
+            if not DBUtils(config).is_up_to_date():
+                logger.error("The database schema is missing or out of date, run: bnb_kanpora.py db migrate")
+                exit(1)
+        return config
+
+    def get_value(self, value, prompt:str, flag:str, print_choices=None) -> str:
+        """Return the value given as a flag, or ask for it on an interactive terminal"""
+        if value is not None:
+            return value
+        if not sys.stdin.isatty():
+            logger.error(f"Missing argument {flag}")
+            exit(2)
+        if print_choices:
+            print_choices()
+        return input(prompt)
+
+    def confirm(self, args, question:str) -> bool:
+        if args.yes:
+            return True
+        if not sys.stdin.isatty():
+            logger.error("Confirmation needed, use --yes")
+            exit(2)
+        sys.stdout.write(question)
+        return input().lower() == "y"
+
     def db(self):
         parser = argparse.ArgumentParser(
             description='Manage an airbnb survey')
+        parser.add_argument("--full", action="store_true", default=False,
+                            help="""rewrite the whole database file, needed once to enable
+                            incremental vacuum on older SQLite databases (compact)""")
         args = self.parse_subcommand_args(parser)
-        
-        config = Config(args.config_file)
+
+        from bnb_kanpora.controllers import DatabaseController
+        config = self.get_config(args, check_schema=False)
         db = DatabaseController(config)
+        viewer = ABViewer(args.format)
 
         if(args.subcommand == "check"):            
             try:
                 db.db_check_connection()
-                print("Connection OK")
+                version = db.schema_version()
+                viewer.print_result({"connection": True, "schema_version": version},
+                                    f"Connection OK\nSchema version {version}")
             except Exception as e:
-                print("Something went wrong with the DB connection, please check your config file")
-                print(e)
+                viewer.print_result({"connection": False, "error": str(e)},
+                                    f"Something went wrong with the DB connection, please check your config file\n{e}")
+                exit(1)
+        elif(args.subcommand == "migrate"):
+            applied = db.migrate()
+            viewer.print_result({"applied": applied, "schema_version": db.schema_version()},
+                                f"Applied migrations: {applied}" if applied else "Schema is up to date")
+        elif(args.subcommand == "compact"):
+            nb_bytes = db.compact(full=args.full)
+            viewer.print_result({"nb_bytes_reclaimed": nb_bytes}, f"{nb_bytes} bytes reclaimed")
         else:
             print("Unrecognized subcommand")
             parser.print_help()
@@ -99,41 +158,184 @@ class ABCollectorApp:
 
     def survey(self):
         parser = argparse.ArgumentParser(description='Manage an airbnb survey')
+        parser.add_argument("-s", "--survey_id", action="store",
+                            help="""survey id (aggregate, delete, metrics, normalize, reparse, run_extra, run_hosts, sweep, tiles), or comma separated survey ids (export)""")
+        parser.add_argument("-a", "--search_area_id", action="store", type=int,
+                            help="""search area to survey (run), or to purge, all by default (purge)""")
+        parser.add_argument("-o", "--folder", action="store", default="export",
+                            help="""export folder (aggregate, export, tiles)""")
+        parser.add_argument("--max_requests", action="store", type=int,
+                            help="""stop the survey after this number of requests, 0 for no limit (run)""")
+        parser.add_argument("--max_duration", action="store", type=float,
+                            help="""stop the survey after this number of seconds, 0 for no limit (run)""")
+        parser.add_argument("--target_coverage", action="store", type=float,
+                            help="""stop the survey once this estimated share of the listings is found, 0 for no limit (run)""")
+        parser.add_argument("--max_age", action="store", type=float,
+                            help="""days after which a room page or host profile is fetched again,
+                            fill_max_age or host_max_age by default (run_extra, run_hosts)""")
+        parser.add_argument("--workers", action="store", type=int,
+                            help="""number of processes mapping the archived pages, one per CPU by default (reparse)""")
+        parser.add_argument("--checkin", action="store", type=date.fromisoformat,
+                            help="""first check-in date, YYYY-MM-DD, tomorrow by default (sweep)""")
+        parser.add_argument("--nb_dates", action="store", type=int, default=1,
+                            help="""number of consecutive check-in dates (sweep)""")
+        parser.add_argument("--nights", action="store", type=int, default=1,
+                            help="""nights of each stay (sweep)""")
+        parser.add_argument("--guests", action="store",
+                            help="""comma separated numbers of guests, search_max_guests by default (sweep)""")
+        parser.add_argument("--grid", action="store", choices=["square", "hex"], default="square",
+                            help="""shape of the cells (aggregate)""")
+        parser.add_argument("--cell_size", action="store", type=float, default=500,
+                            help="""side of the cells in meters (aggregate)""")
+        parser.add_argument("--raster", action="store_true", default=False,
+                            help="""write a NumPy raster instead of GeoJSON, square cells only (aggregate)""")
+        parser.add_argument("--min_zoom", action="store", type=int, default=0,
+                            help="""first zoom of the tiles (tiles)""")
+        parser.add_argument("--max_zoom", action="store", type=int, default=14,
+                            help="""last zoom of the tiles, at most 18 (tiles)""")
+        parser.add_argument("--full_zoom", action="store", type=int, default=12,
+                            help="""first zoom showing every room, rooms are clustered below (tiles)""")
+        parser.add_argument("--older_than", action="store", type=float,
+                            help="""purge the surveys older than this number of days, max_age of [RETENTION] by default (purge)""")
+        parser.add_argument("--keep_last", action="store", type=int,
+                            help="""keep this number of latest surveys per search area, keep_last of [RETENTION] by default (purge)""")
+        parser.add_argument("--no_rollup", action="store_true", default=False,
+                            help="""do not keep the aggregates of the purged surveys (purge)""")
         args = self.parse_subcommand_args(parser)
 
-        config = Config(args.config_file)
-        survey_controller = SearchSurveyController(config)
-        survey_viewer = ABSurveyViewer()
-        search_area_viewer = ABSearchAreaViewer()
+        config = self.get_config(args)
+        survey_viewer = ABSurveyViewer(args.format)
+        search_area_viewer = ABSearchAreaViewer(args.format)
+
+        def get_survey_controller():
+            from bnb_kanpora.controllers import SearchSurveyController
+            return SearchSurveyController(config)
 
         if(args.subcommand == "delete"):
-            survey_viewer.print_surveys()
-            survey_id = input("survey_id : ")
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
             question = "Are you sure you want to delete listings for survey {}? [y/N] ".format(survey_id)
-            sys.stdout.write(question)
-            choice = input().lower()
-            if choice != "y":
+            if not self.confirm(args, question):
                 print("Cancelling the request.")
                 return
-            survey_controller.delete(survey_id)
+            deleted = get_survey_controller().delete(survey_id)
+            survey_viewer.print_result({"survey_id": int(survey_id), "deleted": deleted},
+                                       f"Survey {survey_id} deleted")
 
         elif(args.subcommand == "list"):
             survey_viewer.print_surveys()
             
         elif(args.subcommand == "run"):
-            search_area_viewer.print_search_areas()
-            search_area_id = input("search_area_id : ")
+            search_area_id = self.get_value(args.search_area_id, "search_area_id : ", "--search_area_id", search_area_viewer.print_search_areas)
+            survey_controller = get_survey_controller()
             survey_id = survey_controller.add(search_area_id)
-            results = survey_controller.run(survey_id)
+            results = survey_controller.run(survey_id, max_requests=args.max_requests, max_duration=args.max_duration,
+                                            target_coverage=args.target_coverage)
             logger.info(f"Finished survey {survey_id} (search area {search_area_id}) : {results.total_nb_rooms} parsed, {results.total_nb_saved} saved, {results.total_nb_rooms_expected} expected")
+            if results.budget_exhausted or results.target_reached:
+                logger.info(f"Survey {survey_id} stopped early, estimated coverage: {results.coverage}")
+            stats = {"survey_id": survey_id, "search_area_id": int(search_area_id), **results.get_stats()}
+            if args.format != "text":
+                survey_viewer.print_result(stats)
         
         elif(args.subcommand == "run_extra"):
-            print("run extra information search for survey")
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            from bnb_kanpora.controllers import ABListingExtraController
+            extra_controller = ABListingExtraController(config)
+            try:
+                nb_copied, nb_fetched = extra_controller.fill_loop_by_room(int(survey_id), max_age=args.max_age)
+            finally:
+                extra_controller.close()
+            survey_viewer.print_result({"survey_id": int(survey_id), "nb_rooms_copied": nb_copied, "nb_rooms_fetched": nb_fetched},
+                                       f"Survey {survey_id}: {nb_copied} rooms filled from cached pages, {nb_fetched} pages fetched")
         
+        elif(args.subcommand == "run_hosts"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            from bnb_kanpora.controllers import HostController
+            host_controller = HostController(config)
+            try:
+                nb_hosts, nb_fetched = host_controller.fill_hosts(int(survey_id), max_age=args.max_age)
+            finally:
+                host_controller.close()
+            survey_viewer.print_result({"survey_id": int(survey_id), "nb_hosts": nb_hosts, "nb_hosts_fetched": nb_fetched},
+                                       f"Survey {survey_id}: {nb_hosts} hosts, {nb_fetched} profiles fetched")
+
+        elif(args.subcommand == "sweep"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            try:
+                stays = stay_dates(args.checkin or date.today() + timedelta(days=1), args.nb_dates, args.nights)
+                guests = [int(nb_guests) for nb_guests in args.guests.split(",")] if args.guests else None
+                sweeps = get_survey_controller().sweep(int(survey_id), stays, guests)
+            except ValueError as e:
+                logger.error(str(e))
+                exit(2)
+            survey_viewer.print_result({"survey_id": int(survey_id), "sweeps": sweeps}, "\n".join(
+                f"{s['checkin']} to {s['checkout']}, {s['guests']} guests: {s['nb_available']} rooms available, "
+                f"estimated occupancy {s['occupancy']}" for s in sweeps))
+
+        elif(args.subcommand == "metrics"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            survey_viewer.print_rows(get_survey_controller().get_metrics(survey_id))
+
+        elif(args.subcommand == "reparse"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            if not config.ARCHIVE_FOLDER:
+                logger.error("No archive folder in the [ARCHIVE] section of the configuration")
+                exit(1)
+            from bnb_kanpora.controllers import ABListingExtraController, HostController
+            nb_updated = get_survey_controller().reparse(int(survey_id), max_workers=args.workers)
+            nb_room_pages = ABListingExtraController(config).reparse(int(survey_id))
+            nb_host_pages = HostController(config).reparse(int(survey_id))
+            survey_viewer.print_result({"survey_id": int(survey_id), "nb_rooms_updated": nb_updated,
+                                        "nb_room_pages": nb_room_pages, "nb_host_pages": nb_host_pages},
+                                       f"Survey {survey_id}: {nb_updated} rooms updated, "
+                                       f"{nb_room_pages} room pages and {nb_host_pages} host pages mapped")
+
+        elif(args.subcommand == "purge"):
+            from bnb_kanpora.controllers import RetentionController
+            retention = RetentionController(config)
+            survey_ids = retention.expired(args.search_area_id, max_age=args.older_than, keep_last=args.keep_last)
+            if not survey_ids:
+                survey_viewer.print_result({"survey_ids": []}, "No survey to purge")
+                return
+            question = f"Are you sure you want to delete surveys {', '.join(map(str, survey_ids))}? [y/N] "
+            if not self.confirm(args, question):
+                print("Cancelling the request.")
+                return
+            result = retention.purge(survey_ids, rollup=False if args.no_rollup else None)
+            survey_viewer.print_result(result, f"Surveys {', '.join(map(str, survey_ids))} purged: {result['nb_rooms']} rooms, "
+                                               f"{result['nb_listings']} listings, {result['nb_bytes_reclaimed']} bytes reclaimed")
+
+        elif(args.subcommand == "normalize"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            nb_rooms, nb_listings = get_survey_controller().normalize(int(survey_id))
+            survey_viewer.print_result({"survey_id": int(survey_id), "nb_rooms": nb_rooms, "nb_new_listings": nb_listings},
+                                       f"Survey {survey_id}: {nb_rooms} rooms normalized, {nb_listings} new listings")
+
+        elif(args.subcommand == "aggregate"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            try:
+                path = get_survey_controller().aggregate(int(survey_id), kind=args.grid, cell_size=args.cell_size,
+                                                         folder=args.folder, raster=args.raster)
+            except ValueError as e:
+                logger.error(str(e))
+                exit(2)
+            survey_viewer.print_result({"survey_id": int(survey_id), "path": path}, f"Aggregated to {path}")
+
+        elif(args.subcommand == "tiles"):
+            survey_id = self.get_value(args.survey_id, "survey_id : ", "--survey_id", survey_viewer.print_surveys)
+            try:
+                path = get_survey_controller().export_tiles(int(survey_id), folder=args.folder, min_zoom=args.min_zoom,
+                                                            max_zoom=args.max_zoom, full_zoom=args.full_zoom)
+            except ValueError as e:
+                logger.error(str(e))
+                exit(2)
+            survey_viewer.print_result({"survey_id": int(survey_id), "path": path}, f"Tiles written to {path}")
+
         elif(args.subcommand == "export"):
-            survey_viewer.print_surveys()
-            survey_id = input("survey_ids (separated by ',') : ")
-            survey_controller.export(survey_id.split(','))
+            survey_id = self.get_value(args.survey_id, "survey_ids (separated by ',') : ", "--survey_id", survey_viewer.print_surveys)
+            path = get_survey_controller().export(survey_id.split(','), folder=args.folder)
+            survey_viewer.print_result({"survey_ids": [int(s) for s in survey_id.split(',')], "path": path},
+                                       f"Exported to {path}")
         else:
             print("Unrecognized subcommand")
             parser.print_help()
@@ -142,17 +344,28 @@ class ABCollectorApp:
     def search_area(self):
         parser = argparse.ArgumentParser(
             description='Manage an airbnb search area')
+        parser.add_argument("-n", "--name", action="store",
+                            help="""search area name (add)""")
+        parser.add_argument("-b", "--bbox", action="store",
+                            help="""south,west,north,east coordinates (add), as found after # in bboxfinder.com URLs""")
+        parser.add_argument("-p", "--polygon", action="store",
+                            help="""GeoJSON or WKT file of the search area boundary (add),
+                            listings outside of it are not searched""")
+        parser.add_argument("-a", "--search_area_id", action="store", type=int,
+                            help="""search area id (delete)""")
         args = self.parse_subcommand_args(parser)
 
-        config = Config(args.config_file)
-        sac = SearchAreaController(config)
-        search_area_viewer = ABSearchAreaViewer()
+        config = self.get_config(args)
+        search_area_viewer = ABSearchAreaViewer(args.format)
+
+        def get_search_area_controller():
+            from bnb_kanpora.controllers import SearchAreaController
+            return SearchAreaController(config)
 
         if(args.subcommand == "add"):
-            name = input("search area name: ")
+            name = self.get_value(args.name, "search area name: ", "--name")
 
-            def get_box_coordinates():
-                box_str = input("south, west, north, east (copy-paste coordinates after # in URL from http://bboxfinder.com): ")
+            def parse_box_coordinates(box_str):
                 try:
                     arr = [float(s) for s in box_str.split(',')]
                     if(len(arr) != 4):
@@ -160,25 +373,83 @@ class ABCollectorApp:
                     return tuple(arr)
                 except:
                     return 0,0,0,0
-            
-            s_lat, w_lng, n_lat, e_lng = get_box_coordinates()
+
+            def get_box_coordinates():
+                return parse_box_coordinates(self.get_value(None, "south, west, north, east (copy-paste coordinates after # in URL from http://bboxfinder.com): ", "--bbox"))
+
+            polygon = None
+            if args.polygon:
+                from bnb_kanpora.polygon import SearchPolygon
+                try:
+                    polygon = SearchPolygon.load(args.polygon)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Invalid polygon {args.polygon}: {e}")
+                    exit(2)
+                if not args.bbox:
+                    bounds = polygon.bounds
+                    args.bbox = f"{bounds.s_lat},{bounds.w_lng},{bounds.n_lat},{bounds.e_lng}"
+
+            s_lat, w_lng, n_lat, e_lng = parse_box_coordinates(args.bbox) if args.bbox else get_box_coordinates()
             while not(e_lng > w_lng and n_lat > s_lat):
                 print("Validation failed for the following rule : west_lng > east_lng and north_lat  > south_lat")
+                if args.bbox:
+                    exit(2)
                 s_lat, w_lng, n_lat, e_lng  = get_box_coordinates()
 
-            sac.add(name, GeoBox(s_lat=s_lat, w_lng=w_lng, n_lat=n_lat, e_lng=e_lng))
+            search_area_id = get_search_area_controller().add(name, GeoBox(s_lat=s_lat, w_lng=w_lng, n_lat=n_lat, e_lng=e_lng), polygon)
+            search_area_viewer.print_result({"search_area_id": search_area_id, "name": name},
+                                            f"Search area {search_area_id} created")
         elif(args.subcommand == "list"):
             search_area_viewer.print_search_areas()
         elif(args.subcommand == "delete"):
-            search_area_viewer.print_search_areas()
-            search_area_id = input("search area id to delete: ")
-            sac.delete(search_area_id)
+            search_area_id = self.get_value(args.search_area_id, "search area id to delete: ", "--search_area_id", search_area_viewer.print_search_areas)
+            if not self.confirm(args, f"Are you sure you want to delete search area {search_area_id}? [y/N] "):
+                print("Cancelling the request.")
+                return
+            get_search_area_controller().delete(search_area_id)
+            search_area_viewer.print_result({"search_area_id": int(search_area_id), "deleted": True},
+                                            f"Search area {search_area_id} deleted")
 
         else:
             print("Unrecognized subcommand")
             parser.print_help() 
             exit(1)
 
+    def room(self):
+        parser = argparse.ArgumentParser(
+            description='Query the rooms of the surveys')
+        parser.add_argument("-q", "--query", action="store",
+                            help="""full-text query: words, "phrases", prefix*, AND / OR / NOT (search)""")
+        parser.add_argument("-s", "--survey_id", action="store",
+                            help="""comma separated survey ids, all by default (search)""")
+        parser.add_argument("-a", "--search_area_id", action="store", type=int,
+                            help="""only the surveys of this search area (search)""")
+        parser.add_argument("--field", action="store", choices=["name", "address", "license"],
+                            help="""only search this field (search)""")
+        parser.add_argument("--limit", action="store", type=int, default=100,
+                            help="""maximum number of rooms, 0 for all (search)""")
+        args = self.parse_subcommand_args(parser)
+
+        config = self.get_config(args)
+        room_viewer = ABRoomViewer(args.format)
+
+        if(args.subcommand == "search"):
+            from bnb_kanpora.controllers import RoomController
+            import peewee
+            query = self.get_value(args.query, "query : ", "--query")
+            survey_ids = args.survey_id.split(',') if args.survey_id else None
+            try:
+                rooms = RoomController(config).search(query, survey_ids=survey_ids, search_area_id=args.search_area_id,
+                                                      field=args.field, limit=args.limit)
+            except (RuntimeError, peewee.OperationalError) as e:
+                logger.error(f"Search failed: {e}")
+                exit(2)
+            room_viewer.print_rows(rooms)
+        else:
+            print("Unrecognized subcommand")
+            parser.print_help()
+            exit(1)
+
 
 if __name__ == "__main__":
     logging.basicConfig(format='%(levelname)-8s%(message)s')
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+# ============================================================================
+# Spatial aggregation of the rooms of a survey: rooms are read from the
+# database in chunks of NumPy arrays, binned into square or hexagonal cells
+# of a local metric grid, and each cell gets its number of rooms, median
+# rate and share of each room type, written as GeoJSON or as a raster
+# ============================================================================
+import json
+import logging
+import numpy as np
+from abc import ABC, abstractmethod
+from bnb_kanpora.models import SurveyRoomModel
+from bnb_kanpora.utils import GeoBox
+
+logger = logging.getLogger()
+
+AGGREGATION_CHUNK_SIZE = 50000
+# meters per degree of latitude, on the mean Earth radius
+METERS_PER_DEGREE = 6371008.8 * np.pi / 180
+SQUARE = "square"
+HEX = "hex"
+SQRT3 = np.sqrt(3)
+
+
+class SpatialGrid(ABC):
+    """Regular grid over a box, in meters from its south west corner
+
+    The equirectangular projection keeps cells within a few per mille of
+    their nominal size over a city.
+
+    Attributes:
+    ---
+        box:GeoBox
+        cell_size:float
+            Side of the cells, in meters
+
+    Methods:
+    ---
+        cell_keys(lats, lngs) -> np.ndarray
+            int64 key of the cell of each point
+        cell_polygons(keys) -> np.ndarray
+            (n, corners, 2) array of the (lng, lat) corners of each cell
+    """
+    kind = None
+
+    def __init__(self, box:GeoBox, cell_size:float) -> None:
+        if cell_size <= 0:
+            raise ValueError("The cell size must be positive")
+        self.box = box
+        self.cell_size = float(cell_size)
+        self._lng_scale = METERS_PER_DEGREE * np.cos(np.radians((box.n_lat + box.s_lat) / 2))
+
+    def to_meters(self, lats, lngs) -> tuple:
+        x = (np.asarray(lngs, dtype=np.float64) - self.box.w_lng) * self._lng_scale
+        y = (np.asarray(lats, dtype=np.float64) - self.box.s_lat) * METERS_PER_DEGREE
+        return x, y
+
+    def to_degrees(self, x, y) -> tuple:
+        return self.box.s_lat + y / METERS_PER_DEGREE, self.box.w_lng + x / self._lng_scale
+
+    @abstractmethod
+    def cell_keys(self, lats, lngs) -> np.ndarray:
+        raise NotImplementedError
+
+    @abstractmethod
+    def cell_polygons(self, keys) -> np.ndarray:
+        raise NotImplementedError
+
+    @staticmethod
+    def create(kind:str, box:GeoBox, cell_size:float) -> 'SpatialGrid':
+        grids = {SQUARE: SquareGrid, HEX: HexGrid}
+        if kind not in grids:
+            raise ValueError(f"Unknown grid {kind}, expected one of {', '.join(grids)}")
+        return grids[kind](box, cell_size)
+
+
+class SquareGrid(SpatialGrid):
+    """Square cells, keyed by row * nb_cols + col: the grid is also a raster"""
+    kind = SQUARE
+
+    def __init__(self, box:GeoBox, cell_size:float) -> None:
+        super().__init__(box, cell_size)
+        width, height = self.to_meters(box.n_lat, box.e_lng)
+        self.nb_cols = max(1, int(np.ceil(width / self.cell_size)))
+        self.nb_rows = max(1, int(np.ceil(height / self.cell_size)))
+
+    def cell_keys(self, lats, lngs) -> np.ndarray:
+        x, y = self.to_meters(lats, lngs)
+        cols = np.clip(np.floor(x / self.cell_size), 0, self.nb_cols - 1).astype(np.int64)
+        rows = np.clip(np.floor(y / self.cell_size), 0, self.nb_rows - 1).astype(np.int64)
+        return rows * self.nb_cols + cols
+
+    def cell_polygons(self, keys) -> np.ndarray:
+        rows, cols = np.divmod(np.asarray(keys, dtype=np.int64), self.nb_cols)
+        # counterclockwise from the south west corner, closed
+        dx = np.array([0, 1, 1, 0, 0])
+        dy = np.array([0, 0, 1, 1, 0])
+        x = (cols[:, None] + dx) * self.cell_size
+        y = (rows[:, None] + dy) * self.cell_size
+        lats, lngs = self.to_degrees(x, y)
+        return np.stack([lngs, lats], axis=-1)
+
+
+class HexGrid(SpatialGrid):
+    """Pointy top hexagons of side cell_size, keyed by their axial
+    coordinates (q, r) as q << 32 | r, like the cells of H3 on a plane"""
+    kind = HEX
+    # axial coordinates are offset to be positive in 32 bits
+    _OFFSET = 1 << 20
+
+    def cell_keys(self, lats, lngs) -> np.ndarray:
+        x, y = self.to_meters(lats, lngs)
+        q = (SQRT3 / 3 * x - y / 3) / self.cell_size
+        r = 2 / 3 * y / self.cell_size
+        # round the cube coordinates (q, r, -q-r), fixing the one rounded the most
+        s = -q - r
+        rq, rr, rs = np.round(q), np.round(r), np.round(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        return (rq.astype(np.int64) + self._OFFSET) << 32 | (rr.astype(np.int64) + self._OFFSET)
+
+    def axial(self, keys) -> tuple:
+        keys = np.asarray(keys, dtype=np.int64)
+        return (keys >> 32) - self._OFFSET, (keys & 0xFFFFFFFF) - self._OFFSET
+
+    def cell_polygons(self, keys) -> np.ndarray:
+        q, r = self.axial(keys)
+        cx = self.cell_size * SQRT3 * (q + r / 2)
+        cy = self.cell_size * 1.5 * r
+        angles = np.radians(30 + 60 * np.arange(7))
+        x = cx[:, None] + self.cell_size * np.cos(angles)
+        y = cy[:, None] + self.cell_size * np.sin(angles)
+        lats, lngs = self.to_degrees(x, y)
+        return np.stack([lngs, lats], axis=-1)
+
+
+class GridAggregate():
+    """Rooms per cell of a grid, for the non empty cells
+
+    Attributes:
+    ---
+        grid:SpatialGrid
+        keys:np.ndarray
+            Cell keys, sorted
+        counts:np.ndarray
+            Rooms per cell
+        median_rates:np.ndarray
+            Median rate of the rooms with a rate, NaN for none
+        room_types:list[str]
+        room_type_shares:np.ndarray
+            (cells, room types) share of the rooms of each type
+
+    Methods:
+    ---
+        to_geojson() -> dict
+        write_geojson(path:str)
+        write_raster(path:str)
+    """
+    def __init__(self, grid:SpatialGrid, keys, counts, median_rates, room_types:list, room_type_shares) -> None:
+        self.grid = grid
+        self.keys = keys
+        self.counts = counts
+        self.median_rates = median_rates
+        self.room_types = room_types
+        self.room_type_shares = room_type_shares
+
+    def to_geojson(self) -> dict:
+        polygons = np.round(self.grid.cell_polygons(self.keys), 6).tolist()
+        features = []
+        for i, polygon in enumerate(polygons):
+            median_rate = self.median_rates[i]
+            properties = {
+                "cell": int(self.keys[i]),
+                "count": int(self.counts[i]),
+                "median_rate": None if np.isnan(median_rate) else round(float(median_rate), 2),
+            }
+            properties.update((f"share {room_type}", round(float(share), 4))
+                              for room_type, share in zip(self.room_types, self.room_type_shares[i]))
+            features.append({"type": "Feature", "properties": properties,
+                             "geometry": {"type": "Polygon", "coordinates": [polygon]}})
+        return {"type": "FeatureCollection", "features": features}
+
+    def write_geojson(self, path:str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_geojson(), f, separators=(",", ":"))
+
+    def write_raster(self, path:str) -> None:
+        """Compressed NumPy archive of (rows, cols) count, median_rate and
+        share arrays, row 0 at the south, with the bounds of the grid"""
+        if not isinstance(self.grid, SquareGrid):
+            raise ValueError("Only square grids can be written as a raster")
+        shape = (self.grid.nb_rows, self.grid.nb_cols)
+        count = np.zeros(shape, dtype=np.int32)
+        median_rate = np.full(shape, np.nan, dtype=np.float32)
+        shares = np.zeros((len(self.room_types),) + shape, dtype=np.float32)
+        rows, cols = np.divmod(self.keys, self.grid.nb_cols)
+        count[rows, cols] = self.counts
+        median_rate[rows, cols] = self.median_rates
+        shares[:, rows, cols] = self.room_type_shares.T
+        box = self.grid.box
+        s_lat, w_lng = box.s_lat, box.w_lng
+        n_lat, e_lng = self.grid.to_degrees(self.grid.nb_cols * self.grid.cell_size, self.grid.nb_rows * self.grid.cell_size)
+        np.savez_compressed(path, count=count, median_rate=median_rate, room_type_shares=shares,
+                            room_types=np.array(self.room_types), cell_size=self.grid.cell_size,
+                            bounds=np.array([n_lat, e_lng, s_lat, w_lng]))
+
+
+# (column, dtype) of the arrays read by iter_room_chunks, a NULL becomes NaN in float columns
+AGGREGATION_COLUMNS = (("latitude", np.float64), ("longitude", np.float64), ("rate", np.float64), ("room_type", str))
+
+
+def iter_room_chunks(survey_id:int, columns:tuple=AGGREGATION_COLUMNS, chunk_size:int=AGGREGATION_CHUNK_SIZE):
+    """Arrays of the columns of the rooms of a survey, chunk_size rooms at a time"""
+    room = SurveyRoomModel
+    query = (room
+        .select(*[getattr(room, name) for name, _ in columns])
+        .where(room.survey_id == survey_id)
+        .tuples())
+    rows = []
+    for row in query.iterator():
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield _to_arrays(rows, columns)
+            rows = []
+    if rows:
+        yield _to_arrays(rows, columns)
+
+
+def _to_arrays(rows:list, columns:tuple) -> tuple:
+    return tuple(np.array(values, dtype=dtype) for values, (_, dtype) in zip(zip(*rows), columns))
+
+
+def aggregate(grid:SpatialGrid, chunks) -> GridAggregate:
+    """Aggregate (lats, lngs, rates, room_types) chunks by cell of grid.
+    Each chunk is reduced to its cell keys and type codes before the next
+    one is read."""
+    keys, rates, codes = [], [], []
+    room_types = {}
+    for lats, lngs, chunk_rates, chunk_types in chunks:
+        keys.append(grid.cell_keys(lats, lngs))
+        rates.append(chunk_rates.astype(np.float64))
+        chunk_room_types, chunk_codes = np.unique(chunk_types, return_inverse=True)
+        global_codes = np.array([room_types.setdefault(t, len(room_types)) for t in chunk_room_types], dtype=np.int64)
+        codes.append(global_codes[chunk_codes])
+    if not keys:
+        return GridAggregate(grid, np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0), [], np.zeros((0, 0)))
+    keys, rates, codes = np.concatenate(keys), np.concatenate(rates), np.concatenate(codes)
+
+    cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+    # median: sort the rates by cell then value, and pick the middle of each run
+    with_rate = ~np.isnan(rates)
+    order = np.lexsort((rates[with_rate], inverse[with_rate]))
+    sorted_rates = rates[with_rate][order]
+    nb_rates = np.bincount(inverse[with_rate], minlength=len(cells))
+    starts = np.concatenate(([0], np.cumsum(nb_rates)[:-1]))
+    median_rates = np.full(len(cells), np.nan)
+    has_rate = nb_rates > 0
+    low = starts[has_rate] + (nb_rates[has_rate] - 1) // 2
+    high = starts[has_rate] + nb_rates[has_rate] // 2
+    median_rates[has_rate] = (sorted_rates[low] + sorted_rates[high]) / 2
+
+    nb_types = len(room_types)
+    type_counts = np.bincount(inverse * nb_types + codes, minlength=len(cells) * nb_types).reshape(len(cells), nb_types)
+    shares = type_counts / counts[:, None]
+    return GridAggregate(grid, cells, counts, median_rates, list(room_types), shares)
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# ============================================================================
+# Archive of the raw responses of a survey: every explore_tabs, room and host
+# page is appended as an independent zstd frame to append-only segment
+# files, and indexed by kind, key (node, room or host id) and page, so that the
+# field mapping can be run again over a survey without crawling it again
+# ============================================================================
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from bnb_kanpora.decoding import decode_explore_tabs
+from bnb_kanpora.records import RoomRecord
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger()
+
+SEARCH_PAGE = "search"
+ROOM_PAGE = "room"
+HOST_PAGE = "host"
+INDEX_FILE = "index.ndjson"
+SEGMENT_SUFFIX = ".zst"
+
+
+def archive_path(folder:str, survey_id:int) -> str:
+    return os.path.join(folder, f"survey-{survey_id}")
+
+
+class ArchiveEntry():
+    """Location of a response in the segments of an archive"""
+    __slots__ = ("kind", "key", "page", "segment", "offset", "length", "fetched_at")
+
+    def __init__(self, kind:str, key:str, page:int, segment:int, offset:int, length:int, fetched_at:float) -> None:
+        self.kind = kind
+        self.key = key
+        self.page = page
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.fetched_at = fetched_at
+
+    def to_json(self) -> str:
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+    @classmethod
+    def from_json(cls, line:str) -> 'ArchiveEntry':
+        return cls(**json.loads(line))
+
+
+class RawArchive():
+    """Append-only archive of the raw responses of a survey, in folder/survey-<survey_id>
+
+    A segment is closed when it reaches segment_size bytes, and an archive
+    opened again appends to a new segment: written segments never change.
+
+    Attributes:
+    ---
+        path:str
+        segment_size:int
+            Bytes of compressed responses per segment file
+        level:int
+            zstd compression level
+
+    Methods:
+    ---
+        append(kind:str, key, body:bytes, page:int=0) -> ArchiveEntry
+        entries(kind:str=None) -> list[ArchiveEntry]
+        read(entry:ArchiveEntry) -> bytes
+        close()
+    """
+    def __init__(self, folder:str, survey_id:int, segment_size:int=64 * 1024 * 1024, level:int=3) -> None:
+        if zstandard is None:
+            raise RuntimeError("The response archive needs the zstandard package")
+        self.path = archive_path(folder, survey_id)
+        self.segment_size = segment_size
+        self.level = level
+        self._lock = threading.Lock()
+        # compressors are not thread safe
+        self._local = threading.local()
+        self._segment = None
+        self._segment_file = None
+        self._index_file = None
+
+    def segment_path(self, segment:int) -> str:
+        return os.path.join(self.path, f"{segment:05d}{SEGMENT_SUFFIX}")
+
+    def _next_segment(self) -> int:
+        segments = [int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX)]
+        return max(segments) + 1 if segments else 0
+
+    def _open_segment(self) -> None:
+        if self._segment_file is not None:
+            self._segment_file.close()
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self._index_file = open(os.path.join(self.path, INDEX_FILE), "a")
+        self._segment = self._next_segment()
+        self._segment_file = open(self.segment_path(self._segment), "ab")
+
+    def append(self, kind:str, key, body:bytes, page:int=0) -> ArchiveEntry:
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        frame = compressor.compress(body)
+        with self._lock:
+            if self._segment_file is None or (
+                    self._segment_file.tell() and self._segment_file.tell() + len(frame) > self.segment_size):
+                self._open_segment()
+            entry = ArchiveEntry(kind, str(key), page, self._segment, self._segment_file.tell(), len(frame), time.time())
+            self._segment_file.write(frame)
+            # the index only points to written frames
+            self._segment_file.flush()
+            self._index_file.write(entry.to_json() + "\n")
+            self._index_file.flush()
+        return entry
+
+    def entries(self, kind:str=None) -> list:
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.isfile(index_path):
+            return []
+        with open(index_path) as f:
+            entries = [ArchiveEntry.from_json(line) for line in f if line.strip()]
+        return [entry for entry in entries if kind is None or entry.kind == kind]
+
+    def read(self, entry:ArchiveEntry) -> bytes:
+        with open(self.segment_path(entry.segment), "rb") as f:
+            f.seek(entry.offset)
+            return zstandard.ZstdDecompressor().decompress(f.read(entry.length))
+
+    def close(self) -> None:
+        with self._lock:
+            for f in (self._segment_file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._segment_file = self._index_file = None
+
+
+def _map_segment(path:str, entries:list, survey_id:int) -> list:
+    """Room rows of the search pages of a segment, run in a worker process"""
+    decompressor = zstandard.ZstdDecompressor()
+    rows = []
+    with open(path, "rb") as f:
+        for offset, length in entries:
+            f.seek(offset)
+            try:
+                _, listings = decode_explore_tabs(decompressor.decompress(f.read(length)))
+            except (KeyError, ValueError, zstandard.ZstdError) as e:
+                logger.warning(f"Unreadable search page at {path}:{offset}: {e}")
+                continue
+            rows.extend(RoomRecord.from_search_result(listing).to_row(survey_id) for listing in listings or [])
+    return rows
+
+
+def reparse_search_pages(archive:RawArchive, survey_id:int, max_workers:int=None) -> list:
+    """Map the archived search pages of a survey to room rows again, one
+    segment per task of a process pool. A room found in several pages keeps
+    the row of its latest page."""
+    by_segment = {}
+    for entry in sorted(archive.entries(SEARCH_PAGE), key=lambda e: e.fetched_at):
+        by_segment.setdefault(entry.segment, []).append((entry.offset, entry.length))
+    rows = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_map_segment, archive.segment_path(segment), entries, survey_id)
+                   for segment, entries in sorted(by_segment.items())]
+        for future in futures:
+            for row in future.result():
+                if row['room_id'] is not None:
+                    rows[row['room_id']] = row
+    return list(rows.values())
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+# ============================================================================
+# Storage backends: build the peewee database from the [DATABASE] section
+# and bulk load rooms with the fastest path each engine offers
+# ============================================================================
+import io
+import logging
+from abc import ABC, abstractmethod
+from peewee import chunked
+from playhouse.sqlite_ext import SqliteExtDatabase
+from bnb_kanpora.models import RoomModel
+
+logger = logging.getLogger()
+
+SQLITE_INSERT_BATCH_SIZE = 500
+UPDATE_BATCH_SIZE = 500
+
+
+class DatabaseBackend(ABC):
+    """Base class for a storage engine
+
+    Attributes:
+    ---
+        settings: configparser.SectionProxy | dict
+            [DATABASE] section of the configuration file
+
+    Methods:
+    ---
+        create_database() -> peewee.Database
+        bulk_insert_rooms(database, rows:list[dict]) -> int
+        bulk_update_rooms(database, rows:list[dict]) -> int
+        compact(database, full:bool=False) -> int
+    """
+    engine = None
+
+    def __init__(self, settings) -> None:
+        self.settings = settings
+        self.db_name = settings["db_name"]
+
+    @property
+    @abstractmethod
+    def url(self) -> str:
+        """Database URL, as understood by playhouse.db_url"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_database(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk_insert_rooms(self, database, rows:list) -> int:
+        """Insert room rows, skipping rooms already saved for the survey.
+
+        Returns the number of rows actually inserted.
+        """
+        raise NotImplementedError
+
+    def bulk_update_rooms(self, database, rows:list) -> int:
+        """Update the columns of rooms already saved for their survey with
+        the values of rows, rows of other rooms are skipped.
+
+        Returns the number of rooms updated.
+        """
+        rows = self._complete_rows(rows)
+        saved = set()
+        for survey_id in set(row['survey_id'] for row in rows):
+            saved.update((str(survey_id), room_id) for (room_id,) in
+                         RoomModel.select(RoomModel.room_id).where(RoomModel.survey_id == survey_id).tuples())
+        rows = [row for row in rows if (str(row['survey_id']), row['room_id']) in saved]
+        if not rows:
+            return 0
+        keys = (RoomModel.survey_id.name, RoomModel.room_id.name)
+        columns = [RoomModel._meta.fields[name] for name in rows[0] if name not in keys]
+        with database.atomic():
+            for batch in chunked(rows, UPDATE_BATCH_SIZE):
+                (RoomModel.insert_many(batch)
+                    .on_conflict(conflict_target=[RoomModel.survey_id, RoomModel.room_id], preserve=columns)
+                    .execute())
+        return len(rows)
+
+    @abstractmethod
+    def compact(self, database, full:bool=False) -> int:
+        """Give the space of deleted rows back, after a purge.
+
+        Returns the number of bytes the database file shrank, when known.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _complete_rows(rows:list) -> list:
+        """Keep the room columns of each row and drop the rows missing a
+        mandatory column, they would fail the whole batch"""
+        fields = RoomModel._meta.fields
+        required = [f.name for f in RoomModel._meta.sorted_fields if not f.null and f.default is None]
+        rows = [{k: v for k, v in row.items() if k in fields} for row in rows]
+        complete = [row for row in rows if all(row.get(name) is not None for name in required)]
+        if len(complete) < len(rows):
+            logger.info(f"{len(rows) - len(complete)} rooms with missing mandatory fields not saved")
+        return complete
+
+
+class SqliteBackend(DatabaseBackend):
+    """Single file SQLite database in WAL mode (default)"""
+    engine = "sqlite"
+
+    @property
+    def url(self) -> str:
+        return f'sqlite:///{self.db_name}.db'
+
+    def create_database(self):
+        return SqliteExtDatabase(f'{self.db_name}.db', pragmas=(
+            # only applies to new databases, before journal_mode: see compact
+            ('auto_vacuum', 'incremental'),
+            ('cache_size', -1024 * 64),  # 64MB page-cache.
+            ('journal_mode', 'wal'),  # Use WAL-mode (you should always use this!).
+            ('foreign_keys', 1)) # Enforce foreign-key constraints.
+        )
+
+    def bulk_insert_rooms(self, database, rows:list) -> int:
+        rows = self._complete_rows(rows)
+        if not rows:
+            return 0
+        nb_inserted = 0
+        with database.atomic():
+            for batch in chunked(rows, SQLITE_INSERT_BATCH_SIZE):
+                # the rows changed by the statement, not by its triggers
+                nb_inserted += database.execute(RoomModel.insert_many(batch).on_conflict_ignore()).rowcount
+        return nb_inserted
+
+    def compact(self, database, full:bool=False) -> int:
+        """Release the free pages with an incremental vacuum and truncate the
+        WAL file. A full VACUUM rewrites the whole file, and is needed once
+        to enable incremental vacuum on databases created without it."""
+        page_size = database.pragma('page_size')
+        pages_before = database.pragma('page_count')
+        if full:
+            database.pragma('auto_vacuum', 'incremental')
+            database.execute_sql('VACUUM')
+        elif database.pragma('auto_vacuum') == 2:
+            # a cursor steps the statement once, freeing a single page
+            database.connection().executescript('PRAGMA incremental_vacuum')
+        else:
+            logger.warning("Incremental vacuum is not enabled on this database, run a full compaction once")
+        database.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        return (pages_before - database.pragma('page_count')) * page_size
+
+
+class PostgresqlBackend(DatabaseBackend):
+    """PostgreSQL database with pooled connections and COPY based bulk loading.
+
+    Several crawler processes can write to the same database concurrently.
+    """
+    engine = "postgresql"
+
+    def __init__(self, settings) -> None:
+        super().__init__(settings)
+        self.host = settings.get("host", "localhost")
+        self.port = int(settings.get("port", 5432))
+        self.user = settings.get("user")
+        self.password = settings.get("password")
+        self.max_connections = int(settings.get("max_connections", 8))
+        self.stale_timeout = int(settings.get("stale_timeout", 300))
+
+    @property
+    def url(self) -> str:
+        credentials = f'{self.user}:{self.password}@' if self.password else (f'{self.user}@' if self.user else '')
+        return f'postgresql://{credentials}{self.host}:{self.port}/{self.db_name}'
+
+    def create_database(self):
+        from playhouse.pool import PooledPostgresqlExtDatabase
+        return PooledPostgresqlExtDatabase(
+            self.db_name,
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            max_connections=self.max_connections,
+            stale_timeout=self.stale_timeout,
+            register_hstore=False,
+        )
+
+    @staticmethod
+    def _copy_value(value) -> str:
+        """Encode a value for COPY ... FROM STDIN in text format"""
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        return (str(value)
+                .replace('\\', '\\\\')
+                .replace('\t', '\\t')
+                .replace('\n', '\\n')
+                .replace('\r', '\\r'))
+
+    def bulk_insert_rooms(self, database, rows:list) -> int:
+        rows = self._complete_rows(rows)
+        if not rows:
+            return 0
+        # every row gets the model defaults so that all columns are copied
+        fields = [f for f in RoomModel._meta.sorted_fields]
+        columns = ", ".join(f'"{f.column_name}"' for f in fields)
+        buffer = io.StringIO()
+        for row in rows:
+            values = []
+            for field in fields:
+                value = row.get(field.name, row.get(field.column_name))
+                if value is None and field.default is not None:
+                    value = field.default() if callable(field.default) else field.default
+                values.append(self._copy_value(field.db_value(value)))
+            buffer.write("\t".join(values) + "\n")
+        buffer.seek(0)
+
+        table = RoomModel._meta.table_name
+        with database.atomic():
+            cursor = database.cursor()
+            cursor.execute(f'CREATE TEMP TABLE "{table}_copy" (LIKE "{table}" INCLUDING DEFAULTS) ON COMMIT DROP')
+            cursor.copy_expert(f'COPY "{table}_copy" ({columns}) FROM STDIN', buffer)
+            cursor.execute(f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{table}_copy" ON CONFLICT DO NOTHING')
+            return cursor.rowcount
+
+    def compact(self, database, full:bool=False) -> int:
+        """VACUUM ANALYZE, or VACUUM FULL which locks the tables while it rewrites them"""
+        if database.in_transaction():
+            raise ValueError("The database cannot be compacted inside a transaction")
+        size = "SELECT pg_database_size(current_database())"
+        connection = database.connection()
+        # VACUUM cannot run in a transaction block, and psycopg2 opens one
+        # for every statement unless the connection is in autocommit
+        connection.commit()
+        autocommit = connection.autocommit
+        connection.autocommit = True
+        try:
+            size_before = database.execute_sql(size).fetchone()[0]
+            database.execute_sql('VACUUM FULL ANALYZE' if full else 'VACUUM ANALYZE')
+            return size_before - database.execute_sql(size).fetchone()[0]
+        finally:
+            connection.autocommit = autocommit
+
+
+BACKENDS = {
+    SqliteBackend.engine: SqliteBackend,
+    PostgresqlBackend.engine: PostgresqlBackend,
+}
+
+
+def get_backend(settings) -> DatabaseBackend:
+    engine = settings.get("engine", SqliteBackend.engine).strip().lower()
+    if engine not in BACKENDS:
+        raise ValueError(f"Unknown database engine {engine}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[engine](settings)
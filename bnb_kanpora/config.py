@@ -6,10 +6,12 @@ import logging
 import os
 import configparser
 import sys
-from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel, SurveyProgressModel
-from playhouse.sqlite_ext import SqliteExtDatabase
+from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel, SurveyProgressModel, MetricModel, SchemaVersionModel, RoomPageModel, HostModel, ListingModel, ObservationModel, SurveyRoomModel, SurveyRollupModel, RoomSearchModel, AvailabilityModel
+from bnb_kanpora.backends import get_backend
 
-MODELS = [RoomModel, SurveyModel, SearchAreaModel, SurveyProgressModel]
+MODELS = [RoomModel, SurveyModel, SearchAreaModel, SurveyProgressModel, MetricModel, SchemaVersionModel, RoomPageModel, HostModel, ListingModel, ObservationModel, SurveyRollupModel, AvailabilityModel]
+# models of views and indexes, created by storage.create_views and fulltext.create_index
+VIEW_MODELS = [SurveyRoomModel, RoomSearchModel]
 
 logger = logging.getLogger()
 
@@ -30,6 +32,16 @@ class Config():
         self.AWS_KEY = None
         self.AWS_SECRET = None
         self.USE_ROTATING_IP = False
+        self.METRICS_STORE_IN_DB = True
+        self.METRICS_PROMETHEUS_FILE = None
+        self.ARCHIVE_FOLDER = None
+        self.ARCHIVE_SEGMENT_SIZE = 64 * 1024 * 1024
+        self.ARCHIVE_COMPRESSION_LEVEL = 3
+        self.ARCHIVE_REPARSE_WORKERS = None
+        self.RETENTION_MAX_AGE = 0.0
+        self.RETENTION_KEEP_LAST = 0
+        self.RETENTION_ROLLUP = True
+        self.RETENTION_BATCH_SIZE = 5000
         
         try:
             config = configparser.ConfigParser()
@@ -44,19 +56,20 @@ class Config():
             config.read(self.config_file)
 
             # database
+            # the connection is opened by the first query, and the schema is
+            # created once with `bnb_kanpora.py db migrate`
             try:
-                self.database =   SqliteExtDatabase(f'{config["DATABASE"]["db_name"]}.db', pragmas=(
-                    ('cache_size', -1024 * 64),  # 64MB page-cache.
-                    ('journal_mode', 'wal'),  # Use WAL-mode (you should always use this!).
-                    ('foreign_keys', 1)) # Enforce foreign-key constraints.
-                )  
-                self.database.bind(MODELS)
-                self.database.connect()
-                self.database.create_tables(MODELS)
+                self.backend = get_backend(config["DATABASE"])
+                self.database = self.backend.create_database()
+                self.database.bind(MODELS + VIEW_MODELS)
             except Exception:
                 logger.error("Incomplete database information in %s: cannot continue",
                              self.config_file)
                 sys.exit()
+            # single writer thread, see writer.DatabaseWriter
+            self.DB_WRITER_BATCH_SIZE = config["DATABASE"].getint("writer_batch_size", fallback=500)
+            self.DB_WRITER_FLUSH_INTERVAL = config["DATABASE"].getfloat("writer_flush_interval", fallback=1.0)
+            self.DB_WRITER_QUEUE_SIZE = config["DATABASE"].getint("writer_queue_size", fallback=10000)
 
             # network
             try:
@@ -65,7 +78,7 @@ class Config():
                 # Remove any empty strings from the list of proxies
                 self.HTTP_PROXY_LIST = [x for x in self.HTTP_PROXY_LIST if x]
             except Exception:
-                logger.warningf("No proxy_list in {self.config_file}: not using proxies")
+                logger.warning(f"No proxy_list in {self.config_file}: not using proxies")
                 self.HTTP_PROXY_LIST = []
 
             try:
@@ -79,6 +92,23 @@ class Config():
             self.MAX_CONNECTION_ATTEMPTS = int(config["NETWORK"]["max_connection_attempts"])
             self.REQUEST_SLEEP = float(config["NETWORK"]["request_sleep"])
             self.HTTP_TIMEOUT = float(config["NETWORK"]["http_timeout"])
+
+            # adaptive pacing, see throttle.AdaptiveRateController
+            self.INITIAL_REQUEST_RATE = config["NETWORK"].getfloat("initial_request_rate", fallback=2.0)
+            self.MIN_REQUEST_RATE = config["NETWORK"].getfloat("min_request_rate", fallback=0.2)
+            self.MAX_REQUEST_RATE = config["NETWORK"].getfloat("max_request_rate", fallback=20.0)
+            self.INITIAL_CONCURRENCY = config["NETWORK"].getint("initial_concurrency", fallback=2)
+            self.MAX_CONCURRENCY = config["NETWORK"].getint("max_concurrency", fallback=8)
+
+            # retries, see retry.Backoff and retry.CircuitBreaker
+            self.RETRY_BACKOFF_BASE = config["NETWORK"].getfloat("retry_backoff_base", fallback=0.5)
+            self.RETRY_BACKOFF_MAX = config["NETWORK"].getfloat("retry_backoff_max", fallback=60.0)
+            self.CIRCUIT_BREAKER_THRESHOLD = config["NETWORK"].getint("circuit_breaker_threshold", fallback=5)
+            self.CIRCUIT_BREAKER_RESET = config["NETWORK"].getfloat("circuit_breaker_reset", fallback=60.0)
+
+            # warm sessions, see sessions.SessionPool
+            self.SESSION_POOL_SIZE = config["NETWORK"].getint("session_pool_size", fallback=self.MAX_CONCURRENCY)
+            self.SESSION_WARMUP_URL = config["NETWORK"].get("session_warmup_url", fallback=self.URL_ROOT) or None
             
             try:
                 self.URL_API_SEARCH_ROOT = config["NETWORK"]["url_api_search_root"]
@@ -107,7 +137,46 @@ class Config():
             # survey
             self.SEARCH_MAX_PAGES = int(config["SURVEY"]["search_max_pages"])
             self.SEARCH_MAX_GUESTS = int(config["SURVEY"]["search_max_guests"])
+            # slice saturated boxes by filters before splitting them, see slicing.SlicingStrategy
+            self.SEARCH_DO_LOOP_OVER_ROOM_TYPES = config["SURVEY"].getboolean("search_do_loop_over_room_types", fallback=False)
+            self.SEARCH_DO_LOOP_OVER_PRICES = config["SURVEY"].getboolean("search_do_loop_over_prices", fallback=False)
+            # budget of a survey, 0 for no limit, see frontier.CrawlBudget
+            self.SEARCH_MAX_REQUESTS = config["SURVEY"].getint("search_max_requests", fallback=0)
+            self.SEARCH_MAX_DURATION = config["SURVEY"].getfloat("search_max_duration", fallback=0.0)
+            self.SEARCH_TARGET_COVERAGE = config["SURVEY"].getfloat("search_target_coverage", fallback=0.0)
+            # keep the listing JSON of search results, see records.RoomRecord
+            self.SEARCH_KEEP_RAW_JSON = config["SURVEY"].getboolean("search_keep_raw_json", fallback=False)
             self.RE_INIT_SLEEP_TIME = float(config["SURVEY"]["re_init_sleep_time"])
+            # extra fill from room pages, pages younger than fill_max_age days are not fetched again
+            self.FILL_MAX_ROOM_COUNT = config["SURVEY"].getint("fill_max_room_count", fallback=50000)
+            self.FILL_MAX_AGE = config["SURVEY"].getfloat("fill_max_age", fallback=30.0)
+            # host profiles younger than host_max_age days are not fetched again
+            self.HOST_MAX_AGE = config["SURVEY"].getfloat("host_max_age", fallback=30.0)
+
+            # metrics
+            try:
+                self.METRICS_STORE_IN_DB = config["METRICS"].getboolean("store_in_db", fallback=True)
+                self.METRICS_PROMETHEUS_FILE = config["METRICS"].get("prometheus_file") or None
+            except KeyError:
+                logger.debug(f"No METRICS section in {self.config_file}: metrics stored in the database only")
+
+            # raw responses archive, see archive.RawArchive
+            try:
+                self.ARCHIVE_FOLDER = config["ARCHIVE"].get("folder") or None
+                self.ARCHIVE_SEGMENT_SIZE = config["ARCHIVE"].getint("segment_size", fallback=self.ARCHIVE_SEGMENT_SIZE)
+                self.ARCHIVE_COMPRESSION_LEVEL = config["ARCHIVE"].getint("compression_level", fallback=self.ARCHIVE_COMPRESSION_LEVEL)
+                self.ARCHIVE_REPARSE_WORKERS = config["ARCHIVE"].getint("reparse_workers", fallback=None)
+            except KeyError:
+                logger.debug(f"No ARCHIVE section in {self.config_file}: raw responses are not archived")
+
+            # survey retention, see retention.py
+            try:
+                self.RETENTION_MAX_AGE = config["RETENTION"].getfloat("max_age", fallback=self.RETENTION_MAX_AGE)
+                self.RETENTION_KEEP_LAST = config["RETENTION"].getint("keep_last", fallback=self.RETENTION_KEEP_LAST)
+                self.RETENTION_ROLLUP = config["RETENTION"].getboolean("rollup", fallback=self.RETENTION_ROLLUP)
+                self.RETENTION_BATCH_SIZE = config["RETENTION"].getint("batch_size", fallback=self.RETENTION_BATCH_SIZE)
+            except KeyError:
+                logger.debug(f"No RETENTION section in {self.config_file}: surveys are only deleted explicitly")
 
             # account
             try:
@@ -7,22 +7,42 @@
 
 from bnb_kanpora.http_requests import HTTPRequest
 from bnb_kanpora.config import Config
-from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel
+from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel, MetricModel, RoomPageModel, HostModel, SurveyRoomModel, RoomSearchModel, SurveyProgressModel, AvailabilityModel
 from bnb_kanpora.db import DBUtils
-from bnb_kanpora.utils import GeoBox, SearchResults, SurveyResults
+from bnb_kanpora.utils import GeoBox, SearchFilters, SearchResults, SurveyResults
+from bnb_kanpora.metrics import MetricsRegistry
+from bnb_kanpora.writer import DatabaseWriter
+from bnb_kanpora.storage import normalize_survey
+from bnb_kanpora.retention import expired_surveys, purge_survey, delete_orphan_listings
+from bnb_kanpora import fulltext
+from bnb_kanpora.aggregation import SpatialGrid, aggregate, iter_room_chunks, SQUARE
+from bnb_kanpora.tiles import TilePyramid, TILE_COLUMNS
+from bnb_kanpora.records import RoomRecord, parse_price
+from bnb_kanpora.slicing import SlicingStrategy, GEO_SPLIT
+from bnb_kanpora.frontier import CrawlBudget, Frontier, estimate_children
+from bnb_kanpora.coverage import LISTINGS_COUNT_CAP
+from bnb_kanpora.polygon import SearchPolygon
+from bnb_kanpora.archive import RawArchive, ROOM_PAGE, HOST_PAGE, archive_path, reparse_search_pages
+from bnb_kanpora.hosts import HOST_FIELDS, parse_host_profile
+from bnb_kanpora.quadtree import QuadTree, ROOT, node_label
 
 import logging
+import os
 import re
-from lxml import html
 import json
+import shutil
+import threading
 import time
 import peewee
-from playhouse.dataset import DataSet
-
-from bnb_kanpora.views import ABSurveyViewer
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from dataclasses import replace
+from datetime import datetime, timedelta
 
 logger = logging.getLogger()
 
+# room columns filled from room pages, they seldom change between surveys
+ROOM_PAGE_FIELDS = ['host_id', 'room_type', 'city', 'neighborhood', 'address', 'bedrooms', 'bathrooms']
+
 
 class DatabaseController():
     """Control the underlying database
@@ -42,9 +62,23 @@ class DatabaseController():
     def create_tables(self) -> None:
         DBUtils(self.config).create_tables()
 
+    def migrate(self) -> list:
+        return DBUtils(self.config).migrate()
+
+    def schema_version(self) -> int:
+        return DBUtils(self.config).schema_version()
+
     def drop_tables(self) -> None:
         DBUtils(self.config).drop_tables()
 
+    def compact(self, full:bool=False) -> int:
+        """Give the space of deleted rows back, returns the number of bytes reclaimed"""
+        nb_bytes = self.config.backend.compact(self.config.database, full=full)
+        if full and fulltext.is_available(self.config.database) and RoomSearchModel.table_exists():
+            # a full VACUUM renumbers the rows the index points to
+            fulltext.rebuild_index(self.config.database)
+        return nb_bytes
+
 
 class SearchAreaController():
     """Control a search area for search surveys
@@ -56,16 +90,17 @@ class SearchAreaController():
 
     Methods:
     ---
-        add(search_area_name:str, geography:Geobox) -> int
+        add(search_area_name:str, geobox:Geobox=None, polygon:SearchPolygon=None) -> int
+            The bounding box of the polygon by default
         delete(search_area_id) -> bool
     """
     def  __init__(self, config:Config) -> None:
-        config.self = config
+        self.config = config
 
     ### Search Area
-    def add(self, search_area_name:str, geobox:GeoBox) -> int:
+    def add(self, search_area_name:str, geobox:GeoBox=None, polygon:SearchPolygon=None) -> int:
         """
-        Add a search_area to the database.
+        Add a search_area to the database, bounded by geobox or by a polygon.
         """
         try:
             logging.info("Adding search_area to database as new search area")
@@ -79,6 +114,9 @@ class SearchAreaController():
             abbreviation = search_area_name.lower()[:10].replace(" ", "_")
             while abbreviation[-1] == "_":
                 abbreviation = abbreviation[:-1]
+
+            if geobox is None:
+                geobox = polygon.bounds
             
             search_area = SearchAreaModel.create(
                 name = search_area_name,
@@ -86,9 +124,10 @@ class SearchAreaController():
                 bb_n_lat = geobox.n_lat,
                 bb_s_lat = geobox.s_lat,
                 bb_e_lng = geobox.e_lng,
-                bb_w_lng = geobox.w_lng
+                bb_w_lng = geobox.w_lng,
+                polygon = polygon.to_geojson() if polygon is not None else None
             )
-            print(f"Search area created: {search_area}")
+            logger.info(f"Search area created: {search_area}")
             return search_area.search_area_id
 
         except Exception:
@@ -113,6 +152,12 @@ class SearchSurveyController():
         delete(survey_id) -> bool
         search(geobox:GeoBox, survey_id:int) -> int
         search_box(geobox:GeoBox, survey_id:int) -> int
+        reparse(survey_id:int, max_workers:int=None) -> int
+        normalize(survey_id:int) -> (int, int)
+        get_leaves(survey_id:int) -> list
+        sweep(survey_id:int, stays:list, guests:list=None) -> list[dict]
+        aggregate(survey_id:int, kind:str=SQUARE, cell_size:float=500, folder:str="export", raster:bool=False) -> str
+        get_metrics(survey_id:int) -> list[MetricModel]
     """
 
     def __init__(self, config:Config) -> None:
@@ -121,93 +166,389 @@ class SearchSurveyController():
 
         self.search_node_counter = 0
         self.config = config
-        self.request = HTTPRequest(config)
+        self.metrics = MetricsRegistry()
+        self._request = None
         #self.logged_progress = self._get_logged_progress()
         #self.bounding_box = self._get_bounding_box()
+
+    @property
+    def request(self) -> HTTPRequest:
+        # the HTTP session is only needed to run a survey
+        if self._request is None:
+            self._request = HTTPRequest(self.config, self.metrics)
+        return self._request
     
     def add(self, search_area_id:int) -> int:
         survey = SurveyModel.create(search_area_id = search_area_id)
         return survey.survey_id
 
     def delete(self, survey_id: int) -> bool:
+        # rooms are deleted in chunks before the survey they reference
         survey = SurveyModel.get_by_id(survey_id)
-        rows_deleted = survey.delete_instance()
-        return rows_deleted == 1
+        purge_survey(self.config.database, survey.survey_id, batch_size=self.config.RETENTION_BATCH_SIZE)
+        return True
 
-    def run(self, survey_id:int) -> int:
+    def run(self, survey_id:int, max_requests:int=None, max_duration:float=None, target_coverage:float=None) -> SurveyResults:
+            """Run a survey, within max_requests requests and max_duration seconds, until
+            target_coverage of the listings is found (search_max_requests, search_max_duration
+            and search_target_coverage by default, 0 for no limit)"""
             survey:SurveyModel = SurveyModel.get_by_id(survey_id)
             search_area:SearchAreaModel = survey.search_area_id
-            survey_results = self.search(search_area.geobox)
-            survey_results = self.save_results(survey_results, survey_id)
+            self.metrics = self.request.metrics = MetricsRegistry()
+            start_time = time.monotonic()
+            nb_requests_start = self.request.nb_requests
+            budget = CrawlBudget.from_config(self.config, max_requests, max_duration, target_coverage)
+            self.request.archive = self.get_archive(survey_id)
+            writer = DatabaseWriter.from_config(self.config, self.metrics)
+            try:
+                # rooms are saved as nodes complete, a failed survey keeps them
+                with writer:
+                    survey_results = self.search(search_area.geobox, survey_results=SurveyResults(), budget=budget,
+                                                 polygon=search_area.search_polygon, writer=writer, survey_id=survey_id)
+            finally:
+                if self.request.archive is not None:
+                    self.request.archive.close()
+                    self.request.archive = None
+            self._save_leaves(survey_id, survey_results.leaves, survey_results.failed)
+            survey_results.total_nb_saved = writer.nb_written
+            survey_results.nb_requests = self.request.nb_requests - nb_requests_start
+            survey_results.elapsed = time.monotonic() - start_time
+            self.save_metrics(survey_results, survey_id)
             return survey_results
 
-    def search(self, geobox:GeoBox, tree_idx:str = '0', survey_results:SurveyResults=SurveyResults()) -> SurveyResults:
-        """Search for a geographical bounding box
+    def get_archive(self, survey_id:int) -> RawArchive:
+        """Raw responses archive of a survey, None when archive folder is not configured"""
+        if not self.config.ARCHIVE_FOLDER:
+            return None
+        return RawArchive(self.config.ARCHIVE_FOLDER, survey_id,
+                          segment_size=self.config.ARCHIVE_SEGMENT_SIZE, level=self.config.ARCHIVE_COMPRESSION_LEVEL)
 
-        Keyword arguments:
-        geobox:Geobox -- geographical bounding box
-        survey_id:int -- survey id
-        tree_idx:str -- Recursive index, root is 0, childs are 0-0, 0-1, 0-2, 0-3, childs of childs are 0-0-1, 0-0-2, ... and so on
+    def reparse(self, survey_id:int, max_workers:int=None) -> int:
+        """Map the archived search pages of a survey to its rooms again.
+
+        Returns the number of rooms updated.
         """
-        results = self._search_box(geobox)
-        
-        survey_results.search_results[tree_idx] = results
-        logger.info(f"{tree_idx} - {len(results.rooms)} on {results.nb_rooms_expected}")
+        archive = self.get_archive(survey_id)
+        if archive is None:
+            raise ValueError("No archive folder in the configuration")
+        with self.metrics.timer("reparse_seconds"):
+            rows = reparse_search_pages(archive, survey_id, max_workers or self.config.ARCHIVE_REPARSE_WORKERS)
+        with self.metrics.timer("db_write_seconds"):
+            nb_updated = self.config.backend.bulk_update_rooms(self.config.database, rows)
+        logger.info(f"Survey {survey_id}: {nb_updated} rooms updated from {len(rows)} archived rooms")
+        return nb_updated
+
+    def normalize(self, survey_id:int) -> tuple:
+        """Move the rooms of a finished survey to observations and shared listings.
+        Run it after run_extra and reparse, which only update the room table.
+
+        Returns (rooms normalized, new listings).
+        """
+        SurveyModel.get_by_id(survey_id)
+        with self.metrics.timer("db_write_seconds"):
+            return normalize_survey(self.config.database, survey_id)
+
+    def save_metrics(self, survey_results:SurveyResults, survey_id:int) -> None:
+        self.metrics.set("survey_seconds", survey_results.elapsed)
+        self.metrics.set("survey_rooms", survey_results.total_nb_rooms)
+        self.metrics.set("survey_rooms_saved", survey_results.total_nb_saved)
+        self.metrics.set("survey_rooms_expected", survey_results.total_nb_rooms_expected)
+        if survey_results.coverage is not None:
+            self.metrics.set("survey_coverage", survey_results.coverage)
+        try:
+            if self.config.METRICS_STORE_IN_DB:
+                self.metrics.save(survey_id)
+            if self.config.METRICS_PROMETHEUS_FILE:
+                self.metrics.write_prometheus(self.config.METRICS_PROMETHEUS_FILE.format(survey_id=survey_id))
+        except Exception:
+            # metrics must never fail a finished survey
+            logger.exception(f"Failed to save metrics of survey {survey_id}")
 
-        # need to split the box to search further (node on tree)
-        # TODO get the expected nb rooms from first query and directly split the box
-        if len(results.rooms) >= (self.config.SEARCH_MAX_PAGES * self.config.SEARCH_LISTINGS_ON_FULL_PAGE):
-            # replace last box with 4-split 
-            for idx, child_bbox in enumerate(geobox.get_four_splits(enlarge_pct=0)):
-                self.search(geobox=child_bbox, 
-                            tree_idx = f"{tree_idx}-{idx}", 
-                            survey_results = survey_results)
+    def get_metrics(self, survey_id:int) -> list:
+        return list(MetricModel.select().where(MetricModel.survey_id == survey_id).order_by(MetricModel.name, MetricModel.node))
 
-        if tree_idx == '0':
-            # last iteration of recursive search (root)
-            return survey_results.get_uniques_search_results()
+    def search(self, geobox:GeoBox, survey_results:SurveyResults=None, budget:CrawlBudget=None,
+               polygon:SearchPolygon=None, writer:DatabaseWriter=None, survey_id:int=None) -> SurveyResults:
+        """Search for a geographical bounding box
 
-        return survey_results
+        Nodes are searched concurrently. A node returning the maximum number
+        of listings is sliced by room type and price bands, or split in four
+        children (see SlicingStrategy). Pending nodes are searched by
+        decreasing number of new listings expected per request, until the
+        budget is spent or the estimated coverage reaches its target. With a
+        polygon, children outside of it are not searched and listings
+        outside of it are dropped. A node whose search fails is kept in
+        survey_results.failed, out of the leaves and of the coverage estimate.
 
-    def _search_box(self, box:GeoBox) -> SearchResults:
+        Keyword arguments:
+        geobox:Geobox -- geographical bounding box, root of the quadtree
+        survey_results:SurveyResults -- results to complete, by node: (quadkey, SearchFilters)
+        budget:CrawlBudget -- maximum number of requests, duration and target coverage, no limit by default
+        polygon:SearchPolygon -- polygon of the search area, within geobox
+        writer:DatabaseWriter -- started writer saving the rooms of each node to survey_id
+        """
+        survey_results = survey_results if survey_results is not None else SurveyResults()
+        estimator = survey_results.estimator
+        budget = budget or CrawlBudget()
+        budget.start(lambda: self.request.nb_requests)
+        slicing = SlicingStrategy.from_config(self.config)
+        quadtree = QuadTree(geobox)
+        root = (ROOT, SearchFilters())
+        frontier = Frontier()
+        frontier.push(root, geobox)
+        estimator.add_node(root)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.config.MAX_CONCURRENCY) as executor:
+            while frontier or pending:
+                if budget.exhausted():
+                    survey_results.budget_exhausted = True
+                if budget.target_reached(estimator.coverage):
+                    survey_results.target_reached = True
+                stop = survey_results.budget_exhausted or survey_results.target_reached
+                # submit no more nodes than threads, so that the frontier order is kept
+                while frontier and len(pending) < self.config.MAX_CONCURRENCY and not stop:
+                    node, box = frontier.pop()
+                    pending[executor.submit(self._search_box, box, node, budget)] = (node, box)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node, box = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception:
+                        logger.exception(f"{node_label(node)} - search failed")
+                        results = SearchResults(geobox=box, filters=node[1], failed=True)
+                    if results.failed:
+                        # its rooms are unknown: neither a leaf nor a node of the estimate
+                        self.metrics.inc("nodes_failed_total")
+                        survey_results.failed.append(node)
+                        logger.warning(f"{node_label(node)} - search failed, its area is not surveyed")
+                        continue
+                    saturated = slicing.is_saturated(results)
+                    area_results, capped = results, None
+                    if polygon is not None:
+                        area_results = polygon.filter_results(results)
+                        # the listings_count of the polygon is estimated from the listings found
+                        capped = saturated or results.nb_rooms_expected >= LISTINGS_COUNT_CAP
+                        self.metrics.inc("rooms_outside_area_total", len(results.rooms) - len(area_results.rooms))
+                    survey_results.search_results[node] = area_results
+                    if writer is not None:
+                        for room in area_results.rooms:
+                            if room.room_id is not None:
+                                writer.put(self._insert_rooms, room.to_row(survey_id))
+                    estimator.complete(node, area_results.nb_rooms_expected, (room.room_id for room in area_results.rooms), capped)
+                    logger.info(f"{node_label(node)} - {len(area_results.rooms)} on {area_results.nb_rooms_expected}, "
+                                f"{estimator.nb_observed} found on {round(estimator.total)} expected")
+
+                    # need to search further (node on tree)
+                    if not saturated:
+                        survey_results.leaves.append(node)
+                    else:
+                        kind, children = slicing.slice(node, box, results, quadtree, polygon)
+                        self.metrics.inc("node_slices_total", kind=kind)
+                        if kind == GEO_SPLIT and len(children) < 4:
+                            self.metrics.inc("nodes_pruned_total", 4 - len(children))
+                        estimates = estimate_children(area_results, children, self.config.SEARCH_LISTINGS_ON_FULL_PAGE, slicing.capacity)
+                        for (child, child_box), (priority, child_expected) in zip(children, estimates):
+                            frontier.push(child, child_box, priority)
+                            estimator.add_node(child, node, child_expected)
+
+        survey_results.nb_nodes_left = len(frontier)
+        if survey_results.budget_exhausted or survey_results.target_reached:
+            logger.info(f"{'Target coverage reached' if survey_results.target_reached else 'Budget spent'} "
+                        f"after {budget.nb_requests} requests, {len(frontier)} nodes left, "
+                        f"estimated coverage {survey_results.coverage}")
+        return survey_results.get_uniques_search_results()
+
+    def _search_box(self, box:GeoBox, node:tuple=(ROOT, SearchFilters()), budget:CrawlBudget=None) -> SearchResults:
         items_offset = 0
+        _, filters = node
+        label = node_label(node)
         results_acc = SearchResults()
         results_acc.geobox = box
+        results_acc.filters = filters
+
+        with self.metrics.timer("node_search_seconds", node=label):
+            # iterate over pages
+            for section_offset in range(0, self.config.SEARCH_MAX_PAGES):
+                # TODO should probably get the value from response
+                items_offset = section_offset * self.config.SEARCH_LISTINGS_ON_FULL_PAGE 
+
+                results = self.request.get_rooms_from_box(box, section_offset, items_offset, node=label, filters=filters)
+                self.metrics.inc("node_pages_total", node=label)
+                if results.failed:
+                    results_acc.failed = True
+                    break
+                results_acc.rooms.extend(results.rooms)
+                results_acc.nb_rooms_expected = results.nb_rooms_expected
+
+                if len(results.rooms) < self.config.SEARCH_LISTINGS_ON_FULL_PAGE:
+                    # If a full page of listings is not returned by Airbnb,
+                    # this branch of the search is complete.
+                    break
+                if budget is not None and budget.exhausted():
+                    break
+
+        self.metrics.inc("node_rooms_total", len(results_acc.rooms), node=label)
+        self.metrics.set("node_rooms_expected", results_acc.nb_rooms_expected, node=label)
+        return results_acc
 
-        # iterate over pages
-        for section_offset in range(0, self.config.SEARCH_MAX_PAGES):
-            # TODO should probably get the value from response
-            items_offset = section_offset * self.config.SEARCH_LISTINGS_ON_FULL_PAGE 
-
-            results = self.request.get_rooms_from_box(box, section_offset, items_offset)
-            results_acc.rooms.extend(results.rooms)
-            results_acc.nb_rooms_expected = results.nb_rooms_expected
+    def _insert_rooms(self, rows:list) -> int:
+        return self.config.backend.bulk_insert_rooms(self.config.database, rows)
+
+    def _save_leaves(self, survey_id:int, leaves:list, failed:list=()) -> None:
+        rows = [dict(survey_id=survey_id, room_type=filters.room_type, price_min=filters.price_min,
+                     price_max=filters.price_max, quadtree_node=key, failed=is_failed)
+                for nodes, is_failed in ((leaves, False), (failed, True)) for key, filters in nodes]
+        with self.config.database.atomic():
+            SurveyProgressModel.delete().where(SurveyProgressModel.survey_id == survey_id).execute()
+            for batch in peewee.chunked(rows, 500):
+                SurveyProgressModel.insert_many(batch).execute()
+
+    def get_leaves(self, survey_id:int) -> list:
+        """(node, box) of the leaves of the last run of a survey: the searches
+        that were not sliced, which cover its search area once"""
+        survey = SurveyModel.get_by_id(survey_id)
+        quadtree = QuadTree(survey.search_area_id.geobox)
+        progress = (SurveyProgressModel
+            .select()
+            .where((SurveyProgressModel.survey_id == survey_id) & (SurveyProgressModel.failed == False))
+            .order_by(SurveyProgressModel.id))
+        return [((leaf.quadtree_node, SearchFilters(leaf.room_type, leaf.price_min, leaf.price_max)),
+                 quadtree.box(leaf.quadtree_node)) for leaf in progress]
+
+    def sweep(self, survey_id:int, stays:list, guests:list=None) -> list:
+        """Search the leaves of a survey again for each stay and number of
+        guests, and save the rooms listed, i.e. available, for each of them.
+
+        A search with dates lists fewer rooms than the search of the survey,
+        so the leaves are not sliced again and each stay costs one pass over
+        them. Rooms of the survey that are not available for a stay are
+        booked or blocked by their host, which the estimated occupancy does
+        not tell apart.
 
-            if len(results.rooms) < self.config.SEARCH_LISTINGS_ON_FULL_PAGE:
-                # If a full page of listings is not returned by Airbnb,
-                # this branch of the search is complete.
-                break
+        Keyword arguments:
+        stays:list[(date, date)] -- (checkin, checkout) of each stay, see utils.stay_dates
+        guests:list[int] -- numbers of guests, search_max_guests by default
 
-        return results_acc
+        Returns, for each stay and number of guests, the number of rooms
+        available and the estimated occupancy of the rooms of the survey.
+        Rooms of leaves whose search failed count as booked, nb_leaves_failed
+        tells how many there were.
+        """
+        survey = SurveyModel.get_by_id(survey_id)
+        leaves = self.get_leaves(survey_id)
+        if not leaves:
+            raise ValueError(f"Survey {survey_id} has no leaves, run it again before sweeping it")
+        guests = guests or [self.config.SEARCH_MAX_GUESTS]
+        polygon = survey.search_area_id.search_polygon
+        slicing = SlicingStrategy.from_config(self.config)
+        self.metrics = self.request.metrics = MetricsRegistry()
+        sweeps = [(checkin, checkout, nb_guests) for checkin, checkout in stays for nb_guests in guests]
+        with self.config.database.atomic():
+            for checkin, checkout, nb_guests in sweeps:
+                (AvailabilityModel.delete()
+                    .where((AvailabilityModel.survey_id == survey_id) & (AvailabilityModel.checkin == checkin)
+                           & (AvailabilityModel.checkout == checkout) & (AvailabilityModel.guests == nb_guests))
+                    .execute())
+
+        available = {sweep: set() for sweep in sweeps}
+        nb_failed = {sweep: 0 for sweep in sweeps}
+        with self.metrics.timer("sweep_seconds"):
+            with DatabaseWriter.from_config(self.config, self.metrics) as writer, \
+                    ThreadPoolExecutor(max_workers=self.config.MAX_CONCURRENCY) as executor:
+                futures = {}
+                for checkin, checkout, nb_guests in sweeps:
+                    for (key, filters), box in leaves:
+                        node = (key, replace(filters, checkin=checkin, checkout=checkout, guests=nb_guests))
+                        futures[executor.submit(self._search_box, box, node)] = node
+                for future in as_completed(futures):
+                    _, filters = node = futures[future]
+                    sweep = (filters.checkin, filters.checkout, filters.guests)
+                    try:
+                        results = future.result()
+                    except Exception:
+                        logger.exception(f"{node_label(node)} - search failed")
+                        results = SearchResults(failed=True)
+                    if results.failed:
+                        self.metrics.inc("sweep_nodes_failed_total")
+                        nb_failed[sweep] += 1
+                        logger.warning(f"{node_label(node)} - search failed, its available rooms are missed")
+                        continue
+                    if slicing.is_saturated(results):
+                        self.metrics.inc("sweep_nodes_saturated_total")
+                        logger.warning(f"{node_label(node)} - saturated, some available rooms may be missed")
+                    if polygon is not None:
+                        results = polygon.filter_results(results)
+                    seen = available[sweep]
+                    for room in results.rooms:
+                        if room.room_id is not None and room.room_id not in seen:
+                            seen.add(room.room_id)
+                            writer.put(self._insert_availability, dict(
+                                survey_id=survey_id, checkin=filters.checkin, checkout=filters.checkout,
+                                guests=filters.guests, room_id=room.room_id, rate=room.rate))
+
+        room_ids = set(room_id for (room_id,) in SurveyRoomModel
+                       .select(SurveyRoomModel.room_id)
+                       .where(SurveyRoomModel.survey_id == survey_id)
+                       .tuples())
+        results = []
+        for (checkin, checkout, nb_guests), seen in available.items():
+            nb_booked = len(room_ids - seen)
+            results.append({"checkin": checkin, "checkout": checkout, "guests": nb_guests,
+                            "nb_available": len(seen), "nb_rooms": len(room_ids),
+                            "nb_leaves_failed": nb_failed[(checkin, checkout, nb_guests)],
+                            "occupancy": round(nb_booked / len(room_ids), 4) if room_ids else None})
+            logger.info(f"Survey {survey_id}, {checkin} to {checkout} for {nb_guests}: {len(seen)} rooms available")
+        return results
+
+    def _insert_availability(self, rows:list) -> int:
+        # rows are unique: a room is put once per stay, whose rows were deleted
+        for batch in peewee.chunked(rows, 500):
+            AvailabilityModel.insert_many(batch).execute()
+        return len(rows)
+
+    def aggregate(self, survey_id:int, kind:str=SQUARE, cell_size:float=500, folder:str="export", raster:bool=False) -> str:
+        """Bin the rooms of a survey into square or hex cells of cell_size
+        meters over its search area, and write the count, median rate and
+        room type shares of each cell as GeoJSON, or as a raster (square
+        cells only). Returns the path of the file written."""
+        survey = SurveyModel.get_by_id(survey_id)
+        grid = SpatialGrid.create(kind, survey.search_area_id.geobox, cell_size)
+        with self.metrics.timer("aggregation_seconds"):
+            cells = aggregate(grid, iter_room_chunks(survey_id))
+        os.makedirs(folder, exist_ok=True)
+        path = f'{folder}/grid_{survey_id}_{kind}_{int(cell_size)}m.{"npz" if raster else "geojson"}'
+        if raster:
+            cells.write_raster(path)
+        else:
+            cells.write_geojson(path)
+        logger.info(f"Survey {survey_id}: {int(cells.counts.sum())} rooms in {len(cells.keys)} cells")
+        return path
 
-    def save_results(self, survey_results:SurveyResults, survey_id:int) -> int:
-        nb_saved = 0
-        for tree_idx, search_results in survey_results.search_results.items():
-            for room in search_results.rooms:
-                room_id = int(room["listing"]["id"])
-                if room_id is not None: 
-                    listing_id = SearchResultsController(self.config).parse_room_from_search_result(room, survey_id)
-                    if listing_id:
-                        nb_saved += 1  
-        survey_results.total_nb_saved = nb_saved
-        return survey_results
+    def export_tiles(self, survey_id:int, folder:str="export", min_zoom:int=0, max_zoom:int=14, full_zoom:int=12) -> str:
+        """Write the rooms of a survey as an MBTiles file of vector tiles,
+        clustered below full_zoom. Returns the path of the file written."""
+        survey = SurveyModel.get_by_id(survey_id)
+        with self.metrics.timer("tiles_seconds"):
+            pyramid = TilePyramid.from_chunks(iter_room_chunks(survey_id, columns=TILE_COLUMNS),
+                                              min_zoom=min_zoom, max_zoom=max_zoom, full_zoom=full_zoom)
+            os.makedirs(folder, exist_ok=True)
+            path = f"{folder}/rooms_{survey_id}.mbtiles"
+            nb_tiles = pyramid.write_mbtiles(path, f"{survey.search_area_id.name}, survey {survey_id}")
+        logger.info(f"Survey {survey_id}: {pyramid.nb_rooms} rooms in {nb_tiles} tiles, zooms {min_zoom} to {max_zoom}")
+        return path
 
     def export(self, survey_ids:list[int], folder="export") -> str:
+        from playhouse.dataset import DataSet
+        os.makedirs(folder, exist_ok=True)
         path = f'{folder}/rooms_{"-".join(survey_ids)}.csv'
-        db = DataSet(f'sqlite:///{self.config.database.database}')
-        query = (RoomModel
+        db = DataSet(self.config.backend.url)
+        query = (SurveyRoomModel
          .select(
-            SearchAreaModel.search_area_id, SearchAreaModel.name.alias("search_area_name"), RoomModel)
+            SearchAreaModel.search_area_id, SearchAreaModel.name.alias("search_area_name"), SurveyRoomModel)
          .join(SurveyModel, peewee.JOIN.INNER)
          .join(SearchAreaModel,  peewee.JOIN.INNER)
          .where(SurveyModel.survey_id << survey_ids)
@@ -216,6 +557,66 @@ class SearchSurveyController():
         return path
 
 
+class RoomController():
+    """Query the rooms of every survey
+
+    Attributes:
+    ---
+        config: Config
+            Configuration object
+
+    Methods:
+    ---
+        search(query:str, survey_ids:list[int]=None, search_area_id:int=None, field:str=None, limit:int=100) -> list[RoomSearchModel]
+    """
+    def __init__(self, config:Config) -> None:
+        self.config = config
+
+    def search(self, query:str, survey_ids:list=None, search_area_id:int=None, field:str=None, limit:int=100) -> list:
+        """Rooms whose name, address or license match a full-text query, best matches first"""
+        if not fulltext.is_available(self.config.database):
+            raise RuntimeError("Full-text search needs an SQLite database with FTS5")
+        return list(fulltext.search_rooms(query, survey_ids=survey_ids, search_area_id=search_area_id,
+                                          field=field, limit=limit))
+
+
+class RetentionController():
+    """Purge the surveys past the retention policy of the [RETENTION] section
+
+    Attributes:
+    ---
+        config: Config
+            Configuration object
+
+    Methods:
+    ---
+        expired(search_area_id:int=None, max_age:float=None, keep_last:int=None) -> list[int]
+        purge(survey_ids:list[int], rollup:bool=None) -> dict
+    """
+    def __init__(self, config:Config) -> None:
+        self.config = config
+
+    def expired(self, search_area_id:int=None, max_age:float=None, keep_last:int=None) -> list:
+        return expired_surveys(
+            max_age=self.config.RETENTION_MAX_AGE if max_age is None else max_age,
+            keep_last=self.config.RETENTION_KEEP_LAST if keep_last is None else keep_last,
+            search_area_id=search_area_id)
+
+    def purge(self, survey_ids:list, rollup:bool=None) -> dict:
+        """Delete surveys with their rooms and archives, the listings only
+        they referenced, and give the space back"""
+        rollup = self.config.RETENTION_ROLLUP if rollup is None else rollup
+        nb_rooms = 0
+        for survey_id in survey_ids:
+            nb_rooms += purge_survey(self.config.database, survey_id, rollup=rollup,
+                                     batch_size=self.config.RETENTION_BATCH_SIZE)
+            if self.config.ARCHIVE_FOLDER:
+                shutil.rmtree(archive_path(self.config.ARCHIVE_FOLDER, survey_id), ignore_errors=True)
+        nb_listings = delete_orphan_listings(self.config.database)
+        nb_bytes = self.config.backend.compact(self.config.database) if survey_ids else 0
+        return {"survey_ids": list(survey_ids), "nb_rooms": nb_rooms, "nb_listings": nb_listings, "nb_bytes_reclaimed": nb_bytes}
+
+
 class SearchResultsController():
     """Controls a search result
     
@@ -226,6 +627,7 @@ class SearchResultsController():
 
     Methods:
     ---
+        map_room_from_search_result(search_result:dict, survey_id:int) -> dict
         parse_room_from_search_result(search_result:dict, survey_id:int) -> int
     """
     def __init__(self, config:Config) -> None:
@@ -233,61 +635,17 @@ class SearchResultsController():
         """ """
         logger.setLevel(config.log_level)
 
+    def map_room_from_search_result(self, search_result:dict, survey_id:int) -> dict:
+        """
+        Map a search result listing to the columns of the room table.
+        """
+        return RoomRecord.from_search_result(search_result).to_row(survey_id)
+
     def parse_room_from_search_result(self, search_result:dict, survey_id:int) -> int :
         """
         Some fields occasionally extend beyond the varchar(255) limit.
         """
-
-        key_mappings = {
-            'room_id' : (['listing','id'],),
-            'room_type' : (['listing','room_type'],),
-            'host_id' : (['listing', 'user','id'],),
-            'address' : (['listing','public_address'],),
-            'reviews' : (['listing','reviews_count'],),
-            'overall_satisfaction' : (['listing','star_rating'],),
-            'accommodates' : (['listing','person_capacity'],),
-            'bedrooms' : (['listing','bedrooms'],),
-            'bathrooms' : (['listing','bathrooms'],),
-            'latitude' : (['listing','lat'],),
-            'longitude' : (['listing','lng'],),
-            'coworker_hosted' : (['listing','coworker_hosted'],),
-            'extra_host_languages' : (['listing','extra_host_languages'],),
-            'name' : (['listing','name'],),
-            'license' : (['listing','license'],),
-            'city' : (['listing','localized_city'],),
-            'picture_url' : (['listing','picture_url'],),
-            'neighborhood' : (['listing','neighborhood'],),
-            'pdp_type' : (['listing','pdp_type'],),
-            'pdp_url_type' : (['listing','pdp_url_type'],),
-            'rate' : (['pricing_quote', 'structured_stay_display_price','primary_line', 'price'], lambda v: v.replace('\xa0€','')),
-            'rate_with_service_fee' : (['pricing_quote','rate_with_service_fee', 'amount'],),
-            'currency' : (['pricing_quote', 'rate', 'currency'],),
-            'weekly_price_factor' : (['pricing_quote', 'weekly_price_factor'],),
-            'monthly_price_factor' : (['pricing_quote', 'monthly_price_factor'],),
-            'min_nights' : (['listing','min_nights'],),
-            'max_nights' : (['listing','max_nights'],),
-        }
-
-        def map_dict(source, mapping):
-            dest = {}
-            for k, path in mapping.items():
-                if type(path) == str:
-                    dest[k] = source.get(path)
-                elif type(path) == tuple:
-                    accessor = "source"
-                    for i in range(0, len(path[0])):
-                        accessor += f'.get(path[0][{i}], {{}})'
-                    value = eval(accessor) or None
-                    # a lambda function is used for string manipulation
-                    if (value and len(path) > 1):
-                        value = path[1](value)
-                    dest[k] = value
-                else:
-                    raise KeyError("Malformed mapping dict for room parsing")
-            return dest
-
-        room_dict = map_dict(search_result, key_mappings)
-        room_dict['survey_id'] = str(survey_id)
+        room_dict = self.map_room_from_search_result(search_result, survey_id)
 
         try:    
             room = RoomModel.create(**room_dict)
@@ -303,46 +661,198 @@ class SearchResultsController():
         return None
 
 
-class ABListingExtraController():
+class PageFetchController():
+    """Fetch pages of the web site concurrently, through a shared HTTPRequest,
+    and keep them in the raw responses archive of their survey. The fetching
+    threads save their rows through a single DatabaseWriter.
+
+    Attributes:
+    ---
+        config: Config
+            Configuration object
+        metrics: MetricsRegistry
+
+    Methods:
+    ---
+        close()
+    """
     def __init__(self, config:Config) -> None:
-        """ Get the room properties from the web site """
         self.config = config
+        self.metrics = MetricsRegistry()
+        self.writer = None
+        self._request = None
+        self._archives = {}
+        # fetching threads open the archive of a survey on its first page
+        self._archives_lock = threading.Lock()
+
+    @property
+    def request(self) -> HTTPRequest:
+        if self._request is None:
+            self._request = HTTPRequest(self.config, self.metrics)
+        return self._request
+
+    def _archive_page(self, survey_id:int, kind:str, key, body:bytes) -> datetime:
+        """Keep a fetched page in the archive of its survey, returns the time it was fetched at"""
+        if not self.config.ARCHIVE_FOLDER:
+            return datetime.now()
+        with self._archives_lock:
+            if survey_id not in self._archives:
+                self._archives[survey_id] = RawArchive(self.config.ARCHIVE_FOLDER, survey_id,
+                                                       segment_size=self.config.ARCHIVE_SEGMENT_SIZE,
+                                                       level=self.config.ARCHIVE_COMPRESSION_LEVEL)
+            archive = self._archives[survey_id]
+        # the time of the archive entry, that reparse gives the page again
+        return datetime.fromtimestamp(archive.append(kind, key, body).fetched_at)
+
+    def _archived_pages(self, survey_id:int, kind:str):
+        """(id, fetched_at, body) of the latest archived page of kind of every room or host of a survey"""
+        if not self.config.ARCHIVE_FOLDER:
+            raise ValueError("No archive folder in the configuration")
+        archive = RawArchive(self.config.ARCHIVE_FOLDER, survey_id)
+        latest = {}
+        for entry in sorted(archive.entries(kind), key=lambda e: e.fetched_at):
+            latest[entry.key] = entry
+        for key, entry in latest.items():
+            yield int(key), datetime.fromtimestamp(entry.fetched_at), archive.read(entry)
+
+    def _fetch_all(self, fetch, keys:list) -> int:
+        """Call fetch(key) -> bool for every key, max_concurrency at a time.
+        Returns the number of pages found."""
+        with DatabaseWriter.from_config(self.config, self.metrics) as self.writer:
+            with ThreadPoolExecutor(max_workers=self.config.MAX_CONCURRENCY) as executor:
+                return sum(executor.map(fetch, keys))
+
+    def close(self) -> None:
+        for archive in self._archives.values():
+            archive.close()
+        self._archives = {}
+        if self._request is not None:
+            self._request.close()
+
+
+class HostController(PageFetchController):
+    """Collect the profiles of the hosts of a survey
+
+    Hosts are deduplicated before fetching: an operator of hundreds of
+    listings has its profile fetched once, and not again for max_age days.
 
-    def fill_loop_by_room(self, survey_id):
-        # TODO refacto
+    Attributes:
+    ---
+        config: Config
+            Configuration object
+
+    Methods:
+    ---
+        fill_hosts(survey_id:int, max_age:float=None) -> (int, int)
+            (distinct hosts of the survey, profiles fetched)
+        get_host(survey_id:int, host_id:int) -> bool
+        reparse(survey_id:int) -> int
+        close()
+    """
+    def fill_hosts(self, survey_id:int, max_age:float=None) -> tuple:
+        max_age = self.config.HOST_MAX_AGE if max_age is None else max_age
+        fresh_after = datetime.now() - timedelta(days=max_age)
+        host_ids = (SurveyRoomModel
+            .select(SurveyRoomModel.host_id)
+            .where(SurveyRoomModel.survey_id == survey_id)
+            .distinct())
+        nb_hosts = host_ids.count()
+        fresh = HostModel.select(HostModel.host_id).where(HostModel.fetched_at >= fresh_after)
+        to_fetch = [host_id for (host_id,) in host_ids.where(SurveyRoomModel.host_id.not_in(fresh)).order_by(SurveyRoomModel.host_id).tuples()]
+        logger.info(f"Survey {survey_id}: {nb_hosts} hosts, {len(to_fetch)} profiles to fetch")
+        return nb_hosts, self._fetch_all(lambda host_id: self.get_host(survey_id, host_id), to_fetch)
+
+    def get_host(self, survey_id:int, host_id:int) -> bool:
+        try:
+            response = self.request.search_rooms(self.config.URL_HOST_ROOT + str(host_id))
+            if response is None:
+                logger.info(f"Host {host_id}: not found")
+                return False
+            fetched_at = self._archive_page(survey_id, HOST_PAGE, host_id, response.content)
+            fields = parse_host_profile(response.content)
+            self.writer.put(self._save_hosts, dict(host_id=host_id, fetched_at=fetched_at, **fields))
+            return True
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            logger.exception(f"Host {host_id}: failed to retrieve from web site.")
+            return False
+
+    def reparse(self, survey_id:int) -> int:
+        """Map the archived host pages of a survey to host profiles again.
+
+        Returns the number of pages mapped.
+        """
+        rows = []
+        with self.metrics.timer("reparse_seconds"):
+            for host_id, fetched_at, body in self._archived_pages(survey_id, HOST_PAGE):
+                try:
+                    rows.append(dict(host_id=host_id, fetched_at=fetched_at, **parse_host_profile(body)))
+                except Exception as e:
+                    logger.warning(f"Host {host_id}: unreadable archived page: {e}")
+        with self.metrics.timer("db_write_seconds"), self.config.database.atomic():
+            for batch in peewee.chunked(rows, 500):
+                self._save_hosts(batch)
+        logger.info(f"Survey {survey_id}: {len(rows)} archived host pages mapped")
+        return len(rows)
+
+    def _save_hosts(self, rows:list) -> int:
+        host_fields = [getattr(HostModel, name) for name in HOST_FIELDS] + [HostModel.fetched_at]
+        # a reparsed page never replaces a profile fetched after it
+        (HostModel
+            .insert_many(rows)
+            .on_conflict(conflict_target=[HostModel.host_id], preserve=host_fields,
+                         where=(HostModel.fetched_at <= peewee.EXCLUDED.fetched_at))
+            .execute())
+        return len(rows)
+
+
+class ABListingExtraController(PageFetchController):
+    """Fill the rooms of a survey from their pages on the web site
+
+    Attributes:
+    ---
+        config: Config
+            Configuration object
+
+    Methods:
+    ---
+        fill_loop_by_room(survey_id:int, max_age:float=None) -> (int, int)
+        get_extras(survey_id:int, room_id:int) -> bool
+        reparse(survey_id:int) -> int
+        close()
+    """
+    def fill_loop_by_room(self, survey_id:int, max_age:float=None) -> tuple:
         """
         Master routine for looping over rooms (after a search)
         to fill in the properties.
+
+        The fields of room pages fetched less than max_age days ago
+        (fill_max_age by default), by any survey, are copied to the rooms
+        of the survey in bulk: only the pages of new rooms and stale pages
+        are fetched. Returns (rooms copied, rooms fetched).
         """
-        room_count = 0
-        while room_count < self.config.FILL_MAX_ROOM_COUNT:
-            if not self.config.HTTP_PROXY_LIST:
-                logging.info(
-                    "No proxies left: re-initialize after %s seconds",
-                    self.config.RE_INIT_SLEEP_TIME)
-                time.sleep(self.config.RE_INIT_SLEEP_TIME)  # be nice
-            room_count += 1
-            room_id = self._get_room_to_fill(survey_id)
-            if room_id is None:
-                return None
-            else:
-                self.get_extras(room_id)
+        max_age = self.config.FILL_MAX_AGE if max_age is None else max_age
+        fresh_after = datetime.now() - timedelta(days=max_age)
+        nb_copied = self._copy_room_pages(survey_id, fresh_after)
+        room_ids = self._get_rooms_to_fill(survey_id, fresh_after)
+        logger.info(f"Survey {survey_id}: {nb_copied} rooms filled from cached pages, {len(room_ids)} pages to fetch")
+        return nb_copied, self._fetch_all(lambda room_id: self.get_extras(survey_id, room_id), room_ids)
 
     def get_extras(self, survey_id:int, room_id:int) -> bool:
         try:
             # initialization
             logger.info("-" * 70)
             logger.info(f"Room {str(room_id)}: getting from Airbnb web site")
-            
-            room = RoomModel.get((RoomModel.room_id == room_id) & (RoomModel.survey_id == survey_id))
 
-            room_url = self.config.URL_ROOM_ROOT + str(room.room_id)
-            response = HTTPRequest
-            (self.config).ws_request_with_repeats(room_url)
+            room_url = self.config.URL_ROOM_ROOT + str(room_id)
+            response = self.request.search_rooms(room_url)
             if response is not None:
-                page = response.text
-                tree = html.fromstring(page)
-                self.__get_room_info_from_tree(survey_id, room_id, tree)
+                fetched_at = self._archive_page(survey_id, ROOM_PAGE, room_id, response.content)
+                from lxml import html
+                tree = html.fromstring(response.content)
+                fields = self.__get_room_info_from_tree(tree)
+                self.writer.put(self._save_room_pages, (survey_id, room_id, fetched_at, fields))
                 logger.info("Room %s: found", room_id)
                 return True
             else:
@@ -354,25 +864,70 @@ class ABListingExtraController():
             logger.exception("Room " + str(room_id) +
                              ": failed to retrieve from web site.")
             logger.error("Exception: " + str(type(ex)))
-            raise
+            return False
 
-    def _get_room_to_fill(self, survey_id:int) -> int:
-        # TODO refacto
-        """
-        For "fill" runs (loops over room pages), choose a random room that has
-        not yet been visited in this "fill".
+    def reparse(self, survey_id:int) -> int:
+        """Map the archived room pages of a survey to its rooms and to the
+        room page cache again.
+
+        Returns the number of pages mapped.
         """
-        for attempt in range(self.config.MAX_CONNECTION_ATTEMPTS):
-            try:
-                room = RoomModel.select().where(RoomModel.survey_id == survey_id).order_by(peewee.fn.Random()).limit(1).get()
-                return room.room_id
-            except TypeError as e:
-                # TODO should test nbrows
-                logging.info("Finishing: no unfilled rooms in database --")
-                return None
-            except Exception as e:
-                logging.exception(f"Error retrieving room to fill from db: {str(e)}")
-        return None
+        from lxml import html
+        pages = []
+        with self.metrics.timer("reparse_seconds"):
+            for room_id, fetched_at, body in self._archived_pages(survey_id, ROOM_PAGE):
+                try:
+                    fields = self.__get_room_info_from_tree(html.fromstring(body))
+                except Exception as e:
+                    logger.warning(f"Room {room_id}: unreadable archived page: {e}")
+                    continue
+                pages.append((survey_id, room_id, fetched_at, fields))
+        with self.metrics.timer("db_write_seconds"), self.config.database.atomic():
+            for batch in peewee.chunked(pages, 500):
+                self._save_room_pages(batch)
+        logger.info(f"Survey {survey_id}: {len(pages)} archived room pages mapped")
+        return len(pages)
+
+    def _save_room_pages(self, pages:list) -> int:
+        """Keep the fields of room pages for the next surveys, and fill the rooms of their survey.
+        pages: [(survey_id, room_id, fetched_at, fields)]"""
+        page_fields = [getattr(RoomPageModel, name) for name in ROOM_PAGE_FIELDS] + [RoomPageModel.fetched_at]
+        # a reparsed page never replaces a page fetched after it
+        (RoomPageModel
+            .insert_many([dict(room_id=room_id, fetched_at=fetched_at, **fields) for _, room_id, fetched_at, fields in pages])
+            .on_conflict(conflict_target=[RoomPageModel.room_id], preserve=page_fields,
+                         where=(RoomPageModel.fetched_at <= peewee.EXCLUDED.fetched_at))
+            .execute())
+        for survey_id, room_id, _, fields in pages:
+            found = {name: value for name, value in fields.items() if value is not None}
+            if found:
+                RoomModel.update(**found).where((RoomModel.room_id == room_id) & (RoomModel.survey_id == survey_id)).execute()
+        return len(pages)
+
+    def _fresh_pages(self, fresh_after:datetime):
+        return RoomPageModel.select(RoomPageModel.room_id).where(RoomPageModel.fetched_at >= fresh_after)
+
+    def _copy_room_pages(self, survey_id:int, fresh_after:datetime) -> int:
+        """Fill the rooms of a survey from the pages fetched after fresh_after, in a single UPDATE"""
+        updates = {}
+        for name in ROOM_PAGE_FIELDS:
+            # a field missing from the page keeps the value of the search
+            updates[getattr(RoomModel, name)] = (RoomPageModel
+                .select(peewee.fn.COALESCE(getattr(RoomPageModel, name), getattr(RoomModel, name)))
+                .where(RoomPageModel.room_id == RoomModel.room_id))
+        return (RoomModel
+            .update(updates)
+            .where((RoomModel.survey_id == survey_id) & (RoomModel.room_id.in_(self._fresh_pages(fresh_after))))
+            .execute())
+
+    def _get_rooms_to_fill(self, survey_id:int, fresh_after:datetime) -> list:
+        """Rooms of a survey without a page fetched after fresh_after, at most fill_max_room_count"""
+        query = (RoomModel
+            .select(RoomModel.room_id)
+            .where((RoomModel.survey_id == survey_id) & (RoomModel.room_id.not_in(self._fresh_pages(fresh_after))))
+            .order_by(RoomModel.room_id)
+            .limit(self.config.FILL_MAX_ROOM_COUNT))
+        return [room_id for (room_id,) in query.tuples()]
     
     def __get_country(self, tree):
         temp = tree.xpath(
@@ -540,6 +1095,7 @@ class ABListingExtraController():
         return reviews
 
     def __get_bedrooms(self, tree):
+        bedrooms = None
         temp = tree.xpath(
             "//div[@class='col-md-6']"
             "/div/span[text()[contains(.,'Bedrooms:')]]"
@@ -555,14 +1111,16 @@ class ABListingExtraController():
                 )
             if len(temp) > 0:
                 bedrooms = temp[0].strip()
-        if bedrooms:
-            bedrooms = bedrooms.split('+')[0]
-            bedrooms = bedrooms.split(' ')[0]
+        if not bedrooms:
+            return None
+        bedrooms = bedrooms.split('+')[0]
+        bedrooms = bedrooms.split(' ')[0]
         bedrooms = float(bedrooms)
     
         return bedrooms
 
     def __get_bathrooms(self, tree):
+        bathrooms = None
         temp = tree.xpath(
             "//div[@class='col-md-6']"
             "/div/span[text()[contains(.,'Bathrooms:')]]"
@@ -578,15 +1136,17 @@ class ABListingExtraController():
                 )
             if len(temp) > 0:
                 bathrooms = temp[0].strip()
-        if bathrooms:
-            bathrooms = bathrooms.split('+')[0]
-            bathrooms = bathrooms.split(' ')[0]
+        if not bathrooms:
+            return None
+        bathrooms = bathrooms.split('+')[0]
+        bathrooms = bathrooms.split(' ')[0]
         bathrooms = float(bathrooms)
         
         return bathrooms
 
     def __get_minstay(self, tree):
         # -- minimum stay --
+        minstay = None
         temp3 = tree.xpath(
             "//div[contains(@class,'col-md-6')"
             "and text()[contains(.,'minimum stay')]]"
@@ -608,14 +1168,16 @@ class ABListingExtraController():
             minstay = temp2[0].strip()
         elif len(temp1) > 0:
             minstay = temp1[0].strip()
-        if minstay is not None:
-            minstay = minstay.split('+')[0]
-            minstay = minstay.split(' ')[0]
+        if not minstay:
+            return None
+        minstay = minstay.split('+')[0]
+        minstay = minstay.split(' ')[0]
         minstay = int(minstay)
     
         return minstay
 
     def __get_price(self, tree):
+        price = None
         temp2 = tree.xpath(
             "//meta[@itemprop='price']/@content"
             )
@@ -628,6 +1190,8 @@ class ABListingExtraController():
             price = temp1[0][1:]
             non_decimal = re.compile(r'[^\d.]+')
             price = non_decimal.sub('', price)
+        if not price:
+            return None
         # Now find out if it's per night or per month
         # (see if the per_night div is hidden)
         per_month = tree.xpath(
@@ -638,41 +1202,24 @@ class ABListingExtraController():
         
         return price
         
-    def __get_room_info_from_tree(self, survey_id, room_id, tree):
-        try:
+    def __get_room_info_from_tree(self, tree) -> dict:
+        """Static fields of a room page, None for the fields the page misses"""
+        getters = {
+            'host_id': self.__get_host_id,
+            'room_type': self.__get_room_type,
+            'city': self.__get_city,
+            'neighborhood': self.__get_neighborhood,
+            'address': self.__get_address,
+            'bedrooms': self.__get_bedrooms,
+            'bathrooms': self.__get_bathrooms,
+        }
+        fields = {}
+        for name, getter in getters.items():
             # Some of these items do not appear on every page (eg,
-            # ratings, bathrooms), and so their absence is marked with
-            # logger.info. Others should be present for every room (eg,
-            # latitude, room_type, host_id) and so are marked with a
-            # warning.  Items coded in <meta
-            # property="airbedandbreakfast:*> elements -- country --
-            
-            query = RoomModel.update(
-                price = self.__get_price(tree),
-            ).where(
-                (RoomModel.room_id == room_id) & (RoomModel.survey_id == survey_id)
-            )
-            query.execute()
-
-            # NOT FILLING HERE, but maybe should? have to write helper methods:
-            # coworker_hosted, extra_host_languages, name,
-            #    property_type, currency, rate_type
-            
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except IndexError:
-            logger.exception("Web page has unexpected structure.")
-            raise
-        except UnicodeEncodeError as uee:
-            logger.exception("UnicodeEncodeError Exception at " +
-                             str(uee.object[uee.start:uee.end]))
-            raise
-        except AttributeError:
-            logger.exception("AttributeError")
-            raise
-        except TypeError:
-            logger.exception("TypeError parsing web page.")
-            raise
-        except Exception:
-            logger.exception("Error parsing web page.")
-            raise
\ No newline at end of file
+            # bathrooms), or the page has another structure
+            try:
+                fields[name] = getter(tree)
+            except (IndexError, KeyError, ValueError, TypeError, AttributeError):
+                logger.debug(f"No {name} in room page")
+                fields[name] = None
+        return fields
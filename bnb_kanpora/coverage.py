@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# ============================================================================
+# Online estimate of the number of listings of a survey area, and of the
+# share of them found so far, maintained as the nodes of the crawl complete
+# ============================================================================
+import logging
+
+logger = logging.getLogger()
+
+# Airbnb never reports more listings than this for a search
+LISTINGS_COUNT_CAP = 1001
+
+
+class _Node():
+    __slots__ = ("parent", "listings_count", "capped", "estimate", "children_sum", "nb_children")
+
+    def __init__(self, parent:str, prior:float) -> None:
+        self.parent = parent
+        # None until the node is searched
+        self.listings_count = None
+        self.capped = False
+        self.estimate = prior
+        self.children_sum = 0.0
+        self.nb_children = 0
+
+
+class CoverageEstimator():
+    """Estimate the number of listings of an area from the listings_count of
+    the nodes searched.
+
+    The listings_count of a node is exact unless Airbnb capped it: the
+    estimate of a capped node is the sum of the estimates of its children
+    (slices or splits partition the node), at least its listings_count. A
+    node not searched yet is estimated from its parent (prior). The total
+    is thus the sum of listings_count over the deepest un-capped nodes,
+    updated along the path to the root when a node completes.
+
+    Methods:
+    ---
+        add_node(node:str, parent:str=None, prior:float=0.0)
+        complete(node:str, listings_count:int, room_ids:iterable, capped:bool=None)
+            capped defaults to listings_count reaching the cap
+        total -> float
+            Estimated number of listings of the area
+        nb_observed -> int
+            Number of distinct listings found
+        coverage -> float
+            nb_observed / total
+    """
+    def __init__(self, cap:int=LISTINGS_COUNT_CAP) -> None:
+        self.cap = cap
+        self.root = None
+        self._nodes = {}
+        self._room_ids = set()
+
+    def add_node(self, node:str, parent:str=None, prior:float=0.0) -> None:
+        self._nodes[node] = _Node(parent, prior)
+        if parent is None:
+            self.root = node
+            return
+        parent_node = self._nodes[parent]
+        parent_node.nb_children += 1
+        self._add_to_children_sum(parent, prior)
+
+    def complete(self, node:str, listings_count:int, room_ids, capped:bool=None) -> None:
+        self._room_ids.update(room_ids)
+        state = self._nodes[node]
+        state.listings_count = listings_count
+        state.capped = listings_count >= self.cap if capped is None else capped
+        self._set_estimate(node, self._estimate(state))
+
+    def _estimate(self, state:_Node) -> float:
+        if state.listings_count is None:
+            return state.estimate
+        if not state.capped or state.nb_children == 0:
+            return state.listings_count
+        return max(state.listings_count, state.children_sum)
+
+    def _set_estimate(self, node:str, estimate:float) -> None:
+        state = self._nodes[node]
+        delta = estimate - state.estimate
+        state.estimate = estimate
+        if delta and state.parent is not None:
+            self._add_to_children_sum(state.parent, delta)
+
+    def _add_to_children_sum(self, node:str, delta:float) -> None:
+        # walk up while the estimates depend on the children
+        while node is not None:
+            state = self._nodes[node]
+            state.children_sum += delta
+            if state.listings_count is None:
+                return
+            estimate = self._estimate(state)
+            delta = estimate - state.estimate
+            state.estimate = estimate
+            if not delta:
+                return
+            node = state.parent
+
+    @property
+    def total(self) -> float:
+        if self.root is None:
+            return 0.0
+        return self._nodes[self.root].estimate
+
+    @property
+    def nb_observed(self) -> int:
+        return len(self._room_ids)
+
+    @property
+    def coverage(self) -> float:
+        total = self.total
+        if not total:
+            return None if self.root is None or self._nodes[self.root].listings_count is None else 1.0
+        return min(1.0, round(self.nb_observed / total, 4))
@@ -1,4 +1,7 @@
 from bnb_kanpora.config import Config, MODELS
+from bnb_kanpora.migrations import Migrator
+from bnb_kanpora.storage import create_views, drop_views
+from bnb_kanpora.fulltext import create_index, drop_index
 
 class DBUtils:
     def __init__(self, config:Config) -> None:
@@ -10,9 +13,28 @@ class DBUtils:
 
     def drop_tables(self):
         with self.database:
+            drop_index(self.database)
+            drop_views(self.database)
             self.database.drop_tables(MODELS)
         return True
 
+    def create_tables(self):
+        with self.database:
+            self.database.create_tables(MODELS)
+            create_views(self.database)
+            create_index(self.database)
+        return True
+
+    def migrate(self) -> list:
+        return Migrator(self.database).migrate()
+
+    def schema_version(self) -> int:
+        return Migrator(self.database).current_version()
+
+    def is_up_to_date(self) -> bool:
+        return not Migrator(self.database).pending()
+
     def check_connection(self):
-        self.database.is_connection_usable()
+        self.database.connect(reuse_if_open=True)
+        return self.database.is_connection_usable()
 
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+# ============================================================================
+# Decoding of explore_tabs responses: the body is parsed from bytes (no
+# charset detection and str copy), with orjson when it is installed, and
+# only listings_count and the PAGINATED_HOMES listings are extracted
+# ============================================================================
+import json
+import logging
+
+logger = logging.getLogger()
+
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    loads = json.loads
+    JSON_BACKEND = "json"
+
+SECTION_PAGINATED_HOMES = "PAGINATED_HOMES"
+SECTION_LOW_INVENTORY = "HOMES_LOW_INVENTORY_ZOOM_OUT"
+
+
+def decode_explore_tabs(body:bytes) -> tuple:
+    """Extract (listings_count, listings) from an explore_tabs response body.
+
+    listings is None when Airbnb answered with its low inventory section
+    (listings out of the searched box). Raises ValueError for invalid JSON
+    and KeyError for an unexpected structure.
+    """
+    explore_tabs = loads(body)['explore_tabs']
+    if len(explore_tabs) != 1:
+        raise KeyError('JSON Explore_tabs should only contain a single element')
+    explore_tab = explore_tabs[0]
+    listings_count = explore_tab['home_tab_metadata']['listings_count']
+    listings = []
+    if listings_count > 0:
+        for section in explore_tab['sections']:
+            section_type = section['section_type_uid']
+            if section_type == SECTION_LOW_INVENTORY:
+                return listings_count, None
+            if section_type == SECTION_PAGINATED_HOMES:
+                listings = section['listings']
+    return listings_count, listings
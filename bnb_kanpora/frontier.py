@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# ============================================================================
+# Best-first crawl: pending nodes are searched by decreasing number of new
+# listings expected per request, estimated from the results of their parent,
+# until the request budget or the deadline of the survey is spent
+# ============================================================================
+import heapq
+import itertools
+import math
+import time
+from bnb_kanpora.utils import GeoBox, SearchResults
+
+
+class CrawlBudget():
+    """Maximum number of requests and duration (seconds) of a crawl, and
+    share of the listings to find (see CoverageEstimator), None for no limit
+
+    Methods:
+    ---
+        start(count_requests:callable)
+            Start spending the budget, count_requests() returning the number of requests sent so far
+        exhausted() -> bool
+        target_reached(coverage:float) -> bool
+    """
+    def __init__(self, max_requests:int=None, duration:float=None, target_coverage:float=None) -> None:
+        self.max_requests = max_requests or None
+        self.duration = duration or None
+        self.target_coverage = target_coverage or None
+        self._count_requests = lambda: 0
+        self._requests_start = 0
+        self._deadline = None
+
+    @classmethod
+    def from_config(cls, config, max_requests:int=None, duration:float=None, target_coverage:float=None) -> 'CrawlBudget':
+        return cls(
+            max_requests=max_requests if max_requests is not None else config.SEARCH_MAX_REQUESTS,
+            duration=duration if duration is not None else config.SEARCH_MAX_DURATION,
+            target_coverage=target_coverage if target_coverage is not None else config.SEARCH_TARGET_COVERAGE,
+        )
+
+    @property
+    def is_limited(self) -> bool:
+        return self.max_requests is not None or self.duration is not None or self.target_coverage is not None
+
+    def start(self, count_requests) -> None:
+        self._count_requests = count_requests
+        self._requests_start = count_requests()
+        self._deadline = time.monotonic() + self.duration if self.duration else None
+
+    @property
+    def nb_requests(self) -> int:
+        return self._count_requests() - self._requests_start
+
+    def exhausted(self) -> bool:
+        if self.max_requests is not None and self.nb_requests >= self.max_requests:
+            return True
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def target_reached(self, coverage:float) -> bool:
+        return self.target_coverage is not None and coverage is not None and coverage >= self.target_coverage
+
+
+def estimate_children(results:SearchResults, children:list, page_size:int, capacity:int) -> list:
+    """Priority of each child of a saturated node: new listings expected per request.
+
+    The listings found by the parent are a sample of its box: a child is
+    expected to hold the parent's listings_count times the share of the
+    sample it matches, minus the listings of the sample it matches, which
+    are already found.
+
+    Returns (priority, expected listings) for each ((quadkey, filters), box) child.
+    """
+    rooms = results.rooms
+    nb_expected = max(results.nb_rooms_expected, len(rooms))
+    estimates = []
+    for (key, filters), box in children:
+        nb_found = sum(1 for room in rooms if box.contains(room.latitude, room.longitude) and filters.matches(room))
+        share = nb_found / len(rooms) if rooms else 1 / len(children)
+        child_expected = nb_expected * share
+        expected_new = max(0.0, child_expected - nb_found)
+        nb_pages = max(1, math.ceil(min(child_expected, capacity) / page_size))
+        estimates.append((expected_new / nb_pages, child_expected))
+    return estimates
+
+
+class Frontier():
+    """Priority queue of the nodes to search, highest priority first
+
+    Methods:
+    ---
+        push(node:tuple, box:GeoBox, priority:float=math.inf)
+        pop() -> (node, box)
+    """
+    def __init__(self) -> None:
+        self._heap = []
+        # insertion order breaks ties, so that a full crawl stays breadth-first
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, node:tuple, box:GeoBox, priority:float=math.inf) -> None:
+        heapq.heappush(self._heap, (-priority, next(self._counter), node, box))
+
+    def pop(self) -> tuple:
+        _, _, node, box = heapq.heappop(self._heap)
+        return node, box
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# ============================================================================
+# Full-text search over the name, address and license of rooms: an SQLite
+# FTS5 index fed by triggers on the room and observation tables, so that
+# keyword queries never scan the rooms
+# ============================================================================
+import logging
+from peewee import SQL, SqliteDatabase
+from bnb_kanpora.models import RoomModel, ListingModel, ObservationModel, SurveyModel, RoomSearchModel
+
+logger = logging.getLogger()
+
+# the index row of a room has the rowid of the room, the index row of an
+# observation the opposite of the rowid of the observation
+TRIGGERS = {
+    "room_fts_insert": """AFTER INSERT ON "{room}" BEGIN
+        INSERT INTO "{fts}" (rowid, name, address, license, survey_id, room_id)
+        VALUES (new.rowid, new.name, new.address, new.license, new.survey_id, new.room_id);
+    END""",
+    "room_fts_update": """AFTER UPDATE OF name, address, license ON "{room}" BEGIN
+        UPDATE "{fts}" SET name = new.name, address = new.address, license = new.license
+        WHERE rowid = old.rowid;
+    END""",
+    "room_fts_delete": """AFTER DELETE ON "{room}" BEGIN
+        DELETE FROM "{fts}" WHERE rowid = old.rowid;
+    END""",
+    "observation_fts_insert": """AFTER INSERT ON "{observation}" BEGIN
+        INSERT INTO "{fts}" (rowid, name, address, license, survey_id, room_id)
+        SELECT -new.rowid, name, address, license, new.survey_id, new.room_id
+        FROM "{listing}" WHERE listing_id = new.listing_id;
+    END""",
+    "observation_fts_delete": """AFTER DELETE ON "{observation}" BEGIN
+        DELETE FROM "{fts}" WHERE rowid = -old.rowid;
+    END""",
+}
+
+
+def is_available(database) -> bool:
+    return isinstance(database, SqliteDatabase) and RoomSearchModel.fts5_installed()
+
+
+def _tables() -> dict:
+    return dict(room=RoomModel._meta.table_name, observation=ObservationModel._meta.table_name,
+                listing=ListingModel._meta.table_name, fts=RoomSearchModel._meta.table_name)
+
+
+def create_index(database, model=RoomSearchModel) -> bool:
+    """Create the index of the rooms and the triggers keeping it in sync,
+    returns False when the database has no FTS5. Migrations pass the index
+    model of their schema version."""
+    if not is_available(database):
+        logger.info("SQLite FTS5 is not available, rooms are not indexed for full-text search")
+        return False
+    with database.bind_ctx([model]):
+        model.create_table(safe=True)
+    for name, body in TRIGGERS.items():
+        database.execute_sql(f'CREATE TRIGGER IF NOT EXISTS "{name}" ' + body.format(**_tables()))
+    rebuild_index(database)
+    return True
+
+
+def drop_index(database) -> None:
+    if not is_available(database):
+        return
+    for name in TRIGGERS:
+        database.execute_sql(f'DROP TRIGGER IF EXISTS "{name}"')
+    with database.bind_ctx([RoomSearchModel]):
+        RoomSearchModel.drop_table(safe=True)
+
+
+def rebuild_index(database) -> None:
+    """Index every room again, after rowids changed (e.g. by a full VACUUM)"""
+    tables = _tables()
+    with database.atomic():
+        database.execute_sql(f'DELETE FROM "{tables["fts"]}"')
+        database.execute_sql(
+            f'INSERT INTO "{tables["fts"]}" (rowid, name, address, license, survey_id, room_id) '
+            f'SELECT rowid, name, address, license, survey_id, room_id FROM "{tables["room"]}"')
+        database.execute_sql(
+            f'INSERT INTO "{tables["fts"]}" (rowid, name, address, license, survey_id, room_id) '
+            f'SELECT -o.rowid, l.name, l.address, l.license, o.survey_id, o.room_id '
+            f'FROM "{tables["observation"]}" AS o JOIN "{tables["listing"]}" AS l ON l.listing_id = o.listing_id')
+        database.execute_sql(f'INSERT INTO "{tables["fts"]}" ("{tables["fts"]}") VALUES (\'optimize\')')
+
+
+def search_rooms(query:str, survey_ids:list=None, search_area_id:int=None, field:str=None, limit:int=100):
+    """Rooms matching an FTS5 query, best matches first, with their bm25
+    score (lower is better).
+
+    Keyword arguments:
+    query:str -- FTS5 query: words, "phrases", prefix*, AND / OR / NOT
+    survey_ids:list[int] -- only the rooms of these surveys
+    search_area_id:int -- only the rooms of the surveys of this search area
+    field:str -- only search this column: name, address or license
+    limit:int -- maximum number of rooms, None for all
+    """
+    if field is not None:
+        if field not in ("name", "address", "license"):
+            raise ValueError(f"Unknown full-text field {field}, expected name, address or license")
+        query = f"{field} : ({query})"
+    rooms = (RoomSearchModel
+        .select(RoomSearchModel, RoomSearchModel.bm25().alias("score"))
+        .where(RoomSearchModel.match(query)))
+    if survey_ids:
+        rooms = rooms.where(RoomSearchModel.survey_id.in_([int(survey_id) for survey_id in survey_ids]))
+    if search_area_id is not None:
+        surveys = SurveyModel.select(SurveyModel.survey_id).where(SurveyModel.search_area_id == search_area_id)
+        rooms = rooms.where(RoomSearchModel.survey_id.in_(surveys))
+    rooms = rooms.order_by(SQL("score"))
+    if limit:
+        rooms = rooms.limit(limit)
+    return rooms
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# ============================================================================
+# Host profile pages: the attributes of a host are read from the user JSON
+# bootstrapped in the page, with the Open Graph title as a fallback for the
+# name
+# ============================================================================
+import json
+import logging
+from datetime import datetime
+
+logger = logging.getLogger()
+
+# host columns filled from a profile page
+HOST_FIELDS = ['name', 'location', 'about', 'languages', 'member_since',
+               'is_superhost', 'identity_verified', 'nb_listings', 'nb_reviews']
+
+
+def _parse_date(value:str):
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_host_profile(body:bytes) -> dict:
+    """Host columns found in a profile page, None for the missing ones"""
+    from lxml import html
+    tree = html.fromstring(body)
+    fields = dict.fromkeys(HOST_FIELDS)
+    bootstrap = tree.xpath("//meta[@id='_bootstrap-user']/@content")
+    if bootstrap:
+        try:
+            user = json.loads(bootstrap[0]).get("user") or {}
+        except ValueError:
+            logger.debug("Unreadable user JSON in host profile")
+            user = {}
+        fields.update(
+            name=user.get("first_name"),
+            location=user.get("location") or None,
+            about=user.get("about") or None,
+            languages=", ".join(user.get("languages") or []) or None,
+            member_since=_parse_date(user.get("created_at")),
+            is_superhost=user.get("is_superhost"),
+            identity_verified=user.get("identity_verified"),
+            nb_listings=user.get("listings_count"),
+            nb_reviews=user.get("reviewee_count"),
+        )
+    if fields["name"] is None:
+        title = tree.xpath("//meta[@property='og:title']/@content")
+        if title:
+            fields["name"] = title[0].strip() or None
+    return fields
@@ -5,16 +5,24 @@ a set of requests.
 
 Tom Slee, 2013--2017.
 """
-from json.decoder import JSONDecodeError
 import logging
-import random
 import re
 import requests
-import json
+import threading
+import time
+from datetime import date
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from bnb_kanpora.config import Config
-from bnb_kanpora.utils import GeoBox, SearchResults
+from bnb_kanpora.utils import GeoBox, SearchFilters, SearchResults
+from bnb_kanpora.metrics import MetricsRegistry
+from bnb_kanpora.throttle import AdaptiveRateController
+from bnb_kanpora.retry import Backoff, CircuitBreakers, SUCCESS, RENEW_SESSION, FATAL, classify_response, classify_exception, get_retry_after
+from bnb_kanpora.sessions import PooledSession, SessionPool
+from bnb_kanpora.records import RoomRecord
+from bnb_kanpora.decoding import decode_explore_tabs
+from bnb_kanpora.archive import SEARCH_PAGE
+from urllib.parse import urlparse
 
 # Set up logging
 logger = logging.getLogger()
@@ -24,15 +32,50 @@ LOW_INVENTORY_ENLARGE_FACTOR = 0.33
 # requests retry strategy
 MAX_RETRY_FOR_SESSION = 3
 BACK_OFF_FACTOR = 0.2
-TIME_BETWEEN_RETRIES = 1000
 
 class HTTPRequest():
+    """Send requests to Airbnb, paced by an adaptive rate controller.
 
-    def __init__(self, config:Config) -> None:
+    An HTTPRequest is shared by the crawler threads, which lease their
+    sessions from a pool of warm sessions. Search pages are kept in archive
+    (see archive.RawArchive) when it is set.
+    """
+
+    def __init__(self, config:Config, metrics:MetricsRegistry=None) -> None:
         self.config = config
-        self.session = self._get_session()
+        self._lock = threading.Lock()
+        self.throttle = AdaptiveRateController.from_config(config)
+        self.backoff = Backoff(config.RETRY_BACKOFF_BASE, config.RETRY_BACKOFF_MAX)
+        self.breakers = CircuitBreakers(config.CIRCUIT_BREAKER_THRESHOLD, config.CIRCUIT_BREAKER_RESET)
+        self.pool = SessionPool(
+            size=config.SESSION_POOL_SIZE,
+            factory=self._get_session,
+            proxies=config.HTTP_PROXY_LIST,
+            user_agents=config.USER_AGENT_LIST,
+            warmup_url=config.SESSION_WARMUP_URL,
+            warmup_timeout=config.HTTP_TIMEOUT,
+            is_usable=lambda proxy: not self.breakers.is_open(proxy),
+        )
+        self.metrics = metrics or MetricsRegistry()
+        self.archive = None
+        self.nb_requests = 0
+
+    @property
+    def metrics(self) -> MetricsRegistry:
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics:MetricsRegistry) -> None:
+        self._metrics = metrics
+        self.throttle.metrics = metrics
+        self.pool.metrics = metrics
+
+    def close(self) -> None:
+        self.pool.close()
 
-    def get_params(self, geobox:GeoBox=None, room_type:str=None, items_offset:str=None, section_offset:str=None) -> dict:
+    def get_params(self, geobox:GeoBox=None, room_type:str=None, items_offset:str=None, section_offset:str=None,
+                   price_min:int=None, price_max:int=None, checkin:date=None, checkout:date=None,
+                   guests:int=None) -> dict:
         params = {}
         params["_format"] = "for_explore_search_web"
         params["_intents"] = "p1"
@@ -80,6 +123,19 @@ class HTTPRequest():
         
         if room_type:
             params["room_types[]"] = room_type
+
+        if price_min is not None:
+            params["price_min"] = str(price_min)
+        if price_max is not None:
+            params["price_max"] = str(price_max)
+
+        # without dates, every room is listed whether it is booked or not
+        if checkin is not None:
+            params["checkin"] = checkin.isoformat()
+            params["checkout"] = checkout.isoformat()
+        if guests:
+            params["adults"] = str(guests)
+            params["guests"] = str(guests)
         
         if items_offset:
             params["items_offset"]   = str(items_offset)
@@ -88,47 +144,47 @@ class HTTPRequest():
 
         return params
 
-    def get_rooms_from_box(self, geobox:GeoBox, section_offset:int, items_offset:int) -> SearchResults:
-        params = self.get_params(geobox=geobox, section_offset=section_offset, items_offset=items_offset)
-        response = self.search_rooms(self.config.URL_API_SEARCH_ROOT, params)
-        rooms = []
+    def get_rooms_from_box(self, geobox:GeoBox, section_offset:int, items_offset:int, node:str=None,
+                           filters:SearchFilters=None) -> SearchResults:
+        filters = filters or SearchFilters()
+        params = self.get_params(geobox=geobox, section_offset=section_offset, items_offset=items_offset,
+                                 room_type=filters.room_type, price_min=filters.price_min, price_max=filters.price_max,
+                                 checkin=filters.checkin, checkout=filters.checkout, guests=filters.guests)
+        response = self.search_rooms(self.config.URL_API_SEARCH_ROOT, params, node=node)
         if response:
+            if self.archive is not None:
+                entry = self.archive.append(SEARCH_PAGE, node, response.content, page=section_offset)
+                self.metrics.inc("archive_bytes_total", entry.length)
+            parse_start = time.perf_counter()
             try:
-                response_dict = json.loads(response.text)
-                if len(response_dict['explore_tabs']) != 1:
-                    raise KeyError('JSON Explore_tabs should only contain a single element')
-                
-                nb_rooms_expected = response_dict['explore_tabs'][0]['home_tab_metadata']['listings_count']
-
-                if nb_rooms_expected > 0:
-                    for response_section in response_dict['explore_tabs'][0]['sections']:
-                        if response_section['section_type_uid'] == 'HOMES_LOW_INVENTORY_ZOOM_OUT':
-                            return SearchResults() 
-                        if response_section['section_type_uid'] == 'PAGINATED_HOMES':
-                            rooms = response_section['listings']
+                nb_rooms_expected, listings = decode_explore_tabs(response.content)
+                if listings is None:
+                    return SearchResults()
+                rooms = [RoomRecord.from_search_result(listing, self.config.SEARCH_KEEP_RAW_JSON)
+                         for listing in listings]
             except KeyError as e:
                 logger.warning(f"Unexpected JSON format : {e}")
-                return SearchResults() 
-            except JSONDecodeError as e:
+                return SearchResults(geobox=geobox, filters=filters, failed=True)
+            except ValueError as e:
                 logger.warning(f"Parsing JSON from response failed: {e}")
                 logger.warning(f"Reponse code : {response.status_code}, text: {response.text}")
-                return SearchResults() 
+                return SearchResults(geobox=geobox, filters=filters, failed=True)
+            finally:
+                self.metrics.observe("parse_seconds", time.perf_counter() - parse_start, node=node)
 
             return SearchResults(
                 nb_rooms_expected = nb_rooms_expected, 
                 rooms = rooms, 
-                geobox = geobox
+                geobox = geobox,
+                filters = filters
                 )
 
         # Bad Response
-        return SearchResults()
+        return SearchResults(geobox=geobox, filters=filters, failed=True)
 
-    def _get_session(self):
-        if len(self.config.USER_AGENT_LIST) > 0:
-            user_agent = random.choice(self.config.USER_AGENT_LIST)
-            headers = {"User-Agent": user_agent}
-        else:
-            headers = {'User-Agent': 'Mozilla/5.0'}
+    def _get_session(self, proxy:str=None, user_agent:str=None):
+        """New session through proxy (host:port, None for a direct connection) with user_agent"""
+        headers = {"User-Agent": user_agent or 'Mozilla/5.0'}
 
         # Now make the request
         # cookie to avoid auto-redirect
@@ -137,16 +193,16 @@ class HTTPRequest():
         session.headers.update(headers)
         session.cookies.update(cookies)
 
-        retry = Retry(total=MAX_RETRY_FOR_SESSION, read=MAX_RETRY_FOR_SESSION, connect=MAX_RETRY_FOR_SESSION,
+        # connection failures only: statuses, timeouts and read errors go through search_rooms
+        retry = Retry(total=MAX_RETRY_FOR_SESSION, connect=MAX_RETRY_FOR_SESSION, read=0, status=0,
                     backoff_factor=BACK_OFF_FACTOR,
-                    method_whitelist=frozenset(['GET', 'POST']))
+                    allowed_methods=frozenset(['GET', 'POST']))
         adapter = HTTPAdapter(max_retries=retry)
 
-        if self.config.HTTP_PROXY_LIST:
-            http_proxy = random.choice(self.config.HTTP_PROXY_LIST)
+        if proxy:
             session.proxies = {
-                'http': f'http://{http_proxy}',
-                'https': f'http://{http_proxy}',
+                'http': f'http://{proxy}',
+                'https': f'http://{proxy}',
                 }
 
         session.mount("http://www.airbnb.com", adapter)
@@ -154,23 +210,86 @@ class HTTPRequest():
         session.mount("https://ipinfo.io", adapter)
         return session
 
-    def search_rooms(self, url, params=None):
-        retry_attempts = 0
-        while(retry_attempts < self.config.MAX_CONNECTION_ATTEMPTS):
+    @staticmethod
+    def _proxy_name(pooled:PooledSession) -> str:
+        """Proxy of a session, without credentials"""
+        return pooled.proxy.split('@')[-1] if pooled.proxy else "direct"
+
+    def _record_response(self, response, elapsed:float, proxy:str, node:str=None) -> None:
+        self.metrics.observe("http_request_seconds", elapsed, node=node)
+        self.metrics.inc("http_responses_total", node=node, status=response.status_code)
+        self.metrics.inc("http_response_bytes_total", len(response.content), node=node)
+        self.metrics.observe("proxy_request_seconds", elapsed, proxy=proxy)
+        self.metrics.inc("proxy_responses_total", proxy=proxy, status=response.status_code)
+
+    @staticmethod
+    def _breaker_key(pooled:PooledSession, url:str) -> str:
+        """Circuit breakers are kept per proxy, or per endpoint without proxy"""
+        return pooled.proxy or urlparse(url).netloc
+
+    def search_rooms(self, url, params=None, node:str=None):
+        """GET url, retrying transient failures with backoff.
+
+        Returns the response, or None once MAX_CONNECTION_ATTEMPTS attempts
+        failed or for a failure retrying cannot fix.
+        """
+        for attempt in range(self.config.MAX_CONNECTION_ATTEMPTS):
+            # a session whose proxy circuit is closed, or the trial request of a half-open one
+            pooled = self.pool.acquire(accept=lambda pooled: self.breakers[self._breaker_key(pooled, url)].allow())
+            if pooled is None:
+                wait = max(self.breakers.remaining(), self.backoff.delay(attempt))
+                logger.info(f"Circuits open for every idle session, waiting {round(wait, 1)}s")
+                time.sleep(wait)
+                continue
+            breaker_key = self._breaker_key(pooled, url)
+            breaker = self.breakers[breaker_key]
+            proxy = self._proxy_name(pooled)
+
+            response = None
+            outcome = FATAL
+            self.throttle.acquire()
             try:
-                response = self.session.get(url=url, params=params, timeout=self.config.HTTP_TIMEOUT)
-                if response.status_code == 200:
-                    if len(response.text) > 0:
-                        return response
-                    else:
-                        retry_attempts += 1
-                        self.session = self._get_session()    
-                elif response.status_code == 403:
-                    logger.info(f"Access forbidden, will try to open a new connection... attempt {retry_attempts} on {self.config.MAX_CONNECTION_ATTEMPTS}")
-                    retry_attempts += 1
-                    self.session = self._get_session()
-            except Exception as e:
-                raise e
+                with self._lock:
+                    self.nb_requests += 1
+                start = time.perf_counter()
+                response = pooled.session.get(url=url, params=params, timeout=self.config.HTTP_TIMEOUT)
+                self._record_response(response, time.perf_counter() - start, proxy, node=node)
+                outcome = classify_response(response)
+            except requests.exceptions.RequestException as e:
+                outcome = classify_exception(e)
+                self.metrics.inc("http_errors_total", node=node, error=type(e).__name__, proxy=proxy)
+                if outcome == FATAL:
+                    logger.warning(f"Request failed, not retrying: {e}")
+            finally:
+                # only refusals, server errors and timeouts are congestion
+                self.throttle.release(None if outcome == FATAL else outcome == SUCCESS)
+                # a refused session is replaced in the background
+                self.pool.release(pooled, healthy=outcome != RENEW_SESSION)
+
+            if outcome == SUCCESS:
+                breaker.record_success()
+                return response
+            if outcome == FATAL:
+                # an answer, even a 404, shows the proxy works; without one,
+                # the trial of a half-open circuit must not stay pending
+                if response is not None:
+                    breaker.record_success()
+                else:
+                    breaker.release_trial()
+                self.metrics.inc("http_giveups_total", node=node, reason="fatal")
+                return None
+
+            if breaker.record_failure():
+                logger.warning(f"Circuit opened for {proxy if pooled.proxy else breaker_key} after {breaker.failures} consecutive failures")
+                self.metrics.inc("circuit_opened_total", key=proxy if pooled.proxy else breaker_key)
+            reason = response.status_code if response is not None else "error"
+            self.metrics.inc("http_retries_total", node=node, reason=reason)
+            delay = self.backoff.delay(attempt, get_retry_after(response))
+            logger.info(f"Request failed ({reason}), retrying in {round(delay, 2)}s... attempt {attempt + 1} on {self.config.MAX_CONNECTION_ATTEMPTS}")
+            time.sleep(delay)
+
+        self.metrics.inc("http_giveups_total", node=node, reason="attempts")
+        logger.warning(f"Giving up after {self.config.MAX_CONNECTION_ATTEMPTS} attempts on {url}")
         return None
 
 def get_public_ip(session):
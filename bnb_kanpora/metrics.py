@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+# ============================================================================
+# Crawl instrumentation: counters, gauges and latency histograms labelled by
+# survey node, HTTP status or proxy, exported to the metric table or to a
+# Prometheus text file
+# ============================================================================
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class Metric():
+    """Value of a metric for one set of labels"""
+    __slots__ = ("kind", "count", "sum", "buckets", "bucket_counts")
+
+    def __init__(self, kind:str, buckets:tuple=None) -> None:
+        self.kind = kind
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1) if buckets else None
+
+    def add(self, value:float) -> None:
+        self.count += 1
+        if self.kind == GAUGE:
+            self.sum = value
+            return
+        self.sum += value
+        if self.bucket_counts is not None:
+            self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def merge(self, other:'Metric') -> None:
+        self.count += other.count
+        self.sum = other.sum if self.kind == GAUGE else self.sum + other.sum
+        if self.bucket_counts is not None:
+            self.bucket_counts = [a + b for a, b in zip(self.bucket_counts, other.bucket_counts)]
+
+
+class MetricsRegistry():
+    """Thread-safe store of the metrics of a survey run
+
+    Methods:
+    ---
+        inc(name:str, value:float=1, **labels)
+        set(name:str, value:float, **labels)
+        observe(name:str, value:float, buckets:tuple=LATENCY_BUCKETS, **labels)
+        timer(name:str, **labels) -> context manager
+        to_prometheus(drop_labels:tuple=("node",)) -> str
+        save(survey_id:int) -> int
+    """
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name:str, kind:str, labels:dict, buckets:tuple=None) -> Metric:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = Metric(kind, buckets)
+        return metric
+
+    def inc(self, name:str, value:float=1, **labels) -> None:
+        with self._lock:
+            self._get(name, COUNTER, labels).add(value)
+
+    def set(self, name:str, value:float, **labels) -> None:
+        with self._lock:
+            self._get(name, GAUGE, labels).add(value)
+
+    def observe(self, name:str, value:float, buckets:tuple=LATENCY_BUCKETS, **labels) -> None:
+        with self._lock:
+            self._get(name, HISTOGRAM, labels, buckets).add(value)
+
+    @contextmanager
+    def timer(self, name:str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """(name, labels, metric) for every metric, sorted by name and labels"""
+        with self._lock:
+            items = sorted(self._metrics.items())
+        for (name, labels), metric in items:
+            yield name, dict(labels), metric
+
+    def value(self, name:str, **labels) -> float:
+        """Sum of a metric over every label set matching labels"""
+        total = 0
+        for sample_name, sample_labels, metric in self.samples():
+            if sample_name == name and all(sample_labels.get(k) == str(v) for k, v in labels.items()):
+                total += metric.sum
+        return total
+
+    def to_prometheus(self, drop_labels:tuple=("node",)) -> str:
+        """Prometheus text exposition, merging the label sets that only differ by drop_labels"""
+        merged = {}
+        for name, labels, metric in self.samples():
+            labels = tuple((k, v) for k, v in sorted(labels.items()) if k not in drop_labels)
+            key = (name, labels)
+            if key not in merged:
+                merged[key] = Metric(metric.kind, metric.buckets)
+            merged[key].merge(metric)
+
+        def format_labels(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+        lines = []
+        declared = set()
+        for (name, labels), metric in sorted(merged.items()):
+            metric_name = f"bnb_kanpora_{name}"
+            if metric_name not in declared:
+                lines.append(f"# TYPE {metric_name} {metric.kind}")
+                declared.add(metric_name)
+            if metric.kind == HISTOGRAM:
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{metric_name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric_name}_bucket{format_labels(labels, [('le', '+Inf')])} {metric.count}")
+                lines.append(f"{metric_name}_sum{format_labels(labels)} {metric.sum}")
+                lines.append(f"{metric_name}_count{format_labels(labels)} {metric.count}")
+            else:
+                lines.append(f"{metric_name}{format_labels(labels)} {metric.sum}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path:str) -> None:
+        # write then rename, so that a node_exporter textfile collector never reads a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def save(self, survey_id:int) -> int:
+        """Store every metric in the metric table, one row per label set"""
+        from peewee import chunked
+        from bnb_kanpora.models import MetricModel
+        rows = []
+        for name, labels, metric in self.samples():
+            node = labels.pop("node", None)
+            rows.append(dict(
+                survey_id=survey_id,
+                name=name,
+                kind=metric.kind,
+                node=node,
+                labels=json.dumps(labels) if labels else None,
+                count=metric.count,
+                sum=metric.sum,
+                buckets=json.dumps(dict(zip([str(b) for b in metric.buckets] + ["+Inf"], metric.bucket_counts))) if metric.buckets else None,
+            ))
+        with MetricModel._meta.database.atomic():
+            MetricModel.delete().where(MetricModel.survey_id == survey_id).execute()
+            for batch in chunked(rows, 500):
+                MetricModel.insert_many(batch).execute()
+        return len(rows)
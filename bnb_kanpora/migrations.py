@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+# ============================================================================
+# Schema migrations, applied in place on existing databases
+# ============================================================================
+import logging
+from peewee import IntegrityError, SqliteDatabase, PostgresqlDatabase
+from bnb_kanpora.models import SchemaVersionModel
+from bnb_kanpora.schema_history import (SearchAreaV1, SurveyV1, RoomV1, SurveyProgressV1, MetricV4, SearchAreaV5,
+                                        SurveyProgressV5, SearchAreaV6, RoomPageV7, HostV8, ListingV9, ObservationV9,
+                                        SurveyRollupV10, RoomSearchV11, AvailabilityV12, SurveyProgressV13)
+
+logger = logging.getLogger()
+
+# Columns that moved from DECIMAL to native REAL storage in migration 2, per model
+NATIVE_NUMERIC_COLUMNS = {
+    RoomV1: ['overall_satisfaction', 'bedrooms', 'bathrooms', 'latitude', 'longitude',
+                'rate', 'rate_with_service_fee', 'monthly_price_factor', 'weekly_price_factor'],
+    SurveyProgressV1: ['price_min', 'price_max'],
+}
+
+# search_area bounds moved to native REAL storage in migration 5
+SEARCH_AREA_NATIVE_COLUMNS = ['bb_n_lat', 'bb_e_lng', 'bb_s_lat', 'bb_w_lng']
+
+MIGRATIONS = []
+
+
+def migration(version:int, description:str):
+    """Register a migration function, applied once in version order"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _rebuild_table(database, model, casts:dict=None, native:list=None) -> None:
+    """Recreate the table of model from its definition and copy rows over.
+
+    SQLite cannot change a column type in place, so the table is renamed, the
+    new table created and filled with a single INSERT ... SELECT. casts maps
+    field names to the SQL type their values are cast to, native numeric
+    columns (NATIVE_NUMERIC_COLUMNS of model by default) are cast to REAL.
+    """
+    casts = casts or {}
+    native = NATIVE_NUMERIC_COLUMNS.get(model, []) if native is None else native
+    table = model._meta.table_name
+    old_table = f"{table}_old"
+    columns = [c.name for c in database.get_columns(table)]
+    select = []
+    for field in model._meta.sorted_fields:
+        if field.column_name not in columns:
+            continue
+        if field.name in casts:
+            select.append(f'CAST("{field.column_name}" AS {casts[field.name]})')
+        elif field.name in native:
+            select.append(f'CAST("{field.column_name}" AS REAL)')
+        else:
+            select.append(f'"{field.column_name}"')
+    insert_columns = ", ".join(f'"{f.column_name}"' for f in model._meta.sorted_fields if f.column_name in columns)
+
+    # indexes keep their name when the table is renamed and would collide
+    for index in database.get_indexes(table):
+        if not index.name.startswith("sqlite_autoindex"):
+            database.execute_sql(f'DROP INDEX IF EXISTS "{index.name}"')
+    # keep the foreign keys of other tables pointing to the table name, not
+    # to the renamed table that is dropped (foreign keys are disabled during
+    # migrations, see Migrator.migrate)
+    database.execute_sql('PRAGMA legacy_alter_table = ON')
+    database.execute_sql(f'ALTER TABLE "{table}" RENAME TO "{old_table}"')
+    database.execute_sql('PRAGMA legacy_alter_table = OFF')
+    model.create_table(safe=False)
+    database.execute_sql(
+        f'INSERT INTO "{table}" ({insert_columns}) SELECT {", ".join(select)} FROM "{old_table}"')
+    database.execute_sql(f'DROP TABLE "{old_table}"')
+
+
+def _has_decimal_columns(database, model, native:list=None) -> bool:
+    native = NATIVE_NUMERIC_COLUMNS.get(model, []) if native is None else native
+    native = set(model._meta.fields[name].column_name for name in native)
+    for column in database.get_columns(model._meta.table_name):
+        if column.name in native and column.data_type.upper().startswith(("DECIMAL", "NUMERIC")):
+            return True
+    return False
+
+
+@migration(1, "initial schema")
+def create_initial_schema(database) -> None:
+    models = [SearchAreaV1, SurveyV1, RoomV1, SurveyProgressV1]
+    with database.bind_ctx(models):
+        database.create_tables(models, safe=True)
+
+
+@migration(2, "native numeric columns and room lookup indexes")
+def native_numeric_and_indexes(database) -> None:
+    models = [RoomV1, SurveyV1, SurveyProgressV1]
+    with database.bind_ctx(models):
+        for model in NATIVE_NUMERIC_COLUMNS:
+            if not _has_decimal_columns(database, model):
+                continue
+            logger.info(f"Converting {model._meta.table_name} numeric columns to native types")
+            if isinstance(database, SqliteDatabase):
+                _rebuild_table(database, model)
+            else:
+                from playhouse.migrate import SchemaMigrator, migrate
+                migrator = SchemaMigrator.from_database(database)
+                migrate(*[migrator.alter_column_type(model._meta.table_name, model._meta.fields[name].column_name, model._meta.fields[name])
+                          for name in NATIVE_NUMERIC_COLUMNS[model]])
+
+        for model in models:
+            model._schema.create_indexes(safe=True)
+
+
+@migration(3, "PostGIS geometry of rooms")
+def postgis_room_geometry(database) -> None:
+    if not isinstance(database, PostgresqlDatabase):
+        return
+    available = database.execute_sql("SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'").fetchone()
+    if not available:
+        logger.info("PostGIS is not available, rooms are stored without geometry")
+        return
+    table = RoomV1._meta.table_name
+    database.execute_sql("CREATE EXTENSION IF NOT EXISTS postgis")
+    database.execute_sql(
+        f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "geom" geometry(Point, 4326) '
+        'GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint("longitude", "latitude"), 4326)) STORED')
+    database.execute_sql(f'CREATE INDEX IF NOT EXISTS "{table}_geom" ON "{table}" USING GIST ("geom")')
+
+
+@migration(4, "crawl metrics")
+def crawl_metrics(database) -> None:
+    with database.bind_ctx([MetricV4]):
+        database.create_tables([MetricV4], safe=True)
+
+
+@migration(5, "native search area bounds and integer quadtree nodes")
+def integer_quadtree_nodes(database) -> None:
+    from bnb_kanpora.quadtree import QuadTree
+    with database.bind_ctx([SearchAreaV5, SurveyProgressV5]):
+        if _has_decimal_columns(database, SearchAreaV5, SEARCH_AREA_NATIVE_COLUMNS):
+            logger.info("Converting search_area bounds to native types")
+            if isinstance(database, SqliteDatabase):
+                _rebuild_table(database, SearchAreaV5, native=SEARCH_AREA_NATIVE_COLUMNS)
+            else:
+                from playhouse.migrate import SchemaMigrator, migrate
+                migrator = SchemaMigrator.from_database(database)
+                migrate(*[migrator.alter_column_type(SearchAreaV5._meta.table_name, name, SearchAreaV5._meta.fields[name])
+                          for name in SEARCH_AREA_NATIVE_COLUMNS])
+
+        # quadtree nodes were stored as strings: 0, 0-2, 0-2-1... every legacy
+        # node starts with the root 0, which no integer quadkey does. SQLite may
+        # already hold the root as the integer 0 when migration 2 rebuilt the table
+        table = SurveyProgressV5._meta.table_name
+        for progress_id, node in database.execute_sql(f'SELECT "id", "quadtree_node" FROM "{table}"').fetchall():
+            if str(node).startswith("0"):
+                (SurveyProgressV5
+                    .update(quadtree_node=QuadTree.from_string(str(node)))
+                    .where(SurveyProgressV5.id == progress_id)
+                    .execute())
+        if isinstance(database, SqliteDatabase):
+            _rebuild_table(database, SurveyProgressV5, casts={'quadtree_node': 'INTEGER'})
+        else:
+            database.execute_sql(f'ALTER TABLE "{table}" ALTER COLUMN "quadtree_node" TYPE BIGINT USING "quadtree_node"::bigint')
+            database.execute_sql(f'ALTER TABLE "{table}" ALTER COLUMN "room_type" DROP NOT NULL')
+
+
+@migration(6, "polygon search areas")
+def search_area_polygon(database) -> None:
+    table = SearchAreaV6._meta.table_name
+    if "polygon" in [c.name for c in database.get_columns(table)]:
+        return
+    from playhouse.migrate import SchemaMigrator, migrate
+    migrator = SchemaMigrator.from_database(database)
+    migrate(migrator.add_column(table, "polygon", SearchAreaV6.polygon))
+
+
+@migration(7, "room page cache")
+def room_page_cache(database) -> None:
+    with database.bind_ctx([RoomPageV7]):
+        database.create_tables([RoomPageV7], safe=True)
+
+
+@migration(8, "host profiles")
+def host_profiles(database) -> None:
+    with database.bind_ctx([HostV8]):
+        database.create_tables([HostV8], safe=True)
+
+
+@migration(9, "normalized listings and observations")
+def normalized_rooms(database) -> None:
+    from bnb_kanpora.storage import create_views
+    with database.bind_ctx([ListingV9, ObservationV9]):
+        database.create_tables([ListingV9, ObservationV9], safe=True)
+    create_views(database, room=RoomV1, listing=ListingV9, observation=ObservationV9)
+
+
+@migration(10, "survey rollups")
+def survey_rollups(database) -> None:
+    with database.bind_ctx([SurveyRollupV10]):
+        database.create_tables([SurveyRollupV10], safe=True)
+
+
+@migration(11, "full-text index of rooms")
+def room_fulltext_index(database) -> None:
+    from bnb_kanpora.fulltext import create_index
+    create_index(database, model=RoomSearchV11)
+
+
+@migration(12, "availability sweeps")
+def availability_sweeps(database) -> None:
+    with database.bind_ctx([AvailabilityV12]):
+        database.create_tables([AvailabilityV12], safe=True)
+
+
+@migration(13, "failed survey nodes")
+def failed_survey_nodes(database) -> None:
+    table = SurveyProgressV13._meta.table_name
+    if "failed" in [c.name for c in database.get_columns(table)]:
+        return
+    from playhouse.migrate import SchemaMigrator, migrate
+    migrator = SchemaMigrator.from_database(database)
+    migrate(migrator.add_column(table, "failed", SurveyProgressV13.failed))
+
+
+class Migrator():
+    """Apply pending schema migrations to a database
+
+    Attributes:
+    ---
+        database: peewee.Database
+            Database bound to the models
+
+    Methods:
+    ---
+        current_version() -> int
+        pending() -> list
+        migrate() -> list[int]
+    """
+    def __init__(self, database) -> None:
+        self.database = database
+
+    def current_version(self) -> int:
+        if not self.database.table_exists(SchemaVersionModel._meta.table_name):
+            return 0
+        return SchemaVersionModel.select(SchemaVersionModel.version).order_by(SchemaVersionModel.version.desc()).scalar() or 0
+
+    def pending(self) -> list:
+        version = self.current_version()
+        return [m for m in MIGRATIONS if m[0] > version]
+
+    def migrate(self) -> list:
+        """Apply every pending migration, each one in its own transaction"""
+        self.database.create_tables([SchemaVersionModel], safe=True)
+        applied = []
+        is_sqlite = isinstance(self.database, SqliteDatabase)
+        if is_sqlite:
+            foreign_keys = self.database.execute_sql("PRAGMA foreign_keys").fetchone()[0]
+        for version, description, func in self.pending():
+            logger.info(f"Applying migration {version}: {description}")
+            # SQLite tables are rebuilt while other tables reference them:
+            # foreign keys can only be disabled outside of a transaction, and
+            # are checked before the migration commits
+            if is_sqlite:
+                self.database.execute_sql("PRAGMA foreign_keys = OFF")
+            try:
+                with self.database.atomic():
+                    func(self.database)
+                    if is_sqlite and self.database.execute_sql("PRAGMA foreign_key_check").fetchone():
+                        raise IntegrityError(f"Migration {version} breaks foreign key constraints")
+                    SchemaVersionModel.create(version=version, description=description)
+            finally:
+                if is_sqlite:
+                    self.database.execute_sql(f"PRAGMA foreign_keys = {foreign_keys}")
+            applied.append(version)
+        if applied and is_sqlite:
+            # refresh the planner statistics used to pick the new indexes
+            self.database.execute_sql("ANALYZE")
+        return applied
@@ -1,6 +1,7 @@
 from bnb_kanpora.utils import GeoBox
 
-from peewee import AutoField, BooleanField, CharField, CompositeKey, ForeignKeyField, Model, IntegerField, DecimalField, DateTimeField, SmallIntegerField, TextField, BigIntegerField
+from playhouse.sqlite_ext import FTS5Model, SearchField
+from peewee import AutoField, BooleanField, CharField, CompositeKey, ForeignKeyField, Model, IntegerField, DecimalField, DateField, DateTimeField, SmallIntegerField, TextField, BigIntegerField, FloatField
 from datetime import datetime
 
 class SearchAreaModel(Model):
@@ -10,13 +11,16 @@ class SearchAreaModel(Model):
     search_area_id = AutoField()
     name = CharField(255, default='UNKNOWN')
     abbreviation  = CharField(255, null=True)
-    bb_n_lat = DecimalField(30,6)
-    bb_e_lng = DecimalField(30,6)
-    bb_s_lat = DecimalField(30,6)
-    bb_w_lng = DecimalField(30,6)
+    bb_n_lat = FloatField()
+    bb_e_lng = FloatField()
+    bb_s_lat = FloatField()
+    bb_w_lng = FloatField()
+    # GeoJSON geometry within the bounding box, None to search the whole box
+    polygon = TextField(null=True)
 
     def __str__(self):
-        return f"{self.search_area_id} : {self.name}, http://bboxfinder.com/#{self.bb_s_lat},{self.bb_w_lng},{self.bb_n_lat},{self.bb_e_lng}"
+        polygon = " (polygon)" if self.polygon else ""
+        return f"{self.search_area_id} : {self.name}, http://bboxfinder.com/#{self.bb_s_lat},{self.bb_w_lng},{self.bb_n_lat},{self.bb_e_lng}{polygon}"
 
     @property
     def geobox(self):
@@ -27,6 +31,14 @@ class SearchAreaModel(Model):
             w_lng=self.bb_w_lng,
         )
 
+    @property
+    def search_polygon(self):
+        if not self.polygon:
+            return None
+        # numpy is only imported by commands searching polygon areas
+        from bnb_kanpora.polygon import SearchPolygon
+        return SearchPolygon.from_geojson(self.polygon)
+
 
 class SurveyModel(Model):
     class Meta:
@@ -48,6 +60,13 @@ class RoomModel(Model):
     class Meta:
         table_name = "room"
         primary_key = CompositeKey('survey_id', 'room_id')
+        # rooms are looked up across surveys by listing, host, city and position
+        indexes = (
+            (('room_id',), False),
+            (('host_id',), False),
+            (('city',), False),
+            (('latitude', 'longitude'), False),
+        )
     
     survey_id = ForeignKeyField(SurveyModel, backref='rooms')
     room_id = BigIntegerField()
@@ -58,34 +77,243 @@ class RoomModel(Model):
     neighborhood = CharField(255, null=True)
     address = CharField(2000)
     reviews = IntegerField(null=True)
-    overall_satisfaction = DecimalField(5,2, null=True)
+    overall_satisfaction = FloatField(null=True)
     accommodates = IntegerField(null=True)
-    bedrooms = DecimalField(5,2, null=True)
-    bathrooms = DecimalField(5,2, null=True)
+    bedrooms = FloatField(null=True)
+    bathrooms = FloatField(null=True)
     deleted = BooleanField(default=False)
     license = CharField(2000, null=True)
     last_modified = DateTimeField(default=datetime.now)
-    latitude = DecimalField(30,6)
-    longitude = DecimalField(30,6)
+    latitude = FloatField()
+    longitude = FloatField()
+    coworker_hosted = IntegerField(null=True)
+    extra_host_languages = CharField(100, null=True)
+    currency = CharField(20, null=True)
+    picture_url = CharField(200, null=True)
+    pdp_type = CharField(200, null=True)
+    pdp_url_type = CharField(200, null=True)
+    rate = FloatField(null=True)
+    rate_with_service_fee = FloatField(null=True)
+    monthly_price_factor = FloatField(null=True)
+    weekly_price_factor = FloatField(null=True)
+
+class ListingModel(Model):
+    """Slowly changing attributes of a room, stored once per distinct set of
+    values and shared by the observations of every survey, see storage.py"""
+    class Meta:
+        table_name = "listing"
+        indexes = (
+            (('room_id',), False),
+            (('host_id',), False),
+        )
+
+    listing_id = AutoField()
+    content_hash = CharField(32, unique=True)
+    room_id = BigIntegerField()
+    host_id = BigIntegerField()
+    name = CharField(255)
+    room_type = CharField(100)
+    city = CharField(100)
+    neighborhood = CharField(255, null=True)
+    address = CharField(2000)
+    accommodates = IntegerField(null=True)
+    bedrooms = FloatField(null=True)
+    bathrooms = FloatField(null=True)
+    license = CharField(2000, null=True)
     coworker_hosted = IntegerField(null=True)
     extra_host_languages = CharField(100, null=True)
     currency = CharField(20, null=True)
     picture_url = CharField(200, null=True)
     pdp_type = CharField(200, null=True)
     pdp_url_type = CharField(200, null=True)
-    rate = DecimalField(5,2, null=True)
-    rate_with_service_fee = DecimalField(5,2, null=True)
-    monthly_price_factor = DecimalField(5,3, null=True)
-    weekly_price_factor = DecimalField(5,3, null=True)
+
+
+class ObservationModel(Model):
+    """Values of a room seen by a normalized survey, its other attributes are in its listing"""
+    class Meta:
+        table_name = "observation"
+        primary_key = CompositeKey('survey_id', 'room_id')
+        indexes = (
+            (('room_id',), False),
+            (('latitude', 'longitude'), False),
+        )
+
+    survey_id = ForeignKeyField(SurveyModel, backref='observations', on_delete='CASCADE')
+    room_id = BigIntegerField()
+    listing_id = ForeignKeyField(ListingModel, backref='observations')
+    reviews = IntegerField(null=True)
+    overall_satisfaction = FloatField(null=True)
+    deleted = BooleanField(default=False)
+    last_modified = DateTimeField(default=datetime.now)
+    latitude = FloatField()
+    longitude = FloatField()
+    rate = FloatField(null=True)
+    rate_with_service_fee = FloatField(null=True)
+    monthly_price_factor = FloatField(null=True)
+    weekly_price_factor = FloatField(null=True)
+
+
+class SurveyRoomModel(RoomModel):
+    """Rooms of every survey, from the room table or from the observations
+    and listings of normalized surveys: read only view"""
+    class Meta:
+        table_name = "survey_room"
+
+
+class RoomSearchModel(FTS5Model):
+    """FTS5 index of the name, address and license of the rooms of every
+    survey, kept in sync with the room and observation tables by triggers
+    (SQLite only), see fulltext.py"""
+    class Meta:
+        table_name = "room_fts"
+        options = {'tokenize': "unicode61 remove_diacritics 2"}
+
+    name = SearchField()
+    address = SearchField()
+    license = SearchField()
+    survey_id = SearchField(unindexed=True)
+    room_id = SearchField(unindexed=True)
+
+    def __str__(self):
+        license = f", license {self.license}" if self.license else ""
+        return f"Survey {self.survey_id}, room {self.room_id}: {self.name}, {self.address}{license}"
+
+
+class SurveyRollupModel(Model):
+    """Aggregates of the rooms of a purged survey, by room type, see retention.py"""
+    class Meta:
+        table_name = "survey_rollup"
+        indexes = (
+            (('search_area_id', 'survey_date'), False),
+        )
+
+    rollup_id = AutoField()
+    # the survey and its search area may be deleted
+    survey_id = IntegerField()
+    search_area_id = IntegerField()
+    survey_date = DateTimeField()
+    room_type = CharField(100)
+    nb_rooms = IntegerField()
+    nb_hosts = IntegerField()
+    nb_licensed = IntegerField()
+    avg_rate = FloatField(null=True)
+    min_rate = FloatField(null=True)
+    max_rate = FloatField(null=True)
+    avg_reviews = FloatField(null=True)
+    avg_satisfaction = FloatField(null=True)
+    created_at = DateTimeField(default=datetime.now)
+
+    def __str__(self):
+        return f"Survey {self.survey_id} ({self.survey_date}), {self.room_type}: {self.nb_rooms} rooms, {self.nb_hosts} hosts, average rate {self.avg_rate}"
+
+
+class RoomPageModel(Model):
+    """Fields extracted from the latest page of a room, shared by the surveys"""
+    class Meta:
+        table_name = "room_page"
+        indexes = (
+            (('fetched_at',), False),
+        )
+
+    room_id = BigIntegerField(primary_key=True)
+    fetched_at = DateTimeField(default=datetime.now)
+    host_id = BigIntegerField(null=True)
+    room_type = CharField(100, null=True)
+    city = CharField(100, null=True)
+    neighborhood = CharField(255, null=True)
+    address = CharField(2000, null=True)
+    bedrooms = FloatField(null=True)
+    bathrooms = FloatField(null=True)
+
+
+class HostModel(Model):
+    """Attributes of a host, from the latest fetch of its profile page"""
+    class Meta:
+        table_name = "host"
+        indexes = (
+            (('fetched_at',), False),
+        )
+
+    host_id = BigIntegerField(primary_key=True)
+    fetched_at = DateTimeField(default=datetime.now)
+    name = CharField(255, null=True)
+    location = CharField(255, null=True)
+    about = TextField(null=True)
+    languages = CharField(255, null=True)
+    member_since = DateField(null=True)
+    is_superhost = BooleanField(null=True)
+    identity_verified = BooleanField(null=True)
+    nb_listings = IntegerField(null=True)
+    nb_reviews = IntegerField(null=True)
+
+    def __str__(self):
+        return f"Host {self.host_id}: {self.name}, {self.nb_listings} listings"
+
 
 class SurveyProgressModel(Model):
     class Meta:
         table_name = "survey_progress"
 
     survey_id = ForeignKeyField(SurveyModel)
-    room_type = CharField(100)
+    room_type = CharField(100, null=True)
     guests = IntegerField(null=True)
-    price_min = DecimalField(5,2,null=True)
-    price_max = DecimalField(52, null=True)
-    quadtree_node = CharField(1000)
+    price_min = FloatField(null=True)
+    price_max = FloatField(null=True)
+    # integer quadkey, see quadtree.QuadTree
+    quadtree_node = BigIntegerField()
+    # the search of the node failed: it is not a leaf and its area was not surveyed
+    failed = BooleanField(default=False)
     last_modified = DateTimeField(default=datetime.now)
+
+
+class AvailabilityModel(Model):
+    """Rooms listed by a search of the leaves of a survey for a stay, i.e.
+    available from checkin to checkout for guests, see SearchSurveyController.sweep"""
+    class Meta:
+        table_name = "availability"
+        primary_key = CompositeKey('survey_id', 'checkin', 'checkout', 'guests', 'room_id')
+        indexes = (
+            (('room_id',), False),
+        )
+
+    survey_id = ForeignKeyField(SurveyModel, backref='availabilities', on_delete='CASCADE')
+    checkin = DateField()
+    checkout = DateField()
+    guests = IntegerField()
+    room_id = BigIntegerField()
+    # rate for the stay, as listed
+    rate = FloatField(null=True)
+    last_modified = DateTimeField(default=datetime.now)
+
+
+class MetricModel(Model):
+    class Meta:
+        table_name = "metric"
+
+    metric_id = AutoField()
+    survey_id = ForeignKeyField(SurveyModel, backref='metrics', on_delete='CASCADE')
+    name = CharField(100)
+    kind = CharField(20)
+    node = CharField(1000, null=True)
+    labels = TextField(null=True)
+    count = IntegerField(default=0)
+    sum = FloatField(default=0)
+    buckets = TextField(null=True)
+    last_modified = DateTimeField(default=datetime.now)
+
+    def __str__(self):
+        node = f" node {self.node}" if self.node else ""
+        labels = f" {self.labels}" if self.labels else ""
+        return f"{self.name}{node}{labels}: count={self.count} sum={round(self.sum, 6)}"
+
+
+class SchemaVersionModel(Model):
+    class Meta:
+        table_name = "schema_version"
+
+    version = IntegerField(primary_key=True)
+    description = CharField(255, null=True)
+    applied_at = DateTimeField(default=datetime.now)
+
+    def __str__(self):
+        return f"Schema version {self.version}: {self.description} ({self.applied_at})"
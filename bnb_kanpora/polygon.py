@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# ============================================================================
+# Polygon search areas: a search area may be an administrative boundary
+# (GeoJSON or WKT) rather than its bounding box. Quadtree nodes outside the
+# polygon are not searched and listings outside it are dropped. Tests are
+# vectorized with numpy over the edges of the polygon.
+# ============================================================================
+import json
+import logging
+import re
+import numpy as np
+from bnb_kanpora.utils import GeoBox, SearchResults
+
+logger = logging.getLogger()
+
+WKT_POLYGON = re.compile(r"^\s*(MULTI)?POLYGON\s*\((.*)\)\s*$", re.I | re.S)
+WKT_POLYGON_PART = re.compile(r"\(\s*(\(.*?\))\s*\)", re.S)
+WKT_RING = re.compile(r"\(([^()]*)\)")
+
+
+class SearchPolygon():
+    """Polygon of a search area, possibly with holes or several parts
+
+    Points are inside according to the even-odd rule over all the rings,
+    which matches the GeoJSON semantics as long as the parts of a
+    multipolygon do not overlap.
+
+    Attributes:
+    ---
+        polygons:list
+            Parts of the polygon, each one a list of rings of (lng, lat)
+            coordinates, the first ring being the outer boundary
+
+    Methods:
+    ---
+        from_geojson(geojson:str|dict) -> SearchPolygon
+            Polygon or MultiPolygon geometry, Feature or FeatureCollection
+        from_wkt(wkt:str) -> SearchPolygon
+        load(path:str) -> SearchPolygon
+            GeoJSON or WKT file
+        to_geojson() -> str
+        bounds -> GeoBox
+        contains_points(lats, lngs) -> np.ndarray
+        intersects_boxes(boxes) -> np.ndarray
+            boxes as (n_lat, e_lng, s_lat, w_lng) rows, see QuadTree.boxes
+        filter_results(results:SearchResults) -> SearchResults
+    """
+    def __init__(self, polygons:list) -> None:
+        self.polygons = [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings] for rings in polygons]
+        rings = [ring for rings in self.polygons for ring in rings]
+        if not rings or any(len(ring) < 3 for ring in rings):
+            raise ValueError("A polygon needs rings of at least 3 points")
+        # edges of every ring, closed whether or not the last point repeats the first
+        starts = np.concatenate(rings)
+        ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+        self._x0, self._y0 = starts[:, 0], starts[:, 1]
+        self._x1, self._y1 = ends[:, 0], ends[:, 1]
+
+    @classmethod
+    def from_geojson(cls, geojson) -> 'SearchPolygon':
+        if isinstance(geojson, str):
+            geojson = json.loads(geojson)
+        kind = geojson.get("type")
+        if kind == "FeatureCollection":
+            polygons = []
+            for feature in geojson["features"]:
+                polygons.extend(cls.from_geojson(feature).polygons)
+            return cls(polygons)
+        if kind == "Feature":
+            return cls.from_geojson(geojson["geometry"])
+        if kind == "Polygon":
+            return cls([geojson["coordinates"]])
+        if kind == "MultiPolygon":
+            return cls(geojson["coordinates"])
+        raise ValueError(f"Unsupported GeoJSON type: {kind}")
+
+    @classmethod
+    def from_wkt(cls, wkt:str) -> 'SearchPolygon':
+        match = WKT_POLYGON.match(wkt)
+        if match is None:
+            raise ValueError("Only POLYGON and MULTIPOLYGON WKT are supported")
+        body = match.group(2)
+        parts = WKT_POLYGON_PART.findall(f"({body})") if match.group(1) else [body]
+        return cls([
+            [[[float(value) for value in point.split()] for point in ring.split(",")] for ring in WKT_RING.findall(part)]
+            for part in parts])
+
+    @classmethod
+    def load(cls, path:str) -> 'SearchPolygon':
+        with open(path) as f:
+            content = f.read()
+        if content.lstrip().startswith("{"):
+            return cls.from_geojson(content)
+        return cls.from_wkt(content)
+
+    def to_geojson(self) -> str:
+        return json.dumps({
+            "type": "MultiPolygon",
+            "coordinates": [[ring.tolist() for ring in rings] for rings in self.polygons],
+        })
+
+    @property
+    def bounds(self) -> GeoBox:
+        x = np.concatenate([self._x0, self._x1])
+        y = np.concatenate([self._y0, self._y1])
+        return GeoBox(n_lat=y.max(), e_lng=x.max(), s_lat=y.min(), w_lng=x.min())
+
+    def contains_points(self, lats, lngs) -> np.ndarray:
+        """Even-odd ray casting, for every point against every edge at once"""
+        y = np.asarray(lats, dtype=np.float64)[:, None]
+        x = np.asarray(lngs, dtype=np.float64)[:, None]
+        straddles = (self._y0 > y) != (self._y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = self._x0 + (y - self._y0) * (self._x1 - self._x0) / (self._y1 - self._y0)
+        crossings = np.count_nonzero(straddles & (x < x_cross), axis=1)
+        return crossings % 2 == 1
+
+    def intersects_boxes(self, boxes) -> np.ndarray:
+        """Whether each box overlaps the polygon.
+
+        A box overlaps the polygon when an edge of the polygon enters it
+        (Liang-Barsky clipping of every edge by every box), or else when it
+        lies entirely inside the polygon, tested on its centre.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n_lat, e_lng, s_lat, w_lng = (boxes[:, i, None] for i in range(4))
+        dx, dy = self._x1 - self._x0, self._y1 - self._y0
+        t_enter = np.zeros((len(boxes), len(dx)))
+        t_exit = np.ones((len(boxes), len(dx)))
+        inside = np.ones((len(boxes), len(dx)), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for p, q in ((-dx, self._x0 - w_lng), (dx, e_lng - self._x0),
+                         (-dy, self._y0 - s_lat), (dy, n_lat - self._y0)):
+                p = np.broadcast_to(p, q.shape)
+                t = q / p
+                inside &= ~((p == 0) & (q < 0))
+                t_enter = np.where(p < 0, np.maximum(t_enter, t), t_enter)
+                t_exit = np.where(p > 0, np.minimum(t_exit, t), t_exit)
+        crossed = np.any(inside & (t_enter <= t_exit), axis=1)
+        centres = self.contains_points((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2)
+        return crossed | centres
+
+    def filter_results(self, results:SearchResults) -> SearchResults:
+        """Results restricted to the listings in the polygon.
+
+        nb_rooms_expected is scaled by the share of the listings found in
+        the polygon, it is exact when every listing of the box was found.
+        """
+        rooms = [room for room in results.rooms if room.latitude is not None and room.longitude is not None]
+        if rooms:
+            mask = self.contains_points([room.latitude for room in rooms], [room.longitude for room in rooms])
+            rooms = [room for room, inside in zip(rooms, mask) if inside]
+        nb_rooms_expected = results.nb_rooms_expected
+        if results.rooms:
+            nb_rooms_expected = round(nb_rooms_expected * len(rooms) / len(results.rooms))
+        return SearchResults(nb_rooms_expected=nb_rooms_expected, rooms=rooms, geobox=results.geobox, filters=results.filters)
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# ============================================================================
+# Quadtree of the boxes searched in a survey. Nodes are integer quadkeys: a
+# leading 1 bit followed by two bits per level (the Morton code of the node),
+# so that the level, parent and children of a node are bit operations and a
+# node is stored as a single integer.
+# ============================================================================
+import numpy as np
+from bnb_kanpora.utils import GeoBox, SearchFilters
+
+# children of a node, in the order of GeoBox.get_four_splits: bit 0 set for
+# the western half, bit 1 set for the southern half
+NE, NW, SE, SW = 0, 1, 2, 3
+ROOT = 1
+# quadkeys are stored in 64 bits signed integers
+MAX_LEVEL = 31
+
+
+class QuadTree():
+    """Quadtree over a root box
+
+    Attributes:
+    ---
+        root_box:GeoBox
+
+    Methods:
+    ---
+        level(key:int) -> int
+        parent(key:int) -> int
+        child(key:int, idx:int) -> int
+        children(key:int) -> list
+        to_string(key:int) -> str
+            Legacy node id: root is 0, children 0-0 to 0-3, then 0-0-0...
+        from_string(node:str) -> int
+        box(key:int) -> GeoBox
+        boxes(keys) -> np.ndarray
+            (n_lat, e_lng, s_lat, w_lng) of each key, as a (n, 4) array
+        child_boxes(keys) -> (np.ndarray, np.ndarray)
+            Quadkeys and boxes of the children of each key
+    """
+    __slots__ = ("root_box",)
+
+    def __init__(self, root_box:GeoBox) -> None:
+        self.root_box = root_box
+
+    @staticmethod
+    def level(key:int) -> int:
+        return (key.bit_length() - 1) >> 1
+
+    @staticmethod
+    def parent(key:int) -> int:
+        return key >> 2 if key > ROOT else None
+
+    @staticmethod
+    def child(key:int, idx:int) -> int:
+        if QuadTree.level(key) >= MAX_LEVEL:
+            raise ValueError(f"Quadtree nodes are limited to {MAX_LEVEL} levels")
+        return (key << 2) | idx
+
+    @staticmethod
+    def children(key:int) -> list:
+        return [QuadTree.child(key, idx) for idx in (NE, NW, SE, SW)]
+
+    @staticmethod
+    def to_string(key:int) -> str:
+        digits = ["0"]
+        for shift in range(2 * (QuadTree.level(key) - 1), -1, -2):
+            digits.append(str((key >> shift) & 3))
+        return "-".join(digits)
+
+    @staticmethod
+    def from_string(node:str) -> int:
+        digits = node.split("-")
+        if digits[0] != "0":
+            raise ValueError(f"Invalid quadtree node: {node}")
+        key = ROOT
+        for digit in digits[1:]:
+            key = QuadTree.child(key, int(digit))
+        return key
+
+    def box(self, key:int) -> GeoBox:
+        n_lat, e_lng, s_lat, w_lng = self.boxes([key])[0]
+        return GeoBox(n_lat=n_lat, e_lng=e_lng, s_lat=s_lat, w_lng=w_lng)
+
+    def boxes(self, keys) -> np.ndarray:
+        keys = np.asarray(keys, dtype=np.int64)
+        levels = np.zeros(keys.shape, dtype=np.int64)
+        remaining = keys.copy()
+        while np.any(remaining > ROOT):
+            deeper = remaining > ROOT
+            levels[deeper] += 1
+            remaining[deeper] >>= 2
+
+        # column counted from the east, row counted from the north
+        columns = np.zeros(keys.shape, dtype=np.int64)
+        rows = np.zeros(keys.shape, dtype=np.int64)
+        for level in range(int(levels.max(initial=0))):
+            shift = 2 * (levels - level - 1)
+            in_level = shift >= 0
+            digits = np.where(in_level, (keys >> np.maximum(shift, 0)) & 3, 0)
+            columns = np.where(in_level, columns * 2 + (digits & 1), columns)
+            rows = np.where(in_level, rows * 2 + (digits >> 1), rows)
+
+        root = self.root_box
+        sizes = np.ldexp(1.0, -levels)
+        lng_step = (root.e_lng - root.w_lng) * sizes
+        lat_step = (root.n_lat - root.s_lat) * sizes
+        e_lng = root.e_lng - columns * lng_step
+        n_lat = root.n_lat - rows * lat_step
+        return np.column_stack((n_lat, e_lng, n_lat - lat_step, e_lng - lng_step))
+
+    def child_boxes(self, keys) -> tuple:
+        keys = np.asarray(keys, dtype=np.int64)
+        child_keys = ((keys[:, None] << 2) | np.arange(4, dtype=np.int64)).ravel()
+        return child_keys, self.boxes(child_keys)
+
+
+def node_label(node:tuple) -> str:
+    """Readable id of a (quadkey, SearchFilters) crawl node, for logs and metrics"""
+    key, filters = node
+    label = QuadTree.to_string(key)
+    if filters == SearchFilters():
+        return label
+    return f"{label}/{filters.label}"
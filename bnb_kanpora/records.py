@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# ============================================================================
+# Compact room records: search result listings are projected on the mapped
+# room columns as soon as they are received, so that a survey does not hold
+# the raw listing JSON (pricing, pictures, badges...) of every room
+# ============================================================================
+import re
+
+NON_PRICE_CHARS = re.compile(r'[^\d,.]')
+
+def parse_price(value:str) -> float:
+    """Parse a displayed price such as '1 234\xa0€' or '45,50 €' into a float"""
+    value = NON_PRICE_CHARS.sub('', value).replace(',', '.')
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+# room column: (path in the search result listing, optional parsing function)
+ROOM_KEY_MAPPINGS = {
+    'room_id' : (['listing','id'],),
+    'room_type' : (['listing','room_type'],),
+    'host_id' : (['listing', 'user','id'],),
+    'address' : (['listing','public_address'],),
+    'reviews' : (['listing','reviews_count'],),
+    'overall_satisfaction' : (['listing','star_rating'],),
+    'accommodates' : (['listing','person_capacity'],),
+    'bedrooms' : (['listing','bedrooms'],),
+    'bathrooms' : (['listing','bathrooms'],),
+    'latitude' : (['listing','lat'],),
+    'longitude' : (['listing','lng'],),
+    'coworker_hosted' : (['listing','coworker_hosted'],),
+    'extra_host_languages' : (['listing','extra_host_languages'],),
+    'name' : (['listing','name'],),
+    'license' : (['listing','license'],),
+    'city' : (['listing','localized_city'],),
+    'picture_url' : (['listing','picture_url'],),
+    'neighborhood' : (['listing','neighborhood'],),
+    'pdp_type' : (['listing','pdp_type'],),
+    'pdp_url_type' : (['listing','pdp_url_type'],),
+    'rate' : (['pricing_quote', 'structured_stay_display_price','primary_line', 'price'], parse_price),
+    'rate_with_service_fee' : (['pricing_quote','rate_with_service_fee', 'amount'],),
+    'currency' : (['pricing_quote', 'rate', 'currency'],),
+    'weekly_price_factor' : (['pricing_quote', 'weekly_price_factor'],),
+    'monthly_price_factor' : (['pricing_quote', 'monthly_price_factor'],),
+    'min_nights' : (['listing','min_nights'],),
+    'max_nights' : (['listing','max_nights'],),
+}
+
+
+def _get_path(source:dict, path:list):
+    for key in path:
+        if not isinstance(source, dict):
+            return None
+        source = source.get(key)
+    return source
+
+
+class RoomRecord():
+    """A search result listing, reduced to the mapped room columns
+
+    Attributes:
+    ---
+        one attribute per key of ROOM_KEY_MAPPINGS
+        raw:dict
+            The listing as received, only kept when requested
+
+    Methods:
+    ---
+        from_search_result(search_result:dict, keep_raw:bool=False) -> RoomRecord
+        to_row(survey_id:int) -> dict
+    """
+    __slots__ = tuple(ROOM_KEY_MAPPINGS) + ("raw",)
+
+    def __init__(self, raw:dict=None, **values) -> None:
+        for key in ROOM_KEY_MAPPINGS:
+            setattr(self, key, values.get(key))
+        self.raw = raw
+
+    @classmethod
+    def from_search_result(cls, search_result:dict, keep_raw:bool=False) -> 'RoomRecord':
+        record = cls.__new__(cls)
+        for key, mapping in ROOM_KEY_MAPPINGS.items():
+            # empty values (0, "", []) are stored as NULL
+            value = _get_path(search_result, mapping[0]) or None
+            if value and len(mapping) > 1:
+                value = mapping[1](value)
+            setattr(record, key, value)
+        record.raw = search_result if keep_raw else None
+        return record
+
+    def to_row(self, survey_id:int) -> dict:
+        row = {key: getattr(self, key) for key in ROOM_KEY_MAPPINGS}
+        row['survey_id'] = str(survey_id)
+        return row
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RoomRecord):
+            return NotImplemented
+        return all(getattr(self, key) == getattr(other, key) for key in ROOM_KEY_MAPPINGS)
+
+    def __repr__(self) -> str:
+        return f"RoomRecord(room_id={self.room_id}, room_type={self.room_type!r}, rate={self.rate})"
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# ============================================================================
+# Survey retention: select the surveys to drop by age or by count per search
+# area, keep their aggregates, and delete them with their rooms in chunked
+# transactions, so that the database stops growing with every survey
+# ============================================================================
+import logging
+from datetime import datetime, timedelta
+from peewee import fn, Value
+from bnb_kanpora.models import (RoomModel, SurveyModel, SurveyProgressModel, MetricModel, ListingModel,
+                                ObservationModel, SurveyRoomModel, SurveyRollupModel, AvailabilityModel)
+
+logger = logging.getLogger()
+
+PURGE_BATCH_SIZE = 5000
+
+
+def expired_surveys(max_age:float=0, keep_last:int=0, search_area_id:int=None, now:datetime=None) -> list:
+    """Surveys older than max_age days that are not among the keep_last
+    latest surveys of their search area (0 for no limit on either)"""
+    if not max_age and not keep_last:
+        return []
+    now = now or datetime.now()
+    query = SurveyModel.select(SurveyModel.survey_id, SurveyModel.search_area_id, SurveyModel.survey_date)
+    if search_area_id is not None:
+        query = query.where(SurveyModel.search_area_id == search_area_id)
+    expired = []
+    kept = {}
+    for survey in query.order_by(SurveyModel.survey_date.desc(), SurveyModel.survey_id.desc()):
+        area_id = survey.search_area_id_id
+        kept[area_id] = kept.get(area_id, 0) + 1
+        if keep_last and kept[area_id] <= keep_last:
+            continue
+        if max_age and survey.survey_date > now - timedelta(days=max_age):
+            continue
+        expired.append(survey.survey_id)
+    return sorted(expired)
+
+
+def rollup_survey(survey_id:int) -> int:
+    """Keep the aggregates of the rooms of a survey by room type, returns the number of rows added"""
+    survey = SurveyModel.get_by_id(survey_id)
+    survey_date = Value(survey.survey_date, converter=SurveyRollupModel.survey_date.db_value)
+    room = SurveyRoomModel
+    query = (room
+        .select(
+            Value(survey_id), Value(survey.search_area_id_id), survey_date, room.room_type,
+            fn.COUNT(room.room_id), fn.COUNT(room.host_id.distinct()), fn.COUNT(room.license),
+            fn.AVG(room.rate), fn.MIN(room.rate), fn.MAX(room.rate),
+            fn.AVG(room.reviews), fn.AVG(room.overall_satisfaction),
+            Value(datetime.now(), converter=SurveyRollupModel.created_at.db_value))
+        .where(room.survey_id == survey_id)
+        .group_by(room.room_type))
+    fields = [SurveyRollupModel.survey_id, SurveyRollupModel.search_area_id, SurveyRollupModel.survey_date,
+              SurveyRollupModel.room_type, SurveyRollupModel.nb_rooms, SurveyRollupModel.nb_hosts,
+              SurveyRollupModel.nb_licensed, SurveyRollupModel.avg_rate, SurveyRollupModel.min_rate,
+              SurveyRollupModel.max_rate, SurveyRollupModel.avg_reviews, SurveyRollupModel.avg_satisfaction,
+              SurveyRollupModel.created_at]
+    SurveyRollupModel.delete().where(SurveyRollupModel.survey_id == survey_id).execute()
+    SurveyRollupModel.insert_from(query, fields).execute()
+    return SurveyRollupModel.select().where(SurveyRollupModel.survey_id == survey_id).count()
+
+
+def _delete_chunked(database, model, survey_id:int, batch_size:int) -> int:
+    """Delete the rows of a survey batch_size rooms at a time, one transaction each"""
+    deleted = 0
+    while True:
+        with database.atomic():
+            room_ids = [room_id for (room_id,) in model
+                .select(model.room_id)
+                .where(model.survey_id == survey_id)
+                .limit(batch_size)
+                .tuples()]
+            if not room_ids:
+                return deleted
+            deleted += (model
+                .delete()
+                .where((model.survey_id == survey_id) & (model.room_id.in_(room_ids)))
+                .execute())
+
+
+def purge_survey(database, survey_id:int, rollup:bool=False, batch_size:int=PURGE_BATCH_SIZE) -> int:
+    """Delete a survey with its rooms, observations, availabilities, progress and metrics,
+    after keeping its aggregates when rollup is set. Returns the number of
+    rooms deleted."""
+    if rollup:
+        with database.atomic():
+            rollup_survey(survey_id)
+    nb_rooms = _delete_chunked(database, RoomModel, survey_id, batch_size)
+    nb_rooms += _delete_chunked(database, ObservationModel, survey_id, batch_size)
+    _delete_chunked(database, AvailabilityModel, survey_id, batch_size)
+    with database.atomic():
+        for model in (SurveyProgressModel, MetricModel):
+            model.delete().where(model.survey_id == survey_id).execute()
+        SurveyModel.delete().where(SurveyModel.survey_id == survey_id).execute()
+    logger.info(f"Survey {survey_id} purged: {nb_rooms} rooms deleted")
+    return nb_rooms
+
+
+def delete_orphan_listings(database) -> int:
+    """Delete the listings no observation references any more"""
+    referenced = ObservationModel.select(ObservationModel.listing_id).distinct()
+    with database.atomic():
+        return ListingModel.delete().where(ListingModel.listing_id.not_in(referenced)).execute()
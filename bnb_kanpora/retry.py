@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# ============================================================================
+# Retry engine for requests to Airbnb: classification of responses and
+# exceptions, jittered exponential backoff honoring Retry-After, and circuit
+# breakers per proxy (or endpoint when no proxy is used)
+# ============================================================================
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+
+logger = logging.getLogger()
+
+# outcomes of a request
+SUCCESS = "success"
+# transient failure (5xx, timeout, connection reset): retry the same session
+RETRY = "retry"
+# refused (403, 429) or empty body: retry with a new session (proxy, user agent, cookies)
+RENEW_SESSION = "renew_session"
+# the request itself is wrong (404, 400, invalid URL...): retrying will not help
+FATAL = "fatal"
+
+RETRY_STATUSES = frozenset([500, 502, 503, 504, 520, 522, 524])
+RENEW_SESSION_STATUSES = frozenset([403, 407, 429])
+
+
+def classify_response(response) -> str:
+    if response.status_code == 200:
+        return SUCCESS if len(response.content) > 0 else RENEW_SESSION
+    if response.status_code in RENEW_SESSION_STATUSES:
+        return RENEW_SESSION
+    if response.status_code in RETRY_STATUSES:
+        return RETRY
+    return FATAL
+
+
+def classify_exception(exception:Exception) -> str:
+    if isinstance(exception, (requests.exceptions.ProxyError, requests.exceptions.SSLError)):
+        return RENEW_SESSION
+    if isinstance(exception, (requests.exceptions.Timeout,
+                              requests.exceptions.ConnectionError,
+                              requests.exceptions.ChunkedEncodingError,
+                              requests.exceptions.ContentDecodingError)):
+        return RETRY
+    return FATAL
+
+
+def get_retry_after(response) -> float:
+    """Seconds to wait from a Retry-After header (delay in seconds or HTTP date), or None"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Backoff():
+    """Exponential backoff with full jitter: a random delay in [0, min(max_delay, base * 2^attempt)]"""
+    def __init__(self, base:float=0.5, max_delay:float=60.0) -> None:
+        self.base = base
+        self.max_delay = max_delay
+
+    def delay(self, attempt:int, retry_after:float=None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base * (2 ** attempt)))
+        if retry_after is not None:
+            # the server knows best, but never wait forever
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker():
+    """Stop using a proxy (or endpoint) after failure_threshold consecutive failures.
+
+    The circuit is open for reset_timeout seconds, then half-open: a single
+    trial request is let through, closing the circuit on success.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold:int=5, reset_timeout:float=60.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_sent = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_sent:
+                self._trial_sent = True
+                return True
+            return False
+
+    def remaining(self) -> float:
+        """Seconds before the circuit becomes half-open"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_sent = False
+
+    def release_trial(self) -> None:
+        """The request told nothing about the proxy (e.g. an invalid URL):
+        let another trial request through when half-open"""
+        with self._lock:
+            self._trial_sent = False
+
+    def record_failure(self) -> bool:
+        """Count a failure, returns True when the circuit opens"""
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                opening = self.opened_at is None or self._trial_sent
+                self.opened_at = time.monotonic()
+                self._trial_sent = False
+                return opening
+            return False
+
+
+class CircuitBreakers():
+    """Circuit breakers by key (proxy or endpoint), created on first use"""
+    def __init__(self, failure_threshold:int=5, reset_timeout:float=60.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key:str) -> CircuitBreaker:
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[key]
+
+    def is_open(self, key:str) -> bool:
+        return self[key].state == CircuitBreaker.OPEN
+
+    def remaining(self) -> float:
+        """Seconds before the first open circuit becomes half-open, 0 if none is open"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return min((b.remaining() for b in breakers if b.state == CircuitBreaker.OPEN), default=0.0)
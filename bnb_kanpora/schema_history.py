@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+# ============================================================================
+# Frozen copies of the models, as of the schema version that created or last
+# changed their table. Migrations build tables from these copies and never
+# from models.py, so that a migration creates the same schema whatever the
+# models became later. A migration changing a table adds a copy here.
+# Meta.name is the name of the model in models.py, which names the indexes.
+# ============================================================================
+from datetime import datetime
+from peewee import (AutoField, BigIntegerField, BooleanField, CharField, CompositeKey, DateField, DateTimeField,
+                    DecimalField, FloatField, ForeignKeyField, IntegerField, Model, SmallIntegerField, TextField)
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+
+class SearchAreaV1(Model):
+    class Meta:
+        name = "searchareamodel"
+        table_name = "search_area"
+
+    search_area_id = AutoField()
+    name = CharField(255, default='UNKNOWN')
+    abbreviation = CharField(255, null=True)
+    bb_n_lat = DecimalField(30, 6)
+    bb_e_lng = DecimalField(30, 6)
+    bb_s_lat = DecimalField(30, 6)
+    bb_w_lng = DecimalField(30, 6)
+
+
+class SurveyV1(Model):
+    class Meta:
+        name = "surveymodel"
+        table_name = "survey"
+
+    survey_id = AutoField()
+    survey_date = DateTimeField(default=datetime.now)
+    survey_description = CharField(255, null=True)
+    comment = CharField(255, null=True)
+    survey_method = CharField(20, default="neighborhood")
+    status = SmallIntegerField(default=0)
+    search_area_id = ForeignKeyField(SearchAreaV1, backref='+')
+
+
+class RoomV1(Model):
+    class Meta:
+        name = "roommodel"
+        table_name = "room"
+        primary_key = CompositeKey('survey_id', 'room_id')
+        indexes = (
+            (('room_id',), False),
+            (('host_id',), False),
+            (('city',), False),
+            (('latitude', 'longitude'), False),
+        )
+
+    survey_id = ForeignKeyField(SurveyV1, backref='+')
+    room_id = BigIntegerField()
+    host_id = BigIntegerField()
+    name = CharField(255)
+    room_type = CharField(100)
+    city = CharField(100)
+    neighborhood = CharField(255, null=True)
+    address = CharField(2000)
+    reviews = IntegerField(null=True)
+    overall_satisfaction = FloatField(null=True)
+    accommodates = IntegerField(null=True)
+    bedrooms = FloatField(null=True)
+    bathrooms = FloatField(null=True)
+    deleted = BooleanField(default=False)
+    license = CharField(2000, null=True)
+    last_modified = DateTimeField(default=datetime.now)
+    latitude = FloatField()
+    longitude = FloatField()
+    coworker_hosted = IntegerField(null=True)
+    extra_host_languages = CharField(100, null=True)
+    currency = CharField(20, null=True)
+    picture_url = CharField(200, null=True)
+    pdp_type = CharField(200, null=True)
+    pdp_url_type = CharField(200, null=True)
+    rate = FloatField(null=True)
+    rate_with_service_fee = FloatField(null=True)
+    monthly_price_factor = FloatField(null=True)
+    weekly_price_factor = FloatField(null=True)
+
+
+class SurveyProgressV1(Model):
+    class Meta:
+        name = "surveyprogressmodel"
+        table_name = "survey_progress"
+
+    survey_id = ForeignKeyField(SurveyV1, backref='+')
+    room_type = CharField(100)
+    guests = IntegerField(null=True)
+    price_min = FloatField(null=True)
+    price_max = FloatField(null=True)
+    quadtree_node = CharField(1000)
+    last_modified = DateTimeField(default=datetime.now)
+
+
+class MetricV4(Model):
+    class Meta:
+        name = "metricmodel"
+        table_name = "metric"
+
+    metric_id = AutoField()
+    survey_id = ForeignKeyField(SurveyV1, backref='+', on_delete='CASCADE')
+    name = CharField(100)
+    kind = CharField(20)
+    node = CharField(1000, null=True)
+    labels = TextField(null=True)
+    count = IntegerField(default=0)
+    sum = FloatField(default=0)
+    buckets = TextField(null=True)
+    last_modified = DateTimeField(default=datetime.now)
+
+
+class SearchAreaV5(Model):
+    class Meta:
+        name = "searchareamodel"
+        table_name = "search_area"
+
+    search_area_id = AutoField()
+    name = CharField(255, default='UNKNOWN')
+    abbreviation = CharField(255, null=True)
+    bb_n_lat = FloatField()
+    bb_e_lng = FloatField()
+    bb_s_lat = FloatField()
+    bb_w_lng = FloatField()
+
+
+class SurveyProgressV5(Model):
+    class Meta:
+        name = "surveyprogressmodel"
+        table_name = "survey_progress"
+
+    survey_id = ForeignKeyField(SurveyV1, backref='+')
+    room_type = CharField(100, null=True)
+    guests = IntegerField(null=True)
+    price_min = FloatField(null=True)
+    price_max = FloatField(null=True)
+    quadtree_node = BigIntegerField()
+    last_modified = DateTimeField(default=datetime.now)
+
+
+class SearchAreaV6(SearchAreaV5):
+    class Meta:
+        table_name = "search_area"
+
+    polygon = TextField(null=True)
+
+
+class RoomPageV7(Model):
+    class Meta:
+        name = "roompagemodel"
+        table_name = "room_page"
+        indexes = (
+            (('fetched_at',), False),
+        )
+
+    room_id = BigIntegerField(primary_key=True)
+    fetched_at = DateTimeField(default=datetime.now)
+    host_id = BigIntegerField(null=True)
+    room_type = CharField(100, null=True)
+    city = CharField(100, null=True)
+    neighborhood = CharField(255, null=True)
+    address = CharField(2000, null=True)
+    bedrooms = FloatField(null=True)
+    bathrooms = FloatField(null=True)
+
+
+class HostV8(Model):
+    class Meta:
+        name = "hostmodel"
+        table_name = "host"
+        indexes = (
+            (('fetched_at',), False),
+        )
+
+    host_id = BigIntegerField(primary_key=True)
+    fetched_at = DateTimeField(default=datetime.now)
+    name = CharField(255, null=True)
+    location = CharField(255, null=True)
+    about = TextField(null=True)
+    languages = CharField(255, null=True)
+    member_since = DateField(null=True)
+    is_superhost = BooleanField(null=True)
+    identity_verified = BooleanField(null=True)
+    nb_listings = IntegerField(null=True)
+    nb_reviews = IntegerField(null=True)
+
+
+class ListingV9(Model):
+    class Meta:
+        name = "listingmodel"
+        table_name = "listing"
+        indexes = (
+            (('room_id',), False),
+            (('host_id',), False),
+        )
+
+    listing_id = AutoField()
+    content_hash = CharField(32, unique=True)
+    room_id = BigIntegerField()
+    host_id = BigIntegerField()
+    name = CharField(255)
+    room_type = CharField(100)
+    city = CharField(100)
+    neighborhood = CharField(255, null=True)
+    address = CharField(2000)
+    accommodates = IntegerField(null=True)
+    bedrooms = FloatField(null=True)
+    bathrooms = FloatField(null=True)
+    license = CharField(2000, null=True)
+    coworker_hosted = IntegerField(null=True)
+    extra_host_languages = CharField(100, null=True)
+    currency = CharField(20, null=True)
+    picture_url = CharField(200, null=True)
+    pdp_type = CharField(200, null=True)
+    pdp_url_type = CharField(200, null=True)
+
+
+class ObservationV9(Model):
+    class Meta:
+        name = "observationmodel"
+        table_name = "observation"
+        primary_key = CompositeKey('survey_id', 'room_id')
+        indexes = (
+            (('room_id',), False),
+            (('latitude', 'longitude'), False),
+        )
+
+    survey_id = ForeignKeyField(SurveyV1, backref='+', on_delete='CASCADE')
+    room_id = BigIntegerField()
+    listing_id = ForeignKeyField(ListingV9, backref='+')
+    reviews = IntegerField(null=True)
+    overall_satisfaction = FloatField(null=True)
+    deleted = BooleanField(default=False)
+    last_modified = DateTimeField(default=datetime.now)
+    latitude = FloatField()
+    longitude = FloatField()
+    rate = FloatField(null=True)
+    rate_with_service_fee = FloatField(null=True)
+    monthly_price_factor = FloatField(null=True)
+    weekly_price_factor = FloatField(null=True)
+
+
+class SurveyRollupV10(Model):
+    class Meta:
+        name = "surveyrollupmodel"
+        table_name = "survey_rollup"
+        indexes = (
+            (('search_area_id', 'survey_date'), False),
+        )
+
+    rollup_id = AutoField()
+    survey_id = IntegerField()
+    search_area_id = IntegerField()
+    survey_date = DateTimeField()
+    room_type = CharField(100)
+    nb_rooms = IntegerField()
+    nb_hosts = IntegerField()
+    nb_licensed = IntegerField()
+    avg_rate = FloatField(null=True)
+    min_rate = FloatField(null=True)
+    max_rate = FloatField(null=True)
+    avg_reviews = FloatField(null=True)
+    avg_satisfaction = FloatField(null=True)
+    created_at = DateTimeField(default=datetime.now)
+
+
+class RoomSearchV11(FTS5Model):
+    class Meta:
+        name = "roomsearchmodel"
+        table_name = "room_fts"
+        options = {'tokenize': "unicode61 remove_diacritics 2"}
+
+    name = SearchField()
+    address = SearchField()
+    license = SearchField()
+    survey_id = SearchField(unindexed=True)
+    room_id = SearchField(unindexed=True)
+
+
+class AvailabilityV12(Model):
+    class Meta:
+        name = "availabilitymodel"
+        table_name = "availability"
+        primary_key = CompositeKey('survey_id', 'checkin', 'checkout', 'guests', 'room_id')
+        indexes = (
+            (('room_id',), False),
+        )
+
+    survey_id = ForeignKeyField(SurveyV1, backref='+', on_delete='CASCADE')
+    checkin = DateField()
+    checkout = DateField()
+    guests = IntegerField()
+    room_id = BigIntegerField()
+    rate = FloatField(null=True)
+    last_modified = DateTimeField(default=datetime.now)
+
+
+class SurveyProgressV13(SurveyProgressV5):
+    class Meta:
+        table_name = "survey_progress"
+
+    failed = BooleanField(default=False)
+
+
+MODELS = [SearchAreaV1, SurveyV1, RoomV1, SurveyProgressV1, MetricV4, SearchAreaV5, SurveyProgressV5, SearchAreaV6,
+          RoomPageV7, HostV8, ListingV9, ObservationV9, SurveyRollupV10, RoomSearchV11, AvailabilityV12,
+          SurveyProgressV13]
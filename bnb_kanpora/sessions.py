@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# ============================================================================
+# Pool of warm requests sessions, each pinned to a proxy and a user agent, so
+# that keep-alive connections (and their TCP/TLS handshakes through the
+# proxy) are reused across requests. Failing sessions are retired and
+# replaced in the background.
+# ============================================================================
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+logger = logging.getLogger()
+
+# a warm-up answered with one of these statuses means the proxy or user agent is refused
+UNHEALTHY_STATUSES = frozenset([403, 407, 429])
+# attempts to warm a replacement session, on different proxies, before giving up warming it
+MAX_WARMUP_ATTEMPTS = 3
+
+
+class PooledSession():
+    """A requests session and the proxy / user agent pair it is pinned to"""
+    __slots__ = ("session", "proxy", "user_agent", "nb_requests", "created_at")
+
+    def __init__(self, session, proxy:str=None, user_agent:str=None) -> None:
+        self.session = session
+        self.proxy = proxy
+        self.user_agent = user_agent
+        self.nb_requests = 0
+        self.created_at = time.monotonic()
+
+
+class SessionPool():
+    """Fixed-size pool of sessions shared by the crawler threads
+
+    A session is used by a single thread at a time: acquire() leases an idle
+    session, release() gives it back, or retires it when Airbnb refused it.
+
+    Attributes:
+    ---
+        size:int
+            Number of sessions in the pool
+        factory:callable
+            factory(proxy:str, user_agent:str) -> requests.Session
+        warmup_url:str
+            URL requested (HEAD) to open the connection of a new session, None to skip warming
+
+    Methods:
+    ---
+        start()
+            Create and warm the sessions, in parallel
+        acquire(accept:callable=None, timeout:float=None) -> PooledSession
+            Lease an idle session, the first one for which accept(session) is True
+        release(pooled:PooledSession, healthy:bool=True)
+            Give back a leased session, retiring and replacing it when unhealthy
+        close()
+    """
+    def __init__(self, size:int, factory, proxies:list=None, user_agents:list=None,
+                 warmup_url:str=None, warmup_timeout:float=10.0, is_usable=None, metrics=None) -> None:
+        self.size = max(1, size)
+        self.factory = factory
+        self.proxies = list(proxies or [])
+        self.user_agents = list(user_agents or [])
+        self.warmup_url = warmup_url
+        self.warmup_timeout = warmup_timeout
+        # is_usable(proxy) -> bool, False for proxies that should not get new sessions
+        self.is_usable = is_usable
+        self.metrics = metrics
+        self._idle = deque()
+        self._nb_sessions = 0
+        self._condition = threading.Condition()
+        self._executor = None
+        self._proxy_cycle = itertools.cycle(self.proxies) if self.proxies else None
+
+    def _pick_pair(self) -> tuple:
+        user_agent = random.choice(self.user_agents) if self.user_agents else None
+        if not self.proxies:
+            return None, user_agent
+        # spread the sessions over the proxies, skipping the unusable ones
+        for _ in range(len(self.proxies)):
+            proxy = next(self._proxy_cycle)
+            if self.is_usable is None or self.is_usable(proxy):
+                return proxy, user_agent
+        return next(self._proxy_cycle), user_agent
+
+    def _warm(self, pooled:PooledSession) -> bool:
+        """Open the connection of a new session, returns False when it is refused"""
+        if not self.warmup_url:
+            return True
+        start = time.perf_counter()
+        try:
+            response = pooled.session.head(self.warmup_url, timeout=self.warmup_timeout, allow_redirects=False)
+            healthy = response.status_code not in UNHEALTHY_STATUSES and response.status_code < 500
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Warming session through {pooled.proxy or 'direct'} failed: {e}")
+            healthy = False
+        if self.metrics:
+            self.metrics.observe("session_warmup_seconds", time.perf_counter() - start)
+            self.metrics.inc("session_warmups_total", healthy=healthy)
+        return healthy
+
+    def _new_session(self) -> PooledSession:
+        for attempt in range(MAX_WARMUP_ATTEMPTS):
+            proxy, user_agent = self._pick_pair()
+            pooled = PooledSession(self.factory(proxy, user_agent), proxy, user_agent)
+            if self._warm(pooled) or attempt == MAX_WARMUP_ATTEMPTS - 1:
+                # a session that could not be warmed is still added: the
+                # retries of its requests decide what to do with it
+                return pooled
+            pooled.session.close()
+
+    def _add(self) -> None:
+        try:
+            pooled = self._new_session()
+        except Exception:
+            logger.exception("Failed to create a session")
+            with self._condition:
+                self._nb_sessions -= 1
+                self._condition.notify_all()
+            return
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    def _spawn(self, nb_sessions:int) -> None:
+        """Create sessions in the background, the caller holds the condition"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="session-pool")
+        self._nb_sessions += nb_sessions
+        for _ in range(nb_sessions):
+            self._executor.submit(self._add)
+
+    def start(self) -> None:
+        with self._condition:
+            if self._nb_sessions < self.size:
+                self._spawn(self.size - self._nb_sessions)
+
+    def acquire(self, accept=None, timeout:float=None) -> PooledSession:
+        """Lease an idle session.
+
+        Returns None when sessions are idle but accept rejects all of them,
+        or when no session became idle within timeout.
+        """
+        self.start()
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._idle, timeout=timeout):
+                return None
+            for pooled in self._idle:
+                if accept is None or accept(pooled):
+                    self._idle.remove(pooled)
+                    pooled.nb_requests += 1
+                    return pooled
+            return None
+
+    def release(self, pooled:PooledSession, healthy:bool=True) -> None:
+        if healthy:
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+            return
+        # retire the session and replace it without blocking the crawl
+        pooled.session.close()
+        if self.metrics:
+            self.metrics.inc("sessions_retired_total", proxy=pooled.proxy or "direct")
+        with self._condition:
+            self._nb_sessions -= 1
+            self._spawn(1)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._condition:
+            while self._idle:
+                self._idle.popleft().session.close()
+            self._nb_sessions = 0
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# ============================================================================
+# Slicing of saturated searches: a box returning a full search (Airbnb
+# never returns more) is searched again by room type, then by price bands
+# sized from the prices observed in the box, before falling back to a
+# quadtree split of the box, skipping the children outside the polygon of
+# the search area
+# ============================================================================
+import logging
+import math
+from bnb_kanpora.polygon import SearchPolygon
+from bnb_kanpora.quadtree import QuadTree
+from bnb_kanpora.utils import GeoBox, RoomTypes, SearchFilters, SearchResults
+
+logger = logging.getLogger()
+
+# the room type slices of a search must cover every room it returns
+ROOM_TYPES = [RoomTypes.ENTIRE_APT, RoomTypes.PRIVATE_ROOM, RoomTypes.SHARED_ROOM, RoomTypes.HOTEL_ROOM]
+# bands are sized to be filled at this ratio of a full search, listings
+# found are a sample of the box and the bands are only estimates
+BAND_FILL_RATIO = 0.7
+
+ROOM_TYPE_SLICE = "room_type"
+PRICE_SLICE = "price"
+GEO_SPLIT = "geo"
+
+
+def price_bands(rates:list, nb_bands:int, price_min:int=None, price_max:int=None) -> list:
+    """Split [price_min, price_max] in at most nb_bands bands holding about
+    the same number of the observed rates.
+
+    Bands are (min, max) inclusive integer bounds, None for no bound, and
+    cover the whole interval. Returns a single band when the rates cannot
+    be split.
+    """
+    low = price_min if price_min is not None else 0
+    rates = sorted(r for r in rates if r is not None
+                   and r >= low and (price_max is None or r <= price_max))
+    boundaries = []
+    for i in range(1, nb_bands):
+        boundary = int(rates[i * len(rates) // nb_bands]) if rates else None
+        # a band starts at each boundary: it must leave a non empty band below
+        if boundary is not None and boundary > low and (price_max is None or boundary <= price_max) \
+                and (not boundaries or boundary > boundaries[-1]):
+            boundaries.append(boundary)
+    starts = [price_min] + boundaries
+    ends = [b - 1 for b in boundaries] + [price_max]
+    return list(zip(starts, ends))
+
+
+class SlicingStrategy():
+    """Decide how to search further a box whose search is saturated
+
+    Attributes:
+    ---
+        capacity:int
+            Maximum number of listings returned by a search
+        loop_over_room_types:bool
+        loop_over_prices:bool
+
+    Methods:
+    ---
+        is_saturated(results:SearchResults) -> bool
+        slice(node:tuple, box:GeoBox, results:SearchResults, quadtree:QuadTree, polygon:SearchPolygon=None) -> tuple
+    """
+    def __init__(self, capacity:int, loop_over_room_types:bool=False, loop_over_prices:bool=False) -> None:
+        self.capacity = capacity
+        self.loop_over_room_types = loop_over_room_types
+        self.loop_over_prices = loop_over_prices
+
+    @classmethod
+    def from_config(cls, config) -> 'SlicingStrategy':
+        return cls(
+            capacity=config.SEARCH_MAX_PAGES * config.SEARCH_LISTINGS_ON_FULL_PAGE,
+            loop_over_room_types=config.SEARCH_DO_LOOP_OVER_ROOM_TYPES,
+            loop_over_prices=config.SEARCH_DO_LOOP_OVER_PRICES,
+        )
+
+    def is_saturated(self, results:SearchResults) -> bool:
+        return len(results.rooms) >= self.capacity
+
+    def slice(self, node:tuple, box:GeoBox, results:SearchResults, quadtree:QuadTree, polygon:SearchPolygon=None) -> tuple:
+        """(kind of slicing, children), children being the (node, box) of
+        the searches covering a saturated one, nodes being (quadkey, SearchFilters).
+        Geo split children not intersecting polygon are left out."""
+        key, filters = node
+        if self.loop_over_room_types and filters.room_type is None:
+            return ROOM_TYPE_SLICE, [
+                ((key, SearchFilters(room_type, filters.price_min, filters.price_max)), box)
+                for room_type in ROOM_TYPES]
+
+        if self.loop_over_prices:
+            nb_expected = max(results.nb_rooms_expected, len(results.rooms))
+            nb_bands = max(2, math.ceil(nb_expected / (self.capacity * BAND_FILL_RATIO)))
+            bands = price_bands([room.rate for room in results.rooms], nb_bands, filters.price_min, filters.price_max)
+            if len(bands) > 1:
+                return PRICE_SLICE, [
+                    ((key, SearchFilters(filters.room_type, price_min, price_max)), box)
+                    for price_min, price_max in bands]
+
+        # the children keep the filters of the node
+        child_keys, child_boxes = quadtree.child_boxes([key])
+        if polygon is not None:
+            in_polygon = polygon.intersects_boxes(child_boxes)
+            child_keys, child_boxes = child_keys[in_polygon], child_boxes[in_polygon]
+        return GEO_SPLIT, [
+            ((int(child_key), filters), GeoBox(n_lat=n_lat, e_lng=e_lng, s_lat=s_lat, w_lng=w_lng))
+            for child_key, (n_lat, e_lng, s_lat, w_lng) in zip(child_keys, child_boxes)]
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# ============================================================================
+# Normalized room storage: the rooms of a finished survey are moved from the
+# room table to slim per-survey observations referencing listings, the
+# attributes that barely change between surveys stored once per distinct
+# set of values. The survey_room view gives every survey the room layout.
+# ============================================================================
+import hashlib
+import json
+import logging
+from bnb_kanpora.models import RoomModel, ListingModel, ObservationModel, SurveyRoomModel
+
+logger = logging.getLogger()
+
+NORMALIZE_BATCH_SIZE = 500
+
+# room columns stored in listing, the other ones are observed by each survey
+LISTING_FIELDS = ['room_id', 'host_id', 'name', 'room_type', 'city', 'neighborhood', 'address',
+                  'accommodates', 'bedrooms', 'bathrooms', 'license', 'coworker_hosted',
+                  'extra_host_languages', 'currency', 'picture_url', 'pdp_type', 'pdp_url_type']
+OBSERVATION_FIELDS = ['survey_id', 'room_id', 'reviews', 'overall_satisfaction', 'deleted', 'last_modified',
+                      'latitude', 'longitude', 'rate', 'rate_with_service_fee', 'monthly_price_factor',
+                      'weekly_price_factor']
+
+
+def listing_hash(row:dict) -> str:
+    """Content hash of the listing columns of a room row"""
+    values = json.dumps([row.get(name) for name in LISTING_FIELDS], default=str, ensure_ascii=False)
+    return hashlib.blake2b(values.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def survey_room_view_sql(room=RoomModel, listing=ListingModel, observation=ObservationModel) -> str:
+    """survey_room: the rooms of the room table and of the normalized surveys, in the room layout
+
+    The models default to the current ones, migrations pass the models of their schema version.
+    """
+    normalized = []
+    for field in room._meta.sorted_fields:
+        table = "l" if field.name in LISTING_FIELDS and field.name != 'room_id' else "o"
+        normalized.append(f'{table}."{field.column_name}"')
+    columns = ", ".join(f'"{field.column_name}"' for field in room._meta.sorted_fields)
+    return (f'CREATE VIEW "{SurveyRoomModel._meta.table_name}" AS '
+            f'SELECT {columns} FROM "{room._meta.table_name}" '
+            f'UNION ALL '
+            f'SELECT {", ".join(normalized)} FROM "{observation._meta.table_name}" AS o '
+            f'JOIN "{listing._meta.table_name}" AS l ON l."listing_id" = o."listing_id"')
+
+
+def create_views(database, room=RoomModel, listing=ListingModel, observation=ObservationModel) -> None:
+    database.execute_sql(f'DROP VIEW IF EXISTS "{SurveyRoomModel._meta.table_name}"')
+    database.execute_sql(survey_room_view_sql(room, listing, observation))
+
+
+def drop_views(database) -> None:
+    database.execute_sql(f'DROP VIEW IF EXISTS "{SurveyRoomModel._meta.table_name}"')
+
+
+def normalize_survey(database, survey_id:int, batch_size:int=NORMALIZE_BATCH_SIZE) -> tuple:
+    """Move the rooms of a survey from the room table to observations and
+    listings, in one transaction. Listings already stored by another survey
+    are reused.
+
+    Returns (observations added, listings added).
+    """
+    nb_observations = nb_listings = 0
+    last_room_id = None
+    with database.atomic():
+        while True:
+            query = RoomModel.select().where(RoomModel.survey_id == survey_id)
+            if last_room_id is not None:
+                query = query.where(RoomModel.room_id > last_room_id)
+            rows = list(query.order_by(RoomModel.room_id).limit(batch_size).dicts())
+            if not rows:
+                break
+            last_room_id = rows[-1]['room_id']
+
+            listings = {}
+            for row in rows:
+                row['content_hash'] = listing_hash(row)
+                listings[row['content_hash']] = {name: row[name] for name in LISTING_FIELDS + ['content_hash']}
+            stored = set(content_hash for (content_hash,) in ListingModel
+                         .select(ListingModel.content_hash)
+                         .where(ListingModel.content_hash.in_(list(listings)))
+                         .tuples())
+            new_listings = [listing for content_hash, listing in listings.items() if content_hash not in stored]
+            if new_listings:
+                ListingModel.insert_many(new_listings).on_conflict_ignore().execute()
+                nb_listings += len(new_listings)
+
+            listing_ids = dict(ListingModel
+                .select(ListingModel.content_hash, ListingModel.listing_id)
+                .where(ListingModel.content_hash.in_(list(listings)))
+                .tuples())
+            observations = [dict({name: row[name] for name in OBSERVATION_FIELDS}, listing_id=listing_ids[row['content_hash']])
+                            for row in rows]
+            ObservationModel.insert_many(observations).on_conflict_ignore().execute()
+            nb_observations += len(observations)
+
+        RoomModel.delete().where(RoomModel.survey_id == survey_id).execute()
+    logger.info(f"Survey {survey_id}: {nb_observations} rooms normalized, {nb_listings} new listings")
+    return nb_observations, nb_listings
@@ -0,0 +1,44 @@
+"""Fixtures shared by the offline tests: a migrated configuration and the fake
+explore_tabs API of helpers.py patched into HTTPRequest
+
+Test modules set NB_LISTINGS, and override config_extra or listings to
+change the configuration sections or the listings of the fake API.
+"""
+from bnb_kanpora.config import Config
+from bnb_kanpora.controllers import SearchSurveyController
+from bnb_kanpora.db import DBUtils
+from bnb_kanpora.http_requests import HTTPRequest
+from bnb_kanpora.test.helpers import BOX, FakeAirbnb, FakeSession, make_listings, write_config
+import pytest
+
+
+@pytest.fixture
+def config_extra() -> str:
+    """Configuration sections replacing those of example.config"""
+    return ""
+
+
+@pytest.fixture
+def config(tmp_path, config_extra):
+    config = Config(write_config(tmp_path, extra=config_extra))
+    DBUtils(config).migrate()
+    # no pacing against the fake API
+    config.INITIAL_REQUEST_RATE = config.MAX_REQUEST_RATE = 10000
+    return config
+
+
+@pytest.fixture
+def listings(request) -> list:
+    return make_listings(request.module.NB_LISTINGS, **BOX)
+
+
+@pytest.fixture
+def airbnb(monkeypatch, listings):
+    airbnb = FakeAirbnb(listings)
+    monkeypatch.setattr(HTTPRequest, "_get_session", lambda self, proxy=None, user_agent=None: FakeSession(airbnb, proxy, user_agent))
+    return airbnb
+
+
+@pytest.fixture
+def survey_controller(config):
+    return SearchSurveyController(config)
@@ -0,0 +1,220 @@
+"""Offline test helpers: configuration files and a fake explore_tabs API"""
+import html
+import json
+import os
+import random
+import re
+import threading
+from datetime import date
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), "..", "..", "example.config")
+# Châteauroux, the search area of the offline surveys
+BOX = dict(s_lat=46.771898, w_lng=1.581617, n_lat=46.916375, e_lng=1.800148)
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room"]
+# Airbnb never reports more than this number of listings for a search
+LISTINGS_COUNT_CAP = 1001
+LISTINGS_PER_PAGE = 18
+
+
+def write_config(tmp_path, database_section:str=None, extra:str="") -> str:
+    """Write example.config to tmp_path, with its [DATABASE] section and the
+    sections found in extra replaced"""
+    with open(EXAMPLE_CONFIG) as f:
+        content = f.read()
+    database_section = database_section or f"[DATABASE]\ndb_name = {tmp_path / 'bnb'}"
+    content = re.sub(r"\[DATABASE\].*?(?=\[NETWORK\])", database_section + "\n\n", content, flags=re.S)
+    for section in re.findall(r"^\[(\w+)\]", extra, flags=re.M):
+        content = re.sub(rf"^\[{section}\].*?(?=^\[|\Z)", "", content, flags=re.S | re.M)
+    content = content.replace("#proxy_list = ", "proxy_list = ")
+    config_file = tmp_path / "test.config"
+    config_file.write_text(content + "\n" + extra)
+    return str(config_file)
+
+
+def run_survey(config, name:str="Gotham City") -> int:
+    """Add a survey of BOX and run it, returns its survey_id"""
+    from bnb_kanpora.controllers import SearchAreaController, SearchSurveyController
+    from bnb_kanpora.utils import GeoBox
+    controller = SearchSurveyController(config)
+    survey = controller.add(SearchAreaController(config).add(name, GeoBox(**BOX)))
+    controller.run(survey)
+    return survey
+
+
+def make_listings(nb_listings:int, s_lat:float, w_lng:float, n_lat:float, e_lng:float, seed:int=0) -> list:
+    """Random listings in a box, shaped like explore_tabs listings"""
+    rnd = random.Random(seed)
+    listings = []
+    for i in range(nb_listings):
+        # denser towards the centre, like a city
+        lat = min(max(rnd.gauss((s_lat + n_lat) / 2, (n_lat - s_lat) / 5), s_lat), n_lat - 1e-7)
+        lng = min(max(rnd.gauss((w_lng + e_lng) / 2, (e_lng - w_lng) / 5), w_lng), e_lng - 1e-7)
+        price = int(rnd.lognormvariate(4.2, 0.6))
+        listings.append({
+            "listing": {
+                "id": 1000000 + i,
+                "room_type": rnd.choices(ROOM_TYPES, weights=[70, 27, 3])[0],
+                "user": {"id": 500 + i // 3},
+                "public_address": "Châteauroux, Centre-Val de Loire, France",
+                "reviews_count": rnd.randint(0, 200),
+                "star_rating": rnd.choice([None, 4.5, 5.0]),
+                "person_capacity": rnd.randint(1, 8),
+                "bedrooms": rnd.randint(1, 4),
+                "bathrooms": 1.0,
+                "lat": lat,
+                "lng": lng,
+                "name": f"Listing {i}",
+                "localized_city": "Châteauroux",
+                "picture_url": f"https://a0.muscache.com/im/pictures/{i}.jpg",
+                "pdp_type": "MARKETPLACE",
+                "pdp_url_type": "rooms",
+                "license": None,
+            },
+            "pricing_quote": {
+                "structured_stay_display_price": {"primary_line": {"price": f"{price:,}\xa0€".replace(",", " ")}},
+                "rate_with_service_fee": {"amount": price * 1.14},
+                "rate": {"currency": "EUR", "amount": price},
+            },
+        })
+    return listings
+
+
+class FakeResponse():
+    def __init__(self, status_code:int=200, body:bytes=b"", headers:dict=None) -> None:
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeAirbnb():
+    """Serve explore_tabs pages from a fixed set of listings, with Airbnb's
+    listings_count cap, pagination, room type, price, dates and guests filters"""
+
+    def __init__(self, listings:list) -> None:
+        self.listings = listings
+        self.nb_requests = 0
+        self.nb_warmups = 0
+        self.nb_room_requests = 0
+        self.nb_host_requests = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_available(room_id:int, checkin:str) -> bool:
+        """A third of the rooms are booked on any date"""
+        return (room_id + date.fromisoformat(checkin).toordinal()) % 3 != 0
+
+    def matching(self, params:dict) -> list:
+        n_lat, e_lng = float(params["ne_lat"]), float(params["ne_lng"])
+        s_lat, w_lng = float(params["sw_lat"]), float(params["sw_lng"])
+        room_type = params.get("room_types[]")
+        price_min = float(params["price_min"]) if params.get("price_min") is not None else None
+        price_max = float(params["price_max"]) if params.get("price_max") is not None else None
+        checkin = params.get("checkin")
+        guests = int(params.get("guests") or 0)
+        result = []
+        for room in self.listings:
+            listing = room["listing"]
+            if not (s_lat <= listing["lat"] < n_lat and w_lng <= listing["lng"] < e_lng):
+                continue
+            if room_type and listing["room_type"] != room_type:
+                continue
+            price = room["pricing_quote"]["rate"]["amount"]
+            if price_min is not None and price < price_min:
+                continue
+            if price_max is not None and price > price_max:
+                continue
+            if checkin and not self.is_available(listing["id"], checkin):
+                continue
+            if guests > listing["person_capacity"]:
+                continue
+            result.append(room)
+        return result
+
+    def room_page(self, room_id:int) -> FakeResponse:
+        """Room page in the format parsed by ABListingExtraController"""
+        rooms = [room["listing"] for room in self.listings if room["listing"]["id"] == room_id]
+        if not rooms:
+            return FakeResponse(404)
+        listing = rooms[0]
+        bootstrap = html.escape(json.dumps({"listing": {"user": listing["user"], "star_rating": listing["star_rating"]}}))
+        page = f"""<html><head>
+<meta id="_bootstrap-listing" content="{bootstrap}">
+<meta property="airbedandbreakfast:city" content="{listing['localized_city']}">
+</head><body>
+<div class="rich-toggle" data-address="{listing['id']} rue de la Gare, {listing['localized_city']} (Centre)"></div>
+<div class="col-md-6">
+<div><span>Room type:</span><strong>{listing['room_type']}</strong></div>
+<div><span>Bedrooms:</span><strong>{listing['bedrooms']}</strong></div>
+<div><span>Bathrooms:</span><strong>1.5</strong></div>
+</div></body></html>"""
+        return FakeResponse(200, page.encode("utf-8"))
+
+    def host_page(self, host_id:int) -> FakeResponse:
+        """Host profile page in the format parsed by hosts.parse_host_profile"""
+        listings = [room["listing"] for room in self.listings if room["listing"]["user"]["id"] == host_id]
+        if not listings:
+            return FakeResponse(404)
+        user = {"id": host_id, "first_name": f"Host {host_id}", "location": "Châteauroux, France",
+                "languages": ["Français", "English"], "created_at": "2015-06-02T10:00:00Z",
+                "is_superhost": len(listings) > 2, "identity_verified": True,
+                "listings_count": len(listings), "reviewee_count": sum(l["reviews_count"] for l in listings)}
+        page = f"""<html><head>
+<meta property="og:title" content="Host {host_id}">
+<meta id="_bootstrap-user" content="{html.escape(json.dumps({"user": user}))}">
+</head><body></body></html>"""
+        return FakeResponse(200, page.encode("utf-8"))
+
+    def get(self, url:str, params:dict=None, timeout:float=None, **kwargs) -> FakeResponse:
+        with self._lock:
+            self.nb_requests += 1
+            if self.failures:
+                return self.failures.pop(0)
+        if "/rooms/" in url:
+            with self._lock:
+                self.nb_room_requests += 1
+            return self.room_page(int(url.rsplit("/", 1)[-1]))
+        if "/users/show/" in url:
+            with self._lock:
+                self.nb_host_requests += 1
+            return self.host_page(int(url.rsplit("/", 1)[-1]))
+        rooms = self.matching(params)
+        offset = int(params.get("items_offset") or 0)
+        page = rooms[offset:offset + LISTINGS_PER_PAGE]
+        body = {"explore_tabs": [{
+            "home_tab_metadata": {"listings_count": min(len(rooms), LISTINGS_COUNT_CAP)},
+            "sections": [
+                {"section_type_uid": "EXPERIENCES_GRID", "items": [{"id": i} for i in range(20)]},
+                {"section_type_uid": "PAGINATED_HOMES", "listings": page},
+            ],
+        }]}
+        return FakeResponse(200, json.dumps(body).encode("utf-8"))
+
+
+class FakeSession():
+    """Stands for a requests session, forwarding to a shared FakeAirbnb"""
+
+    def __init__(self, airbnb:FakeAirbnb, proxy:str=None, user_agent:str=None) -> None:
+        self.airbnb = airbnb
+        self.proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"} if proxy else {}
+        self.headers = {"User-Agent": user_agent or "Mozilla/5.0"}
+        self.cookies = {}
+        self.closed = False
+
+    def get(self, url:str, params:dict=None, timeout:float=None, **kwargs) -> FakeResponse:
+        return self.airbnb.get(url, params=params, timeout=timeout, **kwargs)
+
+    def head(self, url:str, timeout:float=None, **kwargs) -> FakeResponse:
+        with self.airbnb._lock:
+            self.airbnb.nb_warmups += 1
+        return FakeResponse(200)
+
+    def close(self) -> None:
+        self.closed = True
@@ -0,0 +1,80 @@
+from bnb_kanpora.aggregation import HexGrid, SpatialGrid, SquareGrid, aggregate
+from bnb_kanpora.models import SurveyRoomModel
+from bnb_kanpora.utils import GeoBox
+from bnb_kanpora.test.helpers import BOX, run_survey
+import json
+import numpy as np
+import pytest
+
+NB_LISTINGS = 60
+ROOM_TYPES = np.array(["Entire home/apt", "Private room", "Shared room"])
+
+def random_rooms(nb_rooms:int, seed:int=0) -> tuple:
+    rnd = np.random.default_rng(seed)
+    lats = rnd.uniform(BOX["s_lat"], BOX["n_lat"], nb_rooms)
+    lngs = rnd.uniform(BOX["w_lng"], BOX["e_lng"], nb_rooms)
+    rates = rnd.lognormal(4.2, 0.6, nb_rooms)
+    rates[rnd.random(nb_rooms) < 0.1] = np.nan
+    return lats, lngs, rates, rnd.choice(ROOM_TYPES, nb_rooms)
+
+def test_aggregate_in_chunks():
+    grid = SquareGrid(GeoBox(**BOX), 2000)
+    lats, lngs, rates, room_types = rooms = random_rooms(5000)
+    chunks = [tuple(a[i:i + 1700] for a in rooms) for i in range(0, 5000, 1700)]
+    cells = aggregate(grid, chunks)
+    assert cells.counts.sum() == 5000
+    assert aggregate(grid, [rooms]).median_rates.tolist() == pytest.approx(cells.median_rates.tolist(), nan_ok=True)
+
+    keys = grid.cell_keys(lats, lngs)
+    for i in range(0, len(cells.keys), 7):
+        in_cell = keys == cells.keys[i]
+        assert cells.counts[i] == in_cell.sum()
+        cell_rates = rates[in_cell & ~np.isnan(rates)]
+        assert cells.median_rates[i] == pytest.approx(np.median(cell_rates) if len(cell_rates) else np.nan, nan_ok=True)
+        for room_type, share in zip(cells.room_types, cells.room_type_shares[i]):
+            assert share == pytest.approx((room_types[in_cell] == room_type).mean())
+    assert aggregate(grid, []).counts.tolist() == []
+
+def test_grids():
+    box = GeoBox(**BOX)
+    lats, lngs, _, _ = random_rooms(20000)
+    square = SquareGrid(box, 1000)
+    polygons = square.cell_polygons(square.cell_keys(lats, lngs))
+    assert ((polygons[:, 0, 0] <= lngs) & (lngs <= polygons[:, 2, 0])).all()
+    assert ((polygons[:, 0, 1] <= lats) & (lats <= polygons[:, 2, 1])).all()
+
+    # every room is in the hexagon of the nearest center
+    hexes = HexGrid(box, 1000)
+    q, r = hexes.axial(hexes.cell_keys(lats, lngs))
+    x, y = hexes.to_meters(lats, lngs)
+    distances = np.hypot(x - 1000 * np.sqrt(3) * (q + r / 2), y - 1500 * r)
+    for dq, dr in [(1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1)]:
+        neighbor = np.hypot(x - 1000 * np.sqrt(3) * (q + dq + (r + dr) / 2), y - 1500 * (r + dr))
+        assert (distances <= neighbor + 1e-6).all()
+    assert hexes.cell_polygons(hexes.cell_keys(lats[:3], lngs[:3])).shape == (3, 7, 2)
+    with pytest.raises(ValueError):
+        SpatialGrid.create("triangle", box, 1000)
+    with pytest.raises(TypeError):
+        SpatialGrid(box, 1000)
+
+def test_survey_aggregate(airbnb, config, survey_controller, tmp_path):
+    controller = survey_controller
+    survey = run_survey(config)
+    controller.normalize(survey)
+    nb_rooms = SurveyRoomModel.select().where(SurveyRoomModel.survey_id == survey).count()
+    assert nb_rooms == NB_LISTINGS
+
+    path = controller.aggregate(survey, kind="hex", cell_size=800, folder=str(tmp_path))
+    with open(path) as f:
+        features = json.load(f)["features"]
+    assert sum(feature["properties"]["count"] for feature in features) == nb_rooms
+    assert all(len(feature["geometry"]["coordinates"][0]) == 7 for feature in features)
+    assert all(sum(v for k, v in feature["properties"].items() if k.startswith("share ")) == pytest.approx(1, abs=1e-3)
+               for feature in features)
+
+    raster = np.load(controller.aggregate(survey, cell_size=800, folder=str(tmp_path), raster=True))
+    assert raster["count"].sum() == nb_rooms
+    assert raster["room_type_shares"].shape[1:] == raster["count"].shape
+    assert raster["bounds"][2:].tolist() == [BOX["s_lat"], BOX["w_lng"]]
+    with pytest.raises(ValueError):
+        controller.aggregate(survey, kind="hex", folder=str(tmp_path), raster=True)
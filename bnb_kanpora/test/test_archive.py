@@ -0,0 +1,103 @@
+from bnb_kanpora.archive import RawArchive, SEARCH_PAGE, ROOM_PAGE
+from bnb_kanpora import controllers
+from bnb_kanpora.controllers import ABListingExtraController, HostController, PageFetchController, SearchAreaController
+from bnb_kanpora.models import HostModel, RoomModel, RoomPageModel
+from bnb_kanpora.utils import GeoBox
+from bnb_kanpora.test.helpers import BOX, run_survey
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import pytest
+import time
+
+NB_LISTINGS = 400
+
+def test_append_and_read(tmp_path):
+    archive = RawArchive(str(tmp_path), 1, segment_size=200)
+    bodies = [os.urandom(150) for _ in range(3)] + [b'{"explore_tabs": []}' * 50]
+    entries = [archive.append(SEARCH_PAGE, "0-1", body, page=i) for i, body in enumerate(bodies)]
+    entries.append(archive.append(ROOM_PAGE, 1234, b"<html></html>"))
+    archive.close()
+    # incompressible pages do not fit two in a segment
+    assert len(set(entry.segment for entry in entries)) >= 3
+    assert [archive.read(entry) for entry in entries[:4]] == bodies
+
+    # an archive opened again never writes to existing segments
+    archive = RawArchive(str(tmp_path), 1, segment_size=200)
+    entry = archive.append(SEARCH_PAGE, "0-2", b"{}")
+    archive.close()
+    assert entry.segment > max(e.segment for e in entries) and entry.offset == 0
+    assert [(e.key, e.page) for e in archive.entries(SEARCH_PAGE)] == [("0-1", 0), ("0-1", 1), ("0-1", 2), ("0-1", 3), ("0-2", 0)]
+    assert [e.key for e in archive.entries(ROOM_PAGE)] == ["1234"]
+    assert RawArchive(str(tmp_path), 2).entries() == []
+
+@pytest.fixture
+def config_extra(tmp_path) -> str:
+    return f"[ARCHIVE]\nfolder = {tmp_path / 'archive'}\nsegment_size = 100000\n"
+
+def test_survey_reparse(airbnb, config, survey_controller):
+    controller = survey_controller
+    survey = controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    controller.run(survey)
+    archive = controller.get_archive(survey)
+    assert len(archive.entries(SEARCH_PAGE)) == airbnb.nb_requests
+    assert controller.metrics.value("archive_bytes_total") > 0
+
+    # a column mapped wrongly during the crawl is fixed without crawling again
+    RoomModel.update(name="", reviews=-1).where(RoomModel.survey_id == survey).execute()
+    nb_requests = airbnb.nb_requests
+    assert controller.reparse(survey, max_workers=2) == NB_LISTINGS
+    assert airbnb.nb_requests == nb_requests
+    rooms = RoomModel.select().where(RoomModel.survey_id == survey)
+    assert rooms.count() == NB_LISTINGS
+    assert all(room.name.startswith("Listing ") and room.reviews != -1 for room in rooms)
+
+def test_concurrent_archive_pages(config, tmp_path, monkeypatch):
+    opened = []
+    class SlowArchive(RawArchive):
+        def __init__(self, *args, **kwargs):
+            opened.append(self)
+            time.sleep(0.05)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(controllers, "RawArchive", SlowArchive)
+    controller = PageFetchController(config)
+    bodies = [os.urandom(100) for _ in range(40)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda item: controller._archive_page(1, ROOM_PAGE, item[0], item[1]), enumerate(bodies)))
+    controller.close()
+
+    # the fetching threads share one archive of the survey
+    assert len(opened) == 1
+    archive = RawArchive(str(tmp_path / "archive"), 1)
+    assert sorted(archive.read(entry) for entry in archive.entries(ROOM_PAGE)) == sorted(bodies)
+
+def test_room_and_host_pages_reparse(airbnb, config):
+    survey = run_survey(config)
+    controller = ABListingExtraController(config)
+    try:
+        controller.fill_loop_by_room(survey)
+    finally:
+        controller.close()
+    hosts = HostController(config)
+    try:
+        nb_hosts, _ = hosts.fill_hosts(survey)
+    finally:
+        hosts.close()
+
+    # room and host fields mapped wrongly are fixed without fetching the pages again
+    RoomModel.update(neighborhood=None, bathrooms=None).where(RoomModel.survey_id == survey).execute()
+    RoomPageModel.update(neighborhood=None).execute()
+    HostModel.update(name=None).execute()
+    nb_room_requests, nb_host_requests = airbnb.nb_room_requests, airbnb.nb_host_requests
+    assert ABListingExtraController(config).reparse(survey) == NB_LISTINGS
+    assert HostController(config).reparse(survey) == nb_hosts
+    assert (airbnb.nb_room_requests, airbnb.nb_host_requests) == (nb_room_requests, nb_host_requests)
+    rooms = RoomModel.select().where(RoomModel.survey_id == survey)
+    assert all(room.bathrooms == 1.5 and room.neighborhood == "Centre" for room in rooms)
+    assert all(page.neighborhood == "Centre" for page in RoomPageModel.select())
+    assert HostModel.get_by_id(500).name == "Host 500"
+
+    # a page fetched after the archived one is kept
+    RoomPageModel.update(neighborhood="Fresh", fetched_at=datetime.now() + timedelta(days=1)).execute()
+    ABListingExtraController(config).reparse(survey)
+    assert all(page.neighborhood == "Fresh" for page in RoomPageModel.select())
@@ -0,0 +1,75 @@
+from bnb_kanpora.config import Config
+from bnb_kanpora.db import DBUtils
+from bnb_kanpora.backends import DatabaseBackend, SqliteBackend, PostgresqlBackend, get_backend
+from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel
+from bnb_kanpora.test.helpers import write_config
+import os
+import pytest
+
+# PostgreSQL tests run against a local instance when BNB_KANPORA_TEST_PG_DB is set,
+# e.g. BNB_KANPORA_TEST_PG_DB=bnb_kanpora_test BNB_KANPORA_TEST_PG_USER=postgres
+PG_DB = os.environ.get("BNB_KANPORA_TEST_PG_DB")
+
+def sample_rows(survey_id:int, nb_rooms:int) -> list:
+    return [dict(
+        survey_id=survey_id, room_id=1000 + i, host_id=i % 3, name=f"Room {i}\twith tab",
+        room_type="Entire home/apt", city="Châteauroux", address="Châteauroux, France",
+        latitude=46.8 + i / 1000, longitude=1.69, rate=1250.0, bedrooms=None,
+    ) for i in range(nb_rooms)]
+
+def run_bulk_insert(config:Config):
+    DBUtils(config).migrate()
+    search_area = SearchAreaModel.create(name="Gotham City", bb_n_lat=46.9, bb_e_lng=1.8, bb_s_lat=46.7, bb_w_lng=1.5)
+    survey = SurveyModel.create(search_area_id=search_area)
+    rows = sample_rows(survey.survey_id, 1200)
+    assert config.backend.bulk_insert_rooms(config.database, rows) == 1200
+    # already saved rooms and incomplete rows are skipped
+    rows.append(dict(rows[0], room_id=1, city=None))
+    assert config.backend.bulk_insert_rooms(config.database, rows) == 0
+    room = RoomModel.get((RoomModel.survey_id == survey.survey_id) & (RoomModel.room_id == 1000))
+    assert room.rate == 1250.0
+    assert room.name == "Room 0\twith tab"
+    assert room.deleted is False
+
+def test_get_backend():
+    assert isinstance(get_backend({"db_name": "bnb"}), SqliteBackend)
+    assert isinstance(get_backend({"db_name": "bnb", "engine": "PostgreSQL"}), PostgresqlBackend)
+    with pytest.raises(ValueError):
+        get_backend({"db_name": "bnb", "engine": "oracle"})
+
+def test_incomplete_backend():
+    class IncompleteBackend(DatabaseBackend):
+        def create_database(self):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteBackend({"db_name": "bnb"})
+
+def test_sqlite_bulk_insert(tmp_path):
+    config = Config(write_config(tmp_path, f"[DATABASE]\ndb_name = {tmp_path / 'bnb'}"))
+    assert config.backend.url == f"sqlite:///{tmp_path / 'bnb'}.db"
+    run_bulk_insert(config)
+
+@pytest.mark.skipif(PG_DB is None, reason="no local PostgreSQL configured")
+def test_postgresql_bulk_insert(tmp_path):
+    section = "\n".join([
+        "[DATABASE]",
+        "engine = postgresql",
+        f"db_name = {PG_DB}",
+        f"host = {os.environ.get('BNB_KANPORA_TEST_PG_HOST', 'localhost')}",
+        f"user = {os.environ.get('BNB_KANPORA_TEST_PG_USER', 'postgres')}",
+        f"password = {os.environ.get('BNB_KANPORA_TEST_PG_PASSWORD', '')}",
+    ])
+    config = Config(write_config(tmp_path, section))
+    with config.database.atomic():
+        for model in (RoomModel, SurveyModel, SearchAreaModel):
+            model.delete().execute()
+    run_bulk_insert(config)
+    # VACUUM runs outside of a transaction block, then the connection is restored
+    RoomModel.select().count()
+    for full in (False, True):
+        assert isinstance(config.backend.compact(config.database, full=full), int)
+        assert config.database.connection().autocommit is False
+    with pytest.raises(ValueError):
+        with config.database.atomic():
+            config.backend.compact(config.database)
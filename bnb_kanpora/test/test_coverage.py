@@ -0,0 +1,55 @@
+from bnb_kanpora.coverage import CoverageEstimator
+from bnb_kanpora.utils import SurveyResults
+
+def test_uncapped_root():
+    estimator = CoverageEstimator()
+    assert estimator.coverage is None
+    estimator.add_node("0")
+    estimator.complete("0", 40, range(40))
+    assert estimator.total == 40
+    assert estimator.coverage == 1.0
+
+def test_capped_root_uses_children():
+    estimator = CoverageEstimator()
+    estimator.add_node("0")
+    estimator.complete("0", 1001, range(90))
+    assert estimator.total == 1001
+    # priors of the children, from the sample of the parent
+    for idx, prior in enumerate([800, 400, 200, 100]):
+        estimator.add_node(f"0-{idx}", "0", prior)
+    assert estimator.total == 1500
+    estimator.complete("0-0", 700, range(100, 190))
+    assert estimator.total == 1400
+    # a capped child defers to its own children
+    estimator.complete("0-1", 1001, range(200, 290))
+    assert estimator.total == 2001
+    estimator.add_node("0-1-0", "0-1", 600)
+    estimator.add_node("0-1-1", "0-1", 600)
+    assert estimator.total == 2200
+    estimator.complete("0-1-0", 500, range(300, 390))
+    estimator.complete("0-1-1", 550, range(400, 490))
+    estimator.complete("0-2", 150, range(500, 590))
+    estimator.complete("0-3", 50, range(600, 650))
+    assert estimator.total == 700 + 1050 + 150 + 50
+    assert estimator.nb_observed == 90 + 90 + 90 + 90 + 90 + 90 + 50
+    assert estimator.coverage == round(estimator.nb_observed / 1950, 4)
+
+def test_capped_count_is_a_lower_bound():
+    estimator = CoverageEstimator()
+    estimator.add_node("0")
+    estimator.complete("0", 1001, [])
+    estimator.add_node("0-r0", "0", 300)
+    estimator.add_node("0-r1", "0", 300)
+    assert estimator.total == 1001
+    # children of an uncapped node do not change its count
+    estimator.complete("0-r0", 900, [])
+    estimator.add_node("0-r0-p0", "0-r0", 5000)
+    assert estimator.total == 1200
+
+def test_survey_results():
+    results = SurveyResults()
+    assert results.total_nb_rooms_expected == 0
+    results.estimator.add_node("0")
+    results.estimator.complete("0", 12, range(12))
+    assert results.total_nb_rooms_expected == 12
+    assert results.coverage == 1.0
@@ -0,0 +1,36 @@
+from bnb_kanpora import decoding
+from bnb_kanpora.decoding import decode_explore_tabs
+from bnb_kanpora.test.helpers import BOX, FakeAirbnb, make_listings
+import json
+import pytest
+
+PARAMS = dict(ne_lat=BOX["n_lat"], ne_lng=BOX["e_lng"], sw_lat=BOX["s_lat"], sw_lng=BOX["w_lng"])
+
+def body(listings_count, sections):
+    return json.dumps({"explore_tabs": [{"home_tab_metadata": {"listings_count": listings_count}, "sections": sections}]}).encode()
+
+@pytest.fixture(params=["default", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(decoding, "loads", json.loads)
+
+def test_decode_page(backend):
+    airbnb = FakeAirbnb(make_listings(30, **BOX))
+    listings_count, listings = decode_explore_tabs(airbnb.get("", params=PARAMS).content)
+    assert listings_count == 30
+    assert [l["listing"]["id"] for l in listings] == [l["listing"]["id"] for l in airbnb.listings[:18]]
+
+def test_decode_no_listings(backend):
+    assert decode_explore_tabs(body(0, [{"section_type_uid": "PAGINATED_HOMES", "listings": [{}]}])) == (0, [])
+
+def test_decode_low_inventory(backend):
+    sections = [{"section_type_uid": "HOMES_LOW_INVENTORY_ZOOM_OUT"}, {"section_type_uid": "PAGINATED_HOMES", "listings": [{}]}]
+    assert decode_explore_tabs(body(3, sections)) == (3, None)
+
+def test_decode_errors(backend):
+    with pytest.raises(ValueError):
+        decode_explore_tabs(b"<html>Access denied</html>")
+    with pytest.raises(KeyError):
+        decode_explore_tabs(b'{"explore_tabs": [{}, {}]}')
+    with pytest.raises(KeyError):
+        decode_explore_tabs(b'{"error": "forbidden"}')
@@ -0,0 +1,81 @@
+from bnb_kanpora.controllers import SearchAreaController
+from bnb_kanpora.frontier import CrawlBudget, Frontier, estimate_children
+from bnb_kanpora.models import RoomModel
+from bnb_kanpora.quadtree import QuadTree, ROOT
+from bnb_kanpora.records import RoomRecord
+from bnb_kanpora.utils import GeoBox, SearchFilters, SearchResults
+from bnb_kanpora.test.helpers import BOX
+import pytest
+
+NB_LISTINGS = 1500
+
+def test_frontier_order():
+    frontier = Frontier()
+    box = GeoBox(**BOX)
+    ne, nw, se, _ = [(key, SearchFilters()) for key in QuadTree.children(ROOT)]
+    frontier.push(ne, box, 2.0)
+    frontier.push(nw, box, 5.0)
+    frontier.push(se, box, 2.0)
+    assert [frontier.pop()[0] for _ in range(3)] == [nw, ne, se]
+    assert not frontier
+
+def test_budget():
+    nb_requests = [10]
+    budget = CrawlBudget(max_requests=5)
+    assert budget.is_limited and not CrawlBudget(0, 0).is_limited
+    budget.start(lambda: nb_requests[0])
+    assert not budget.exhausted()
+    nb_requests[0] = 15
+    assert budget.exhausted()
+    budget = CrawlBudget(duration=1e-9)
+    budget.start(lambda: 0)
+    assert budget.exhausted()
+    budget = CrawlBudget(target_coverage=0.9)
+    assert not budget.target_reached(None) and not budget.target_reached(0.5)
+    assert budget.target_reached(0.95)
+
+def test_estimate_children():
+    box = GeoBox(**BOX)
+    north, south = box.get_two_splits()
+    # 60 listings found in the north, 30 in the south, out of 900
+    rooms = [RoomRecord(latitude=north.s_lat + 0.01, longitude=box.w_lng + 0.01)] * 60 + \
+            [RoomRecord(latitude=south.s_lat + 0.01, longitude=box.w_lng + 0.01)] * 30
+    results = SearchResults(nb_rooms_expected=900, rooms=rooms, geobox=box)
+    children = [((key, SearchFilters()), child_box) for key, child_box in zip(QuadTree.children(ROOT), (north, south))]
+    (north_priority, north_expected), (south_priority, south_expected) = estimate_children(results, children, 18, 90)
+    assert north_expected == pytest.approx(600)
+    assert south_expected == pytest.approx(300)
+    # 540 new listings on 5 pages
+    assert north_priority == pytest.approx(540 / 5)
+    assert north_priority > south_priority
+
+def test_survey_budget(airbnb, survey_controller):
+    config = survey_controller.config
+    survey = survey_controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    results = survey_controller.run(survey, max_requests=40)
+    assert results.budget_exhausted
+    # nodes in flight finish their current page
+    assert 40 <= airbnb.nb_requests <= 40 + config.MAX_CONCURRENCY
+    assert results.nb_nodes_left > 0
+    assert 0 < results.coverage < 1
+    nb_saved = RoomModel.select().where(RoomModel.survey_id == survey).count()
+    assert nb_saved == results.total_nb_saved < NB_LISTINGS
+    # the estimate is in the right ballpark
+    assert results.coverage == pytest.approx(nb_saved / NB_LISTINGS, abs=0.25)
+
+def test_survey_target_coverage(airbnb, survey_controller):
+    config = survey_controller.config
+    survey = survey_controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    results = survey_controller.run(survey, target_coverage=0.6)
+    assert results.target_reached and not results.budget_exhausted
+    assert results.coverage >= 0.6
+    assert 0.45 < results.total_nb_saved / NB_LISTINGS < 1
+
+def test_survey_without_budget(airbnb, survey_controller):
+    config = survey_controller.config
+    survey = survey_controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    results = survey_controller.run(survey)
+    assert not results.budget_exhausted
+    assert results.nb_nodes_left == 0
+    assert results.coverage == 1
+    assert results.total_nb_saved == NB_LISTINGS
@@ -0,0 +1,63 @@
+from bnb_kanpora.controllers import (DatabaseController, RetentionController, RoomController, SearchAreaController,
+                                     SearchSurveyController)
+from bnb_kanpora.models import RoomModel, RoomSearchModel
+from bnb_kanpora.utils import GeoBox
+from bnb_kanpora.test.helpers import BOX
+import pytest
+
+NB_LISTINGS = 60
+
+@pytest.fixture
+def listings(listings):
+    for i, listing in enumerate(listings[:6]):
+        listing["listing"]["name"] = f"Loft près de la gare {i}"
+    for listing in listings[3:9]:
+        listing["listing"]["license"] = "36044000123AB"
+    return listings
+
+def room_ids(rooms) -> list:
+    return sorted((int(room.survey_id), int(room.room_id)) for room in rooms)
+
+def test_search(airbnb, config):
+    controller = SearchSurveyController(config)
+    areas = [SearchAreaController(config).add(name, GeoBox(**BOX)) for name in ("Gotham City", "Metropolis")]
+    surveys = [controller.add(area) for area in areas + areas[:1]]
+    for survey in surveys:
+        controller.run(survey)
+    rooms = RoomController(config)
+
+    found = rooms.search("gare")
+    assert len(found) == 6 * 3
+    assert all("gare" in room.name for room in found)
+    # accents are ignored
+    assert len(rooms.search("pres gare", survey_ids=[surveys[0]])) == 6
+    assert len(rooms.search("gare", search_area_id=areas[0])) == 12
+    assert len(rooms.search("36044000123AB", field="license", survey_ids=[surveys[1]])) == 6
+    assert rooms.search("gare", field="license") == []
+    assert len(rooms.search("gare", limit=5)) == 5
+    with pytest.raises(ValueError):
+        rooms.search("gare", field="rate")
+
+    # the index follows room updates, normalization and purges
+    room_id = found[0].room_id
+    RoomModel.update(address="Rue Victor Hugo").where(RoomModel.room_id == room_id).execute()
+    assert len(rooms.search("hugo")) == 3
+    controller.normalize(surveys[0])
+    assert room_ids(rooms.search("gare", survey_ids=[surveys[0]])) == room_ids(r for r in found if int(r.survey_id) == surveys[0])
+    assert len(rooms.search("hugo", survey_ids=[surveys[0]])) == 1
+    RetentionController(config).purge(surveys[:2])
+    assert room_ids(rooms.search("gare")) == room_ids(r for r in found if int(r.survey_id) == surveys[2])
+    assert RoomSearchModel.select().count() == NB_LISTINGS
+
+def test_rebuild_after_vacuum(airbnb, config):
+    controller = SearchSurveyController(config)
+    area = SearchAreaController(config).add("Gotham City", GeoBox(**BOX))
+    surveys = [controller.add(area) for _ in range(2)]
+    for survey in surveys:
+        controller.run(survey)
+    controller.delete(surveys[0])
+    DatabaseController(config).compact(full=True)
+    # rows are found, and deleted, by their new rowids
+    assert len(RoomController(config).search("gare")) == 6
+    controller.delete(surveys[1])
+    assert RoomSearchModel.select().count() == 0
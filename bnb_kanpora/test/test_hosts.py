@@ -0,0 +1,42 @@
+from bnb_kanpora.controllers import HostController
+from bnb_kanpora.hosts import parse_host_profile
+from bnb_kanpora.models import HostModel, RoomModel
+from bnb_kanpora.test.helpers import BOX, FakeAirbnb, make_listings, run_survey
+from datetime import date
+
+NB_LISTINGS = 60
+
+def test_parse_host_profile():
+    airbnb = FakeAirbnb(make_listings(6, **BOX))
+    fields = parse_host_profile(airbnb.host_page(500).content)
+    assert fields["name"] == "Host 500" and fields["location"] == "Châteauroux, France"
+    assert fields["languages"] == "Français, English"
+    assert fields["member_since"] == date(2015, 6, 2)
+    assert fields["nb_listings"] == 3 and fields["is_superhost"] is True and fields["about"] is None
+
+    fields = parse_host_profile(b'<html><head><meta property="og:title" content="Ana"></head></html>')
+    assert fields["name"] == "Ana" and fields["nb_listings"] is None
+
+def fill(config, survey, max_age=None) -> tuple:
+    controller = HostController(config)
+    try:
+        return controller.fill_hosts(survey, max_age=max_age)
+    finally:
+        controller.close()
+
+def test_hosts_fetched_once(airbnb, config):
+    survey = run_survey(config)
+    nb_hosts = RoomModel.select(RoomModel.host_id).where(RoomModel.survey_id == survey).distinct().count()
+    assert nb_hosts < NB_LISTINGS
+    assert fill(config, survey) == (nb_hosts, nb_hosts)
+    assert airbnb.nb_host_requests == nb_hosts
+    assert HostModel.select().count() == nb_hosts
+    host = HostModel.get_by_id(500)
+    assert host.nb_listings == 3 and host.name == "Host 500"
+
+    # fresh profiles are not fetched again, even by another survey
+    airbnb.nb_host_requests = 0
+    assert fill(config, run_survey(config)) == (nb_hosts, 0)
+    assert airbnb.nb_host_requests == 0
+    assert fill(config, survey, max_age=0) == (nb_hosts, nb_hosts)
+    assert HostModel.select().count() == nb_hosts
@@ -0,0 +1,101 @@
+from bnb_kanpora.db import MODELS
+from bnb_kanpora.migrations import Migrator, MIGRATIONS
+from bnb_kanpora.models import RoomModel, SearchAreaModel, SurveyModel, SurveyProgressModel
+from bnb_kanpora.quadtree import QuadTree, ROOT
+from playhouse.sqlite_ext import SqliteExtDatabase
+import pytest
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE "search_area" ("search_area_id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, "abbreviation" VARCHAR(255), "bb_n_lat" DECIMAL(30, 6) NOT NULL, "bb_e_lng" DECIMAL(30, 6) NOT NULL, "bb_s_lat" DECIMAL(30, 6) NOT NULL, "bb_w_lng" DECIMAL(30, 6) NOT NULL)',
+    'CREATE TABLE "survey" ("survey_id" INTEGER NOT NULL PRIMARY KEY, "survey_date" DATETIME NOT NULL, "survey_description" VARCHAR(255), "comment" VARCHAR(255), "survey_method" VARCHAR(20) NOT NULL, "status" SMALLINT NOT NULL, "search_area_id" INTEGER NOT NULL, FOREIGN KEY ("search_area_id") REFERENCES "search_area" ("search_area_id"))',
+    'CREATE TABLE "room" ("survey_id" INTEGER NOT NULL, "room_id" INTEGER NOT NULL, "host_id" INTEGER NOT NULL, "name" VARCHAR(255) NOT NULL, "room_type" VARCHAR(100) NOT NULL, "city" VARCHAR(100) NOT NULL, "neighborhood" VARCHAR(255), "address" VARCHAR(2000) NOT NULL, "reviews" INTEGER, "overall_satisfaction" DECIMAL(5, 2), "accommodates" INTEGER, "bedrooms" DECIMAL(5, 2), "bathrooms" DECIMAL(5, 2), "deleted" INTEGER NOT NULL, "license" VARCHAR(2000), "last_modified" DATETIME NOT NULL, "latitude" DECIMAL(30, 6) NOT NULL, "longitude" DECIMAL(30, 6) NOT NULL, "coworker_hosted" INTEGER, "extra_host_languages" VARCHAR(100), "currency" VARCHAR(20), "picture_url" VARCHAR(200), "pdp_type" VARCHAR(200), "pdp_url_type" VARCHAR(200), "rate" DECIMAL(5, 2), "rate_with_service_fee" DECIMAL(5, 2), "monthly_price_factor" DECIMAL(5, 3), "weekly_price_factor" DECIMAL(5, 3), PRIMARY KEY ("survey_id", "room_id"), FOREIGN KEY ("survey_id") REFERENCES "survey" ("survey_id"))',
+    'CREATE INDEX "roommodel_survey_id" ON "room" ("survey_id")',
+    'CREATE TABLE "survey_progress" ("id" INTEGER NOT NULL PRIMARY KEY, "survey_id" INTEGER NOT NULL, "room_type" VARCHAR(100) NOT NULL, "guests" INTEGER, "price_min" DECIMAL(5, 2), "price_max" DECIMAL(52), "quadtree_node" VARCHAR(1000) NOT NULL, "last_modified" DATETIME NOT NULL, FOREIGN KEY ("survey_id") REFERENCES "survey" ("survey_id"))',
+    "INSERT INTO search_area VALUES (1, 'Gotham City', 'gotham_cit', 46.9, 1.8, 46.7, 1.5)",
+    "INSERT INTO survey VALUES (1, '2022-01-01 00:00:00', NULL, NULL, 'neighborhood', 0, 1)",
+    "INSERT INTO survey_progress VALUES (1, 1, 'Private room', NULL, 50, 80, '0-2-1', '2022-01-01 00:00:00')",
+    "INSERT INTO survey_progress VALUES (2, 1, 'Entire home/apt', NULL, 50, 80, '0', '2022-01-01 00:00:00')",
+    "INSERT INTO room VALUES (1, 40279867, 42, 'Loft', 'Entire home/apt', 'Châteauroux', NULL, 'Châteauroux, France', 12, 4.8, 4, 2, 1, 0, NULL, '2022-01-01 00:00:00', 46.81, 1.69, NULL, NULL, 'EUR', NULL, NULL, NULL, 85, 97.5, 0.8, 0.9)",
+]
+
+@pytest.fixture
+def database(tmp_path):
+    database = SqliteExtDatabase(str(tmp_path / "migrations.db"), pragmas=(('foreign_keys', 1),))
+    database.bind(MODELS)
+    database.connect()
+    yield database
+    database.close()
+
+def test_migrate_empty_database(database):
+    applied = Migrator(database).migrate()
+    assert applied == [m[0] for m in MIGRATIONS]
+    assert Migrator(database).pending() == []
+    assert Migrator(database).migrate() == []
+
+def test_migrate_legacy_database_in_place(database):
+    for sql in LEGACY_SCHEMA:
+        database.execute_sql(sql)
+
+    Migrator(database).migrate()
+
+    column_types = {c.name: c.data_type for c in database.get_columns("room")}
+    assert column_types["rate"] == "REAL"
+    assert column_types["latitude"] == "REAL"
+    indexed = {tuple(i.columns) for i in database.get_indexes("room")}
+    assert {("room_id",), ("host_id",), ("city",), ("latitude", "longitude")} <= indexed
+
+    room = RoomModel.get(RoomModel.room_id == 40279867)
+    assert room.rate == 85.0
+    assert room.weekly_price_factor == 0.9
+    assert room.survey_id.search_area_id.name == "Gotham City"
+    assert database.execute_sql('SELECT "room_id", "rate" FROM "survey_room"').fetchall() == [(40279867, 85.0)]
+
+    assert {c.name: c.data_type for c in database.get_columns("search_area")}["bb_n_lat"] == "REAL"
+    assert SearchAreaModel.get_by_id(1).search_polygon is None
+    assert SearchAreaModel.get_by_id(1).geobox.n_lat == 46.9
+    assert SurveyModel.get_by_id(1).search_area_id.search_area_id == 1
+    progress = SurveyProgressModel.get_by_id(1)
+    assert progress.quadtree_node == QuadTree.from_string("0-2-1")
+    assert QuadTree.to_string(progress.quadtree_node) == "0-2-1"
+    assert SurveyProgressModel.get_by_id(2).quadtree_node == ROOT
+    assert database.execute_sql("PRAGMA foreign_key_check").fetchall() == []
+
+def test_native_numeric_migration_keeps_search_area(database):
+    for sql in LEGACY_SCHEMA:
+        database.execute_sql(sql)
+    for version, _, func in MIGRATIONS:
+        if version <= 2:
+            func(database)
+
+    # search_area bounds are only converted by migration 5
+    assert {c.name: c.data_type for c in database.get_columns("search_area")}["bb_n_lat"].startswith("DECIMAL")
+    assert {c.name: c.data_type for c in database.get_columns("room")}["rate"] == "REAL"
+
+def _schema(database) -> dict:
+    return {table: ({(c.name, c.data_type, c.null) for c in database.get_columns(table)},
+                    {(i.name, tuple(i.columns), i.unique) for i in database.get_indexes(table)})
+            for table in database.get_tables() if not table.startswith(("room_fts", "sqlite_"))}
+
+def test_migrated_schema_matches_models(database, tmp_path):
+    Migrator(database).migrate()
+    created = SqliteExtDatabase(str(tmp_path / "created.db"))
+    with created.bind_ctx(MODELS):
+        created.create_tables(MODELS)
+    assert _schema(database) == _schema(created)
+
+def test_first_migration_creates_its_own_schema(database):
+    for version, _, func in MIGRATIONS:
+        if version == 1:
+            func(database)
+
+    # the tables are created as they were in version 1, whatever the models became
+    columns = {c.name: c.data_type for c in database.get_columns("search_area")}
+    assert "polygon" not in columns
+    assert columns["bb_n_lat"].startswith("DECIMAL")
+    assert {c.name: c.data_type for c in database.get_columns("survey_progress")}["quadtree_node"].startswith("VARCHAR")
+
+@pytest.mark.parametrize("foreign_keys", [0, 1])
+def test_migrate_restores_foreign_keys(database, foreign_keys):
+    database.execute_sql(f"PRAGMA foreign_keys = {foreign_keys}")
+    Migrator(database).migrate()
+    assert database.execute_sql("PRAGMA foreign_keys").fetchone()[0] == foreign_keys
@@ -0,0 +1,86 @@
+from bnb_kanpora.controllers import SearchAreaController
+from bnb_kanpora.models import RoomModel, SearchAreaModel
+from bnb_kanpora.polygon import SearchPolygon
+from bnb_kanpora.records import RoomRecord
+from bnb_kanpora.utils import GeoBox, SearchResults
+from bnb_kanpora.test.helpers import BOX
+import json
+import pytest
+import subprocess
+import sys
+
+NB_LISTINGS = 1500
+# square with a square hole, as (lng, lat)
+SQUARE_WITH_HOLE = [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]]]
+
+def test_parse():
+    from_geojson = SearchPolygon.from_geojson({"type": "Feature", "properties": {},
+                                               "geometry": {"type": "Polygon", "coordinates": SQUARE_WITH_HOLE}})
+    from_wkt = SearchPolygon.from_wkt("POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0), (4 4, 6 4, 6 6, 4 6, 4 4))")
+    for polygon in (from_geojson, from_wkt):
+        assert len(polygon.polygons) == 1 and len(polygon.polygons[0]) == 2
+        assert polygon.bounds == GeoBox(n_lat=10, e_lng=10, s_lat=0, w_lng=0)
+
+    multi = SearchPolygon.from_wkt("MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5), (5.5 5.2, 5.8 5.2, 5.8 5.5)))")
+    assert [len(rings) for rings in multi.polygons] == [1, 2]
+    assert SearchPolygon.from_geojson(multi.to_geojson()).polygons[1][1].tolist() == [[5.5, 5.2], [5.8, 5.2], [5.8, 5.5]]
+    with pytest.raises(ValueError):
+        SearchPolygon.from_wkt("POINT (1 1)")
+    with pytest.raises(ValueError):
+        SearchPolygon.from_geojson({"type": "LineString", "coordinates": [[0, 0], [1, 1]]})
+
+def test_contains_points():
+    polygon = SearchPolygon([SQUARE_WITH_HOLE])
+    lats, lngs = [1, 5, 9, 5, 11], [1, 5, 2, 9.5, 5]
+    assert polygon.contains_points(lats, lngs).tolist() == [True, False, True, True, False]
+
+def test_intersects_boxes():
+    polygon = SearchPolygon([SQUARE_WITH_HOLE])
+    boxes = [
+        (2, 2, 1, 1),           # inside
+        (5.5, 5.5, 4.5, 4.5),   # in the hole
+        (12, 12, 11, 11),       # outside
+        (11, 11, 9, 9),         # across the boundary
+        (20, 20, -10, -10),     # around the polygon
+        (5, 8, 4.5, 6.5),       # across the hole
+    ]
+    assert polygon.intersects_boxes(boxes).tolist() == [True, False, False, True, True, True]
+
+def test_filter_results():
+    polygon = SearchPolygon([SQUARE_WITH_HOLE])
+    rooms = [RoomRecord(latitude=1, longitude=1), RoomRecord(latitude=5, longitude=5),
+             RoomRecord(latitude=11, longitude=1), RoomRecord()]
+    results = polygon.filter_results(SearchResults(nb_rooms_expected=400, rooms=rooms))
+    assert results.rooms == rooms[:1]
+    assert results.nb_rooms_expected == 100
+
+def test_models_without_numpy():
+    # the CLI imports the models at startup, numpy only when a polygon is searched
+    code = "import sys, bnb_kanpora.models; print('numpy' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip() == "False"
+
+def triangle(box):
+    """West half of the box, cut along its diagonal"""
+    return SearchPolygon([[[[box.w_lng, box.s_lat], [box.e_lng, box.s_lat], [box.w_lng, box.n_lat]]]])
+
+def test_survey_polygon(airbnb, config, survey_controller):
+    polygon = triangle(GeoBox(**BOX))
+    search_area_controller = SearchAreaController(config)
+    search_area = search_area_controller.add("Gotham City West", polygon=polygon)
+    assert SearchAreaModel.get_by_id(search_area).geobox == GeoBox(**BOX)
+    assert json.loads(SearchAreaModel.get_by_id(search_area).polygon)["type"] == "MultiPolygon"
+
+    controller = survey_controller
+    survey = controller.add(search_area)
+    results = controller.run(survey)
+    rooms = RoomModel.select().where(RoomModel.survey_id == survey)
+    inside = polygon.contains_points([l["listing"]["lat"] for l in airbnb.listings], [l["listing"]["lng"] for l in airbnb.listings])
+    assert rooms.count() == results.total_nb_saved == inside.sum()
+    assert polygon.contains_points([r.latitude for r in rooms], [r.longitude for r in rooms]).all()
+    assert controller.metrics.value("nodes_pruned_total") > 0
+    polygon_requests = airbnb.nb_requests
+
+    airbnb.nb_requests = 0
+    box_survey = controller.add(search_area_controller.add("Gotham City", GeoBox(**BOX)))
+    controller.run(box_survey)
+    assert polygon_requests < airbnb.nb_requests
@@ -0,0 +1,69 @@
+from bnb_kanpora.quadtree import QuadTree, node_label, ROOT, NE, NW, SE, SW, MAX_LEVEL
+from bnb_kanpora.utils import GeoBox, SearchFilters
+from bnb_kanpora.test.helpers import BOX
+from decimal import Decimal
+import pickle
+import pytest
+
+
+def bounds(box):
+    return [box.n_lat, box.e_lng, box.s_lat, box.w_lng]
+
+def test_quadkeys():
+    key = QuadTree.child(QuadTree.child(ROOT, SE), NW)
+    assert QuadTree.level(ROOT) == 0 and QuadTree.level(key) == 2
+    assert QuadTree.parent(key) == QuadTree.child(ROOT, SE)
+    assert QuadTree.parent(ROOT) is None
+    assert QuadTree.children(ROOT) == [4, 5, 6, 7]
+    assert QuadTree.to_string(ROOT) == "0"
+    assert QuadTree.to_string(key) == "0-2-1"
+    assert QuadTree.from_string("0-2-1") == key
+    with pytest.raises(ValueError):
+        QuadTree.from_string("1-2")
+
+    deepest = ROOT
+    for _ in range(MAX_LEVEL):
+        deepest = QuadTree.child(deepest, SW)
+    assert deepest < 2 ** 63
+    assert QuadTree.from_string(QuadTree.to_string(deepest)) == deepest
+    with pytest.raises(ValueError):
+        QuadTree.child(deepest, NE)
+
+def test_boxes():
+    box = GeoBox(**BOX)
+    quadtree = QuadTree(box)
+    assert quadtree.box(ROOT) == box
+    for key, split in zip(QuadTree.children(ROOT), box.get_four_splits()):
+        assert bounds(quadtree.box(key)) == pytest.approx(bounds(split))
+
+    # keys of different levels in a single call
+    grandchild = QuadTree.child(QuadTree.child(ROOT, SW), NE)
+    boxes = quadtree.boxes([ROOT, QuadTree.child(ROOT, NW), grandchild])
+    assert boxes.shape == (3, 4)
+    expected = box.get_four_splits()[SW].get_four_splits()[NE]
+    assert list(boxes[2]) == pytest.approx(bounds(expected))
+
+    child_keys, child_boxes = quadtree.child_boxes([ROOT, grandchild])
+    assert list(child_keys[:4]) == QuadTree.children(ROOT)
+    assert list(child_keys[4:]) == QuadTree.children(grandchild)
+    assert child_boxes.shape == (8, 4)
+    # children tile their parent
+    assert child_boxes[4:, 0].max() == pytest.approx(expected.n_lat)
+    assert child_boxes[4:, 3].min() == pytest.approx(expected.w_lng)
+
+def test_node_label():
+    assert node_label((ROOT, SearchFilters())) == "0"
+    assert node_label((QuadTree.child(ROOT, SE), SearchFilters("Private room", 50, None))) == "0-2/" + \
+        SearchFilters("Private room", 50, None).label
+
+def test_geobox():
+    box = GeoBox(n_lat=Decimal("46.916375"), e_lng=Decimal("1.800148"), s_lat=46.771898, w_lng=1.581617)
+    assert isinstance(box.n_lat, float)
+    assert box == GeoBox(**BOX) and hash(box) == hash(GeoBox(**BOX))
+    with pytest.raises(AttributeError):
+        box.n_lat = 47.0
+    assert pickle.loads(pickle.dumps(box)) == box
+
+    larger = box.enlarge(0.1)
+    assert larger is not box and box == GeoBox(**BOX)
+    assert larger.n_lat > box.n_lat and larger.w_lng < box.w_lng
@@ -0,0 +1,48 @@
+from bnb_kanpora.records import RoomRecord, ROOM_KEY_MAPPINGS, parse_price
+from bnb_kanpora.test.helpers import BOX, make_listings
+import pickle
+import tracemalloc
+
+
+def test_parse_price():
+    assert parse_price("1 234\xa0€") == 1234
+    assert parse_price("45,50 €") == 45.5
+    assert parse_price("€") is None
+
+def test_record_from_search_result():
+    listing = make_listings(1, **BOX)[0]
+    listing["listing"]["reviews_count"] = 0
+    record = RoomRecord.from_search_result(listing)
+    assert record.room_id == listing["listing"]["id"]
+    assert record.host_id == listing["listing"]["user"]["id"]
+    assert record.rate == listing["pricing_quote"]["rate"]["amount"]
+    assert record.currency == "EUR"
+    # empty and missing values are NULL
+    assert record.reviews is None
+    assert record.neighborhood is None
+    assert record.raw is None
+    row = record.to_row(3)
+    assert set(row) == set(ROOM_KEY_MAPPINGS) | {"survey_id"}
+    assert row["survey_id"] == "3"
+
+def test_record_keeps_raw_on_request():
+    listing = make_listings(1, **BOX)[0]
+    assert RoomRecord.from_search_result(listing, keep_raw=True).raw is listing
+
+def test_record_is_compact():
+    listings = make_listings(1, **BOX)
+    record = RoomRecord.from_search_result(listings[0])
+    assert not hasattr(record, "__dict__")
+    assert pickle.loads(pickle.dumps(record)) == record
+
+    listings = make_listings(2000, **BOX)
+    tracemalloc.start()
+    records = [RoomRecord.from_search_result(listing) for listing in listings]
+    records_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracemalloc.start()
+    raw = [pickle.loads(pickle.dumps(listing)) for listing in listings]
+    raw_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert records_size * 5 < raw_size
+    assert len(records) == len(raw) == 2000
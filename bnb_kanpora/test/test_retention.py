@@ -0,0 +1,70 @@
+from bnb_kanpora.controllers import RetentionController, SearchAreaController, SearchSurveyController
+from bnb_kanpora.models import (ListingModel, MetricModel, ObservationModel, RoomModel, SurveyModel,
+                                SurveyRollupModel)
+from bnb_kanpora.retention import expired_surveys
+from bnb_kanpora.utils import GeoBox
+from bnb_kanpora.test.helpers import BOX
+from datetime import datetime, timedelta
+import pytest
+
+NB_LISTINGS = 120
+
+@pytest.fixture
+def config_extra(tmp_path) -> str:
+    return f"[ARCHIVE]\nfolder = {tmp_path / 'archive'}\n"
+
+def test_expired_surveys(config):
+    now = datetime(2022, 6, 1)
+    areas = [SearchAreaController(config).add(name, GeoBox(**BOX)) for name in ("Gotham City", "Metropolis")]
+    surveys = {}
+    for area in areas:
+        for days in (1, 10, 40, 100):
+            survey = SurveyModel.create(search_area_id=area, survey_date=now - timedelta(days=days))
+            surveys[(area, days)] = survey.survey_id
+    old = lambda *days: sorted(surveys[(area, d)] for area in areas for d in days)
+
+    assert expired_surveys(now=now) == []
+    assert expired_surveys(max_age=30, now=now) == old(40, 100)
+    assert expired_surveys(keep_last=1, now=now) == old(10, 40, 100)
+    # the latest survey of an area is kept, however old
+    assert expired_surveys(max_age=5, keep_last=1, now=now) == old(10, 40, 100)
+    assert expired_surveys(max_age=5, keep_last=3, now=now) == old(100)
+    assert expired_surveys(max_age=30, search_area_id=areas[1], now=now) == sorted(surveys[(areas[1], d)] for d in (40, 100))
+
+def test_purge(airbnb, config, tmp_path):
+    controller = SearchSurveyController(config)
+    search_area = SearchAreaController(config).add("Gotham City", GeoBox(**BOX))
+    surveys = [controller.add(search_area) for _ in range(3)]
+    for survey in surveys:
+        controller.run(survey)
+    controller.normalize(surveys[0])
+    controller.normalize(surveys[1])
+    assert (tmp_path / "archive" / f"survey-{surveys[0]}").is_dir()
+
+    retention = RetentionController(config)
+    assert retention.expired(keep_last=2) == surveys[:1]
+    result = retention.purge(surveys[:1])
+    assert result["nb_rooms"] == NB_LISTINGS
+    # the listings are still observed by the second survey
+    assert result["nb_listings"] == 0 and ListingModel.select().count() == NB_LISTINGS
+    assert not (tmp_path / "archive" / f"survey-{surveys[0]}").exists()
+    assert SurveyModel.get_or_none(SurveyModel.survey_id == surveys[0]) is None
+    assert MetricModel.select().where(MetricModel.survey_id == surveys[0]).count() == 0
+    rollups = list(SurveyRollupModel.select().where(SurveyRollupModel.survey_id == surveys[0]))
+    assert sum(rollup.nb_rooms for rollup in rollups) == NB_LISTINGS
+    assert all(rollup.search_area_id == search_area and rollup.avg_rate > 0 for rollup in rollups)
+
+    config.RETENTION_BATCH_SIZE = 25
+    result = retention.purge(surveys[1:], rollup=False)
+    assert result["nb_rooms"] == 2 * NB_LISTINGS and result["nb_listings"] == NB_LISTINGS
+    assert RoomModel.select().count() == ObservationModel.select().count() == ListingModel.select().count() == 0
+    assert SurveyRollupModel.select().count() == len(rollups)
+    assert result["nb_bytes_reclaimed"] > 0
+    assert config.database.pragma("freelist_count") == 0
+
+def test_delete(airbnb, config):
+    controller = SearchSurveyController(config)
+    survey = controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    controller.run(survey)
+    assert controller.delete(survey)
+    assert RoomModel.select().count() == 0 and SurveyModel.select().count() == 0
@@ -0,0 +1,117 @@
+from bnb_kanpora.http_requests import HTTPRequest
+from bnb_kanpora.retry import Backoff, CircuitBreaker, SUCCESS, RETRY, RENEW_SESSION, FATAL, classify_response, classify_exception, get_retry_after
+from bnb_kanpora.utils import GeoBox
+from bnb_kanpora.test.helpers import BOX, FakeResponse
+from email.utils import formatdate
+import pytest
+import requests
+import time
+
+NB_LISTINGS = 20
+
+@pytest.fixture
+def config(config):
+    # a constant rate and short backoffs against the fake API
+    config.MIN_REQUEST_RATE = config.MAX_REQUEST_RATE
+    config.RETRY_BACKOFF_BASE = 0.001
+    config.MAX_CONNECTION_ATTEMPTS = 4
+    return config
+
+def test_classify():
+    assert classify_response(FakeResponse(200, b"{}")) == SUCCESS
+    assert classify_response(FakeResponse(200, b"")) == RENEW_SESSION
+    assert classify_response(FakeResponse(429)) == RENEW_SESSION
+    assert classify_response(FakeResponse(503)) == RETRY
+    assert classify_response(FakeResponse(404)) == FATAL
+    assert classify_exception(requests.exceptions.ProxyError()) == RENEW_SESSION
+    assert classify_exception(requests.exceptions.ReadTimeout()) == RETRY
+    assert classify_exception(requests.exceptions.InvalidURL()) == FATAL
+
+def test_retry_after():
+    assert get_retry_after(FakeResponse(429, headers={"Retry-After": "7"})) == 7
+    assert 25 < get_retry_after(FakeResponse(429, headers={"Retry-After": formatdate(time.time() + 30, usegmt=True)})) <= 30
+    assert get_retry_after(FakeResponse(429)) is None
+    assert get_retry_after(None) is None
+
+def test_backoff_bounds():
+    backoff = Backoff(base=1, max_delay=10)
+    for attempt in range(8):
+        assert 0 <= backoff.delay(attempt) <= min(10, 2 ** attempt)
+    assert backoff.delay(0, retry_after=5) >= 5
+    assert backoff.delay(0, retry_after=3600) == 10
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    time.sleep(0.06)
+    # a single trial request when half-open
+    assert breaker.allow() and not breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.06)
+    # a trial telling nothing lets another one through
+    assert breaker.allow() and not breaker.allow()
+    breaker.release_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN and breaker.allow()
+
+def test_search_rooms_retries(config, airbnb):
+    airbnb.failures = [FakeResponse(429, headers={"Retry-After": "0"}), FakeResponse(500), FakeResponse(200, b"")]
+    request = HTTPRequest(config)
+    results = request.get_rooms_from_box(GeoBox(**BOX), 0, 0)
+    assert len(results.rooms) == 18
+    assert airbnb.nb_requests == 4
+    assert request.metrics.value("http_retries_total") == 3
+    assert request.metrics.value("http_retries_total", reason=429) == 1
+
+def test_search_rooms_fatal(config, airbnb):
+    airbnb.failures = [FakeResponse(404)]
+    request = HTTPRequest(config)
+    assert request.search_rooms(config.URL_API_SEARCH_ROOT, {}) is None
+    assert airbnb.nb_requests == 1
+    assert request.metrics.value("http_giveups_total", reason="fatal") == 1
+    # a 404 is not a sign of congestion
+    assert request.throttle.rate == config.INITIAL_REQUEST_RATE
+    assert request.metrics.value("throttle_decreases_total") == 0
+
+def test_search_rooms_gives_up(config, airbnb):
+    config.CIRCUIT_BREAKER_THRESHOLD = 100
+    airbnb.failures = [FakeResponse(503)] * 10
+    request = HTTPRequest(config)
+    assert request.search_rooms(config.URL_API_SEARCH_ROOT, {}) is None
+    assert airbnb.nb_requests == config.MAX_CONNECTION_ATTEMPTS
+    assert request.metrics.value("http_giveups_total", reason="attempts") == 1
+
+def test_search_rooms_opens_circuit(config, airbnb):
+    config.CIRCUIT_BREAKER_THRESHOLD = 2
+    config.CIRCUIT_BREAKER_RESET = 0.01
+    airbnb.failures = [FakeResponse(503)] * 2
+    request = HTTPRequest(config)
+    params = request.get_params(GeoBox(**BOX))
+    assert request.search_rooms(config.URL_API_SEARCH_ROOT, params) is not None
+    assert request.metrics.value("circuit_opened_total") == 1
+    assert airbnb.nb_requests == 3
+
+def test_search_rooms_half_open_fatal(config, airbnb):
+    config.CIRCUIT_BREAKER_THRESHOLD = 2
+    config.CIRCUIT_BREAKER_RESET = 0.05
+    config.MAX_CONNECTION_ATTEMPTS = 2
+    airbnb.failures = [FakeResponse(503)] * 2
+    request = HTTPRequest(config)
+    assert request.search_rooms(config.URL_API_SEARCH_ROOT, {}) is None
+    assert request.metrics.value("circuit_opened_total") == 1
+    time.sleep(0.06)
+    # the trial request of the half-open circuit gets a 404
+    airbnb.failures = [FakeResponse(404)]
+    assert request.search_rooms(config.URL_API_SEARCH_ROOT, {}) is None
+    assert airbnb.nb_requests == 3
+    params = request.get_params(GeoBox(**BOX))
+    assert request.search_rooms(config.URL_API_SEARCH_ROOT, params) is not None
+    assert airbnb.nb_requests == 4
@@ -0,0 +1,49 @@
+from bnb_kanpora.controllers import ABListingExtraController
+from bnb_kanpora.models import RoomModel, RoomPageModel
+from bnb_kanpora.test.helpers import run_survey
+from datetime import datetime, timedelta
+import lxml.html
+
+NB_LISTINGS = 60
+
+def fill(config, survey, max_age=None) -> tuple:
+    controller = ABListingExtraController(config)
+    try:
+        return controller.fill_loop_by_room(survey, max_age=max_age)
+    finally:
+        controller.close()
+
+def test_fill_from_room_pages(airbnb, config):
+    survey = run_survey(config)
+    assert fill(config, survey) == (0, NB_LISTINGS)
+    assert airbnb.nb_room_requests == NB_LISTINGS
+    assert RoomPageModel.select().count() == NB_LISTINGS
+    rooms = RoomModel.select().where(RoomModel.survey_id == survey)
+    assert all(room.bathrooms == 1.5 and room.neighborhood == "Centre" for room in rooms)
+    page = RoomPageModel.get_by_id(rooms[0].room_id)
+    assert page.host_id == rooms[0].host_id and page.bedrooms == rooms[0].bedrooms
+
+def test_fresh_pages_are_copied(airbnb, config):
+    fill(config, run_survey(config))
+    airbnb.nb_room_requests = 0
+
+    survey = run_survey(config)
+    assert fill(config, survey) == (NB_LISTINGS, 0)
+    assert airbnb.nb_room_requests == 0
+    rooms = RoomModel.select().where(RoomModel.survey_id == survey)
+    assert all(room.bathrooms == 1.5 and room.neighborhood == "Centre" for room in rooms)
+
+    # stale pages only are fetched again
+    stale = [room.room_id for room in rooms[:10]]
+    RoomPageModel.update(fetched_at=datetime.now() - timedelta(days=60)).where(RoomPageModel.room_id.in_(stale)).execute()
+    survey = run_survey(config)
+    assert fill(config, survey) == (NB_LISTINGS - 10, 10)
+    assert airbnb.nb_room_requests == 10
+    assert fill(config, survey, max_age=0) == (0, NB_LISTINGS)
+
+def test_room_page_without_fields(config):
+    controller = ABListingExtraController(config)
+    tree = lxml.html.fromstring("<html><body><div id='room'></div></body></html>")
+    for name in ("bedrooms", "bathrooms", "minstay", "price"):
+        assert getattr(controller, f"_ABListingExtraController__get_{name}")(tree) is None
+    assert set(controller._ABListingExtraController__get_room_info_from_tree(tree).values()) == {None}
@@ -0,0 +1,78 @@
+from bnb_kanpora.metrics import MetricsRegistry
+from bnb_kanpora.sessions import SessionPool
+from bnb_kanpora.test.helpers import FakeAirbnb, FakeResponse, FakeSession
+import time
+
+PROXIES = ["proxy1:8080", "proxy2:8080", "user:secret@proxy3:8080"]
+
+def make_pool(airbnb, size=3, **kwargs):
+    factory = lambda proxy, user_agent: FakeSession(airbnb, proxy, user_agent)
+    return SessionPool(size, factory, proxies=PROXIES, user_agents=["ua1", "ua2"], warmup_url="https://www.airbnb.com/", **kwargs)
+
+def wait_idle(pool, nb_sessions):
+    deadline = time.monotonic() + 5
+    while len(pool._idle) < nb_sessions and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_pool_pins_sessions_to_proxies():
+    airbnb = FakeAirbnb([])
+    pool = make_pool(airbnb)
+    pool.start()
+    wait_idle(pool, 3)
+    assert airbnb.nb_warmups == 3
+    assert sorted(pooled.proxy for pooled in pool._idle) == sorted(PROXIES)
+    for pooled in pool._idle:
+        assert pooled.session.proxies["https"] == f"http://{pooled.proxy}"
+        assert pooled.session.headers["User-Agent"] == pooled.user_agent
+    pool.close()
+
+def test_pool_reuses_sessions():
+    airbnb = FakeAirbnb([])
+    pool = make_pool(airbnb, size=1)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert first.nb_requests == 2
+    assert airbnb.nb_warmups == 1
+    pool.close()
+
+def test_pool_replaces_retired_sessions():
+    metrics = MetricsRegistry()
+    airbnb = FakeAirbnb([])
+    pool = make_pool(airbnb, size=2, metrics=metrics)
+    pooled = pool.acquire()
+    pool.release(pooled, healthy=False)
+    assert pooled.session.closed
+    wait_idle(pool, 2)
+    assert pooled not in pool._idle
+    assert pool._nb_sessions == 2
+    assert airbnb.nb_warmups == 3
+    assert metrics.value("sessions_retired_total") == 1
+    pool.close()
+
+def test_pool_skips_unusable_proxies():
+    airbnb = FakeAirbnb([])
+    pool = make_pool(airbnb, size=3, is_usable=lambda proxy: proxy != "proxy2:8080")
+    pool.start()
+    wait_idle(pool, 3)
+    assert "proxy2:8080" not in {pooled.proxy for pooled in pool._idle}
+    # sessions rejected by accept are not leased
+    assert pool.acquire(accept=lambda pooled: False) is None
+    pooled = pool.acquire(accept=lambda pooled: pooled.proxy == "proxy1:8080")
+    assert pooled.proxy == "proxy1:8080"
+    pool.close()
+
+def test_pool_retries_refused_warmup(monkeypatch):
+    airbnb = FakeAirbnb([])
+    refused = []
+    def head(self, url, timeout=None, **kwargs):
+        if not refused:
+            refused.append(self)
+            return FakeResponse(403)
+        return FakeResponse(200)
+    monkeypatch.setattr(FakeSession, "head", head)
+    pool = make_pool(airbnb, size=1)
+    pooled = pool.acquire()
+    assert pooled.session is not refused[0]
+    assert refused[0].closed
+    pool.close()
@@ -0,0 +1,91 @@
+from bnb_kanpora.controllers import SearchAreaController, SearchSurveyController
+from bnb_kanpora.models import RoomModel
+from bnb_kanpora.records import RoomRecord
+from bnb_kanpora.quadtree import QuadTree, ROOT
+from bnb_kanpora.slicing import SlicingStrategy, price_bands, ROOM_TYPES, ROOM_TYPE_SLICE, PRICE_SLICE, GEO_SPLIT
+from bnb_kanpora.utils import GeoBox, RoomTypes, SearchFilters, SearchResults
+from bnb_kanpora.test.helpers import BOX
+import pytest
+
+NB_LISTINGS = 1500
+
+def test_price_bands():
+    rates = list(range(10, 110))
+    assert price_bands(rates, 4) == [(None, 34), (35, 59), (60, 84), (85, None)]
+    assert price_bands(rates, 2, 50, 80) == [(50, 64), (65, 80)]
+    # bands cover the interval even when the rates are clustered
+    assert price_bands([20] * 50 + [90] * 50, 4) == [(None, 19), (20, 89), (90, None)]
+    # nothing to split
+    assert price_bands([40] * 10, 3, 40, 40) == [(40, 40)]
+    assert price_bands([], 3) == [(None, None)]
+
+def bounds(box):
+    return [box.n_lat, box.e_lng, box.s_lat, box.w_lng]
+
+def saturated_results(rates):
+    return SearchResults(nb_rooms_expected=1001, rooms=[RoomRecord(rate=rate) for rate in rates])
+
+def test_slicing_order():
+    box = GeoBox(**BOX)
+    quadtree = QuadTree(box)
+    results = saturated_results(range(90))
+    strategy = SlicingStrategy(90, loop_over_room_types=True, loop_over_prices=True)
+    assert strategy.is_saturated(results)
+
+    kind, children = strategy.slice((ROOT, SearchFilters()), box, results, quadtree)
+    assert kind == ROOM_TYPE_SLICE
+    assert [key for (key, _), _ in children] == [ROOT] * len(ROOM_TYPES)
+    assert [filters.room_type for (_, filters), _ in children] == ROOM_TYPES
+
+    node, _ = children[0]
+    kind, children = strategy.slice(node, box, results, quadtree)
+    assert kind == PRICE_SLICE
+    assert len(children) == 16
+    assert all(filters.room_type == node[1].room_type for (_, filters), _ in children)
+
+    # a band with a single price can only be split
+    band = SearchFilters(node[1].room_type, 42, 42)
+    kind, children = strategy.slice((ROOT, band), box, saturated_results([42] * 90), quadtree)
+    assert kind == GEO_SPLIT
+    assert [key for (key, _), _ in children] == QuadTree.children(ROOT)
+    assert all(filters == band for (_, filters), _ in children)
+    for (_, child_box), split in zip(children, box.get_four_splits()):
+        assert bounds(child_box) == pytest.approx(bounds(split))
+
+def test_room_type_slices_cover_parent():
+    box = GeoBox(**BOX)
+    room_types = [RoomTypes.ENTIRE_APT, RoomTypes.PRIVATE_ROOM, RoomTypes.SHARED_ROOM, RoomTypes.HOTEL_ROOM]
+    rooms = [RoomRecord(room_type=room_type, rate=rate) for room_type in room_types for rate in range(40, 100, 5)]
+    parent = SearchFilters(price_min=50, price_max=80)
+    strategy = SlicingStrategy(10, loop_over_room_types=True)
+    kind, children = strategy.slice((ROOT, parent), box, SearchResults(rooms=rooms), QuadTree(box))
+    assert kind == ROOM_TYPE_SLICE
+    # every room of the parent search is in exactly one slice
+    for room in rooms:
+        assert sum(filters.matches(room) for (_, filters), _ in children) == int(parent.matches(room))
+
+@pytest.fixture
+def listings(listings):
+    for room in listings[::50]:
+        room["listing"]["room_type"] = RoomTypes.HOTEL_ROOM
+    return listings
+
+def run_sliced_survey(config, room_types, prices):
+    config.SEARCH_DO_LOOP_OVER_ROOM_TYPES = room_types
+    config.SEARCH_DO_LOOP_OVER_PRICES = prices
+    controller = SearchSurveyController(config)
+    survey = controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    results = controller.run(survey)
+    assert RoomModel.select().where(RoomModel.survey_id == survey).count() == NB_LISTINGS
+    return results
+
+def test_survey_slicing(airbnb, config):
+    results = run_sliced_survey(config, True, True)
+    assert results.total_nb_saved == NB_LISTINGS
+    assert any(filters.price_min is not None for _, filters in results.search_results)
+    assert any(filters.room_type is not None for _, filters in results.search_results)
+    sliced_requests = airbnb.nb_requests
+
+    airbnb.nb_requests = 0
+    run_sliced_survey(config, False, False)
+    assert sliced_requests < airbnb.nb_requests
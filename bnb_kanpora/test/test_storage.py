@@ -0,0 +1,49 @@
+from bnb_kanpora.controllers import HostController, SearchAreaController, SearchSurveyController
+from bnb_kanpora.models import ListingModel, ObservationModel, RoomModel, SurveyRoomModel
+from bnb_kanpora.storage import listing_hash
+from bnb_kanpora.utils import GeoBox
+from bnb_kanpora.test.helpers import BOX
+import csv
+
+NB_LISTINGS = 60
+
+def rooms(survey_id:int, model=RoomModel) -> list:
+    return list(model.select().where(model.survey_id == survey_id).order_by(model.room_id).dicts())
+
+def test_listing_hash():
+    row = dict(room_id=1, name="Studio", rate=50.0, reviews=3)
+    assert listing_hash(row) == listing_hash(dict(row, rate=60.0, reviews=4))
+    assert listing_hash(row) != listing_hash(dict(row, name="Studio!"))
+
+def test_normalize(airbnb, config, tmp_path):
+    controller = SearchSurveyController(config)
+    search_area = SearchAreaController(config).add("Gotham City", GeoBox(**BOX))
+    surveys = [controller.add(search_area) for _ in range(3)]
+    for survey in surveys[:2]:
+        controller.run(survey)
+    # a listing renamed, and new reviews
+    airbnb.listings[0]["listing"]["name"] = "Renamed"
+    for listing in airbnb.listings:
+        listing["listing"]["reviews_count"] += 1
+    controller.run(surveys[2])
+    before = [rooms(survey) for survey in surveys]
+
+    assert controller.normalize(surveys[0]) == (NB_LISTINGS, NB_LISTINGS)
+    # the static attributes of the second survey are already stored
+    assert controller.normalize(surveys[1]) == (NB_LISTINGS, 0)
+    assert controller.normalize(surveys[2]) == (NB_LISTINGS, 1)
+    assert RoomModel.select().count() == 0
+    assert ListingModel.select().count() == NB_LISTINGS + 1
+    assert ObservationModel.select().count() == 3 * NB_LISTINGS
+    assert [rooms(survey, SurveyRoomModel) for survey in surveys] == before
+    assert [room["reviews"] for room in before[0]] != [room["reviews"] for room in before[2]]
+
+    # rooms of normalized surveys and of surveys in the room table are read the same way
+    survey = controller.add(search_area)
+    controller.run(survey)
+    path = controller.export([str(surveys[2]), str(survey)], folder=str(tmp_path / "export"))
+    with open(path) as f:
+        assert len(list(csv.DictReader(f))) == 2 * NB_LISTINGS
+    host_controller = HostController(config)
+    assert host_controller.fill_hosts(surveys[0])[0] == len(set(room["host_id"] for room in before[0]))
+    host_controller.close()
@@ -0,0 +1,64 @@
+from bnb_kanpora.controllers import SearchAreaController
+from bnb_kanpora.models import RoomModel, MetricModel, SurveyProgressModel
+from bnb_kanpora.quadtree import QuadTree, ROOT
+from bnb_kanpora.utils import GeoBox, SearchFilters
+from bnb_kanpora.test.helpers import BOX, FakeResponse
+import pytest
+
+# Offline surveys, against a fake explore_tabs API
+NB_LISTINGS = 600
+
+@pytest.fixture
+def config_extra(tmp_path) -> str:
+    prometheus_file = tmp_path / "bnb_kanpora_{survey_id}.prom"
+    return f"[METRICS]\nstore_in_db = 1\nprometheus_file = {prometheus_file}\n"
+
+@pytest.fixture
+def survey(config, survey_controller) -> int:
+    search_area_id = SearchAreaController(config).add("Gotham City", GeoBox(**BOX))
+    return survey_controller.add(search_area_id)
+
+def test_run_survey(config, airbnb, survey_controller, survey):
+    results = survey_controller.run(survey)
+    assert results.total_nb_saved == NB_LISTINGS
+    assert RoomModel.select().where(RoomModel.survey_id == survey).count() == NB_LISTINGS
+    stats = results.get_stats()
+    assert stats["nb_requests"] == airbnb.nb_requests
+    assert stats["nb_expected"] == NB_LISTINGS
+
+def test_run_survey_metrics(config, tmp_path, airbnb, survey_controller, survey):
+    survey_controller.run(survey)
+    metrics = survey_controller.get_metrics(survey)
+    requests = sum(m.count for m in metrics if m.name == "http_request_seconds")
+    assert requests == airbnb.nb_requests
+    assert {m.node for m in metrics if m.name == "node_search_seconds"} >= {"0", "0-0"}
+    assert MetricModel.get((MetricModel.survey_id == survey) & (MetricModel.name == "db_rows_written_total")).sum == NB_LISTINGS
+    prometheus = (tmp_path / f"bnb_kanpora_{survey}.prom").read_text()
+    assert f'bnb_kanpora_http_request_seconds_count {airbnb.nb_requests}' in prometheus
+    assert 'bnb_kanpora_http_responses_total{status="200"}' in prometheus
+
+def test_run_survey_failed_node(config, airbnb, survey_controller, survey, monkeypatch):
+    failed_node = (QuadTree.children(ROOT)[0], SearchFilters())
+    search_box = survey_controller._search_box
+    def _search_box(box, node, budget=None):
+        if node == failed_node:
+            raise ConnectionError("proxy down")
+        return search_box(box, node, budget)
+    monkeypatch.setattr(survey_controller, "_search_box", _search_box)
+
+    # the other nodes are searched, the area of the failed one is missing
+    results = survey_controller.run(survey)
+    assert results.failed == [failed_node] and failed_node not in results.leaves
+    assert survey_controller.metrics.value("nodes_failed_total") == 1
+    assert 0 < results.total_nb_saved < NB_LISTINGS
+    assert results.coverage < 1
+    assert results.get_stats()["nb_nodes_failed"] == 1
+    assert [node for node, _ in survey_controller.get_leaves(survey)] == results.leaves
+    assert SurveyProgressModel.get(SurveyProgressModel.failed == True).quadtree_node == failed_node[0]
+
+def test_run_survey_request_gives_up(config, airbnb, survey_controller, survey):
+    airbnb.failures = [FakeResponse(404)]
+    results = survey_controller.run(survey)
+    assert results.failed == [(ROOT, SearchFilters())] and results.leaves == []
+    assert results.coverage is None
+    assert survey_controller.get_leaves(survey) == []
@@ -0,0 +1,84 @@
+from bnb_kanpora.controllers import SearchAreaController
+from bnb_kanpora.models import AvailabilityModel, SurveyProgressModel, SurveyModel
+from bnb_kanpora.quadtree import ROOT
+from bnb_kanpora.utils import GeoBox, SearchFilters, stay_dates
+from bnb_kanpora.test.helpers import BOX, FakeResponse
+from datetime import date
+import pytest
+
+NB_LISTINGS = 200
+
+def test_stay_dates():
+    assert stay_dates(date(2022, 7, 30), nb_dates=3, nights=2) == [
+        (date(2022, 7, 30), date(2022, 8, 1)), (date(2022, 7, 31), date(2022, 8, 2)), (date(2022, 8, 1), date(2022, 8, 3))]
+    with pytest.raises(ValueError):
+        stay_dates(date(2022, 7, 30), nb_dates=0)
+
+def test_stay_params(survey_controller):
+    request = survey_controller.request
+    params = request.get_params(checkin=date(2022, 7, 14), checkout=date(2022, 7, 16), guests=2)
+    assert (params["checkin"], params["checkout"], params["adults"], params["guests"]) == ("2022-07-14", "2022-07-16", "2", "2")
+    params = request.get_params()
+    assert "checkin" not in params and params["adults"] == "0"
+    filters = SearchFilters(checkin=date(2022, 7, 14), checkout=date(2022, 7, 16), guests=2)
+    assert filters.label == "-@2022-07-14:2022-07-16x2"
+
+def test_sweep(airbnb, survey_controller):
+    config = survey_controller.config
+    # 36 listings per search at most, so that the area is split
+    config.SEARCH_MAX_PAGES = 2
+    survey = survey_controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    results = survey_controller.run(survey)
+
+    leaves = survey_controller.get_leaves(survey)
+    assert len(leaves) == len(results.leaves) == SurveyProgressModel.select().count() > 1
+    assert (ROOT, SearchFilters()) not in [node for node, _ in leaves]
+    assert sum((box.n_lat - box.s_lat) * (box.e_lng - box.w_lng) for _, box in leaves) == \
+        pytest.approx((BOX["n_lat"] - BOX["s_lat"]) * (BOX["e_lng"] - BOX["w_lng"]))
+
+    nb_requests = airbnb.nb_requests
+    stays = stay_dates(date(2022, 7, 14), nb_dates=3)
+    sweeps = survey_controller.sweep(survey, stays, guests=[1, 6])
+    # one search of at most two pages per leaf, stay and number of guests: no node is split again
+    assert len(leaves) * 6 <= airbnb.nb_requests - nb_requests <= len(leaves) * 6 * 2
+
+    room_ids = set(room["listing"]["id"] for room in airbnb.listings)
+    assert len(sweeps) == 6
+    for sweep in sweeps:
+        expected = set(room["listing"]["id"] for room in airbnb.listings
+                       if airbnb.is_available(room["listing"]["id"], sweep["checkin"].isoformat())
+                       and room["listing"]["person_capacity"] >= sweep["guests"])
+        saved = set(room_id for (room_id,) in AvailabilityModel
+                    .select(AvailabilityModel.room_id)
+                    .where((AvailabilityModel.checkin == sweep["checkin"]) & (AvailabilityModel.guests == sweep["guests"]))
+                    .tuples())
+        assert saved == expected
+        assert sweep["nb_available"] == len(expected) and sweep["nb_rooms"] == len(room_ids)
+        assert sweep["occupancy"] == round(len(room_ids - expected) / len(room_ids), 4)
+
+    # sweeping a stay again replaces its rooms
+    survey_controller.sweep(survey, stays[:1], guests=[1])
+    assert AvailabilityModel.select().where(AvailabilityModel.checkin == stays[0][0]).count() == \
+        sweeps[0]["nb_available"] + sweeps[1]["nb_available"]
+
+    survey_controller.delete(survey)
+    assert AvailabilityModel.select().count() == SurveyProgressModel.select().count() == 0
+
+def test_sweep_without_leaves(airbnb, survey_controller):
+    survey = survey_controller.add(SearchAreaController(survey_controller.config).add("Gotham City", GeoBox(**BOX)))
+    with pytest.raises(ValueError):
+        survey_controller.sweep(survey, stay_dates(date(2022, 7, 14)))
+
+def test_sweep_failed_leaf(airbnb, survey_controller):
+    config = survey_controller.config
+    config.SEARCH_MAX_PAGES = 2
+    survey = survey_controller.add(SearchAreaController(config).add("Gotham City", GeoBox(**BOX)))
+    survey_controller.run(survey)
+    nb_leaves = len(survey_controller.get_leaves(survey))
+
+    airbnb.failures = [FakeResponse(404)]
+    sweep, = survey_controller.sweep(survey, stay_dates(date(2022, 7, 14)), guests=[1])
+    assert sweep["nb_leaves_failed"] == 1
+    assert survey_controller.metrics.value("sweep_nodes_failed_total") == 1
+    assert survey_controller.metrics.value("node_pages_total") >= nb_leaves
+    assert sweep["nb_available"] == AvailabilityModel.select().count()
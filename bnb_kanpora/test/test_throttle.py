@@ -0,0 +1,58 @@
+from bnb_kanpora.throttle import AdaptiveRateController
+from bnb_kanpora.metrics import MetricsRegistry
+import threading
+import time
+
+def test_additive_increase():
+    throttle = AdaptiveRateController(initial_rate=1000, max_rate=1001, initial_concurrency=1, max_concurrency=3, rate_increase=0.5)
+    for _ in range(10):
+        throttle.acquire()
+        throttle.release(True)
+    assert throttle.rate == 1001
+    assert throttle.concurrency_limit == 3
+
+def test_multiplicative_decrease_once_per_burst():
+    metrics = MetricsRegistry()
+    throttle = AdaptiveRateController(initial_rate=1000, min_rate=100, max_rate=1000, initial_concurrency=8, max_concurrency=8, metrics=metrics)
+    throttle.acquire()
+    throttle.release(False)
+    assert throttle.rate == 500
+    assert throttle.concurrency_limit == 4
+    # failures of requests already in flight count once
+    throttle._last_decrease = time.monotonic() + 1
+    throttle.acquire()
+    throttle.release(False)
+    assert throttle.rate == 500
+    assert metrics.value("throttle_decreases_total") == 1
+    assert metrics.value("concurrency_limit") == 4
+
+def test_neutral_release():
+    throttle = AdaptiveRateController(initial_rate=1000, min_rate=100, max_rate=1000, initial_concurrency=4, max_concurrency=8)
+    throttle.acquire()
+    throttle.release(None)
+    assert throttle.rate == 1000
+    assert throttle.concurrency_limit == 4
+    assert throttle._in_flight == 0
+
+def test_concurrency_limit():
+    throttle = AdaptiveRateController(initial_rate=1000, max_rate=1000, initial_concurrency=2, max_concurrency=2, rate_increase=0)
+    in_flight, max_in_flight = 0, 0
+    lock = threading.Lock()
+
+    def request():
+        nonlocal in_flight, max_in_flight
+        throttle.acquire()
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight -= 1
+        throttle.release(True)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_in_flight == 2
@@ -0,0 +1,146 @@
+from bnb_kanpora.tiles import TilePyramid, encode_tile, mercator, morton_codes
+from bnb_kanpora.test.helpers import run_survey
+import gzip
+import sqlite3
+import struct
+import numpy as np
+import pytest
+
+NB_LISTINGS = 60
+
+def read_varint(data:bytes, i:int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[i]
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        i += 1
+        if byte < 0x80:
+            return value, i
+
+def read_message(data:bytes) -> list:
+    """(field number, value) of a protocol buffer message, length delimited values as bytes"""
+    fields, i = [], 0
+    while i < len(data):
+        key, i = read_varint(data, i)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, i = read_varint(data, i)
+        elif wire_type == 1:
+            value, i = struct.unpack("<d", data[i:i + 8])[0], i + 8
+        else:
+            length, i = read_varint(data, i)
+            value, i = data[i:i + length], i + length
+        fields.append((number, value))
+    return fields
+
+def read_packed(data:bytes) -> list:
+    values, i = [], 0
+    while i < len(data):
+        value, i = read_varint(data, i)
+        values.append(value)
+    return values
+
+def decode_tile(tile:bytes) -> list:
+    """(id, x, y, properties) of the features of a single layer tile"""
+    [(number, layer)] = read_message(tile)
+    assert number == 3
+    layer = read_message(layer)
+    assert (15, 2) in layer and (5, 4096) in layer and (1, b"rooms") in layer
+    keys = [value.decode() for number, value in layer if number == 3]
+    values = []
+    for number, value in layer:
+        if number == 4:
+            [(kind, value)] = read_message(value)
+            values.append({1: lambda v: v.decode(), 3: float, 5: int, 7: bool}[kind](value))
+    features = []
+    for number, feature in layer:
+        if number == 2:
+            feature = dict(read_message(feature))
+            tags = read_packed(feature[2])
+            command, x, y = read_packed(feature[4])
+            assert feature[3] == 1 and command == 9
+            unzigzag = lambda v: (v >> 1) ^ -(v & 1)
+            features.append((feature[1], unzigzag(x), unzigzag(y),
+                             {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}))
+    return features
+
+def random_rooms(nb_rooms:int, seed:int=0) -> tuple:
+    rnd = np.random.default_rng(seed)
+    rates = rnd.lognormal(4.2, 0.6, nb_rooms)
+    rates[rnd.random(nb_rooms) < 0.1] = np.nan
+    lats = rnd.normal(46.84, 0.03, nb_rooms)
+    lats[0] = np.nan
+    return (np.arange(nb_rooms, dtype=np.int64) + 10 ** 17, lats, rnd.normal(1.69, 0.04, nb_rooms),
+            rates, rnd.integers(0, 100, nb_rooms).astype(np.float64),
+            rnd.choice(np.array(["Entire home/apt", "Private room"]), nb_rooms))
+
+def test_morton_codes():
+    ix, iy = np.array([0, 1, 0, 1, 5], dtype=np.uint64), np.array([0, 0, 1, 1, 3], dtype=np.uint64)
+    assert morton_codes(ix, iy).tolist() == [0, 1, 2, 3, 0b11011]
+    # the parent of a tile has the code of the tile shifted by two bits
+    assert (morton_codes(ix >> np.uint64(1), iy >> np.uint64(1)) == morton_codes(ix, iy) >> np.uint64(2)).all()
+    x, y = mercator([0, 85.0511287798], [-180, 180])
+    assert x.tolist() == pytest.approx([0, 1]) and y.tolist() == pytest.approx([0.5, 0])
+
+def test_encode_tile():
+    features = [(12, 5, 4095, {"room_id": "123", "rate": 80.5, "reviews": 3, "cluster": True, "none": None}),
+                (2 ** 60, 0, 0, {"room_id": "124", "rate": 80.5})]
+    assert decode_tile(encode_tile(features)) == [
+        (12, 5, 4095, {"room_id": "123", "rate": 80.5, "reviews": 3, "cluster": True}),
+        (2 ** 60, 0, 0, {"room_id": "124", "rate": 80.5})]
+
+def test_tile_pyramid(tmp_path):
+    rooms = random_rooms(5000)
+    chunks = [tuple(a[i:i + 2000] for a in rooms) for i in range(0, 5000, 2000)]
+    pyramid = TilePyramid.from_chunks(chunks, min_zoom=4, max_zoom=13, full_zoom=12)
+    assert pyramid.nb_rooms == 4999
+    path = str(tmp_path / "rooms.mbtiles")
+    nb_tiles = pyramid.write_mbtiles(path, "Gotham City")
+
+    with sqlite3.connect(path) as connection:
+        metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+        tiles = connection.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles").fetchall()
+    assert len(tiles) == nb_tiles
+    assert metadata["format"] == "pbf" and (metadata["minzoom"], metadata["maxzoom"]) == ("4", "13")
+    w_lng, s_lat, e_lng, n_lat = map(float, metadata["bounds"].split(","))
+    assert w_lng == pytest.approx(np.nanmin(rooms[2]), abs=1e-5) and n_lat == pytest.approx(np.nanmax(rooms[1]), abs=1e-5)
+
+    by_zoom = {}
+    for zoom, column, row, data in tiles:
+        by_zoom.setdefault(zoom, []).append((column, (1 << zoom) - 1 - row, decode_tile(gzip.decompress(data))))
+    assert sorted(by_zoom) == list(range(4, 14))
+    for zoom, zoom_tiles in by_zoom.items():
+        features = [feature for _, _, tile_features in zoom_tiles for feature in tile_features]
+        if zoom < 12:
+            assert all(properties["cluster"] for _, _, _, properties in features)
+            assert sum(properties["point_count"] for _, _, _, properties in features) == 4999
+            assert len(features) < 4999
+        else:
+            assert sorted(feature_id for feature_id, _, _, _ in features) == rooms[0][1:].tolist()
+            # every room is in its tile, at its pixel
+            lats, lngs = rooms[1][1:], rooms[2][1:]
+            x, y = mercator(lats, lngs)
+            pixels = dict(zip(rooms[0][1:].tolist(), zip(x.tolist(), y.tolist())))
+            for column, row, tile_features in zoom_tiles:
+                for room_id, px, py, properties in tile_features:
+                    assert properties["room_id"] == str(room_id)
+                    x, y = pixels[room_id]
+                    assert int(x * (1 << zoom)) == column and int(y * (1 << zoom)) == row
+                    assert px == int((x * (1 << zoom) - column) * 4096)
+                    assert py == int((y * (1 << zoom) - row) * 4096)
+
+    # the low zooms are a handful of tiles
+    assert len(by_zoom[4]) == 1
+    with pytest.raises(ValueError):
+        TilePyramid.from_chunks([], min_zoom=5, max_zoom=19)
+
+def test_survey_tiles(airbnb, config, survey_controller, tmp_path):
+    survey = run_survey(config)
+    path = survey_controller.export_tiles(survey, folder=str(tmp_path), min_zoom=8, max_zoom=15, full_zoom=14)
+    assert path == f"{tmp_path}/rooms_{survey}.mbtiles"
+    with sqlite3.connect(path) as connection:
+        metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+        tiles = connection.execute("SELECT tile_data FROM tiles WHERE zoom_level = 15").fetchall()
+    assert metadata["name"] == "Gotham City, survey 1"
+    assert sum(len(decode_tile(gzip.decompress(data))) for (data,) in tiles) == NB_LISTINGS
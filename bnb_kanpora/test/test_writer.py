@@ -0,0 +1,71 @@
+from bnb_kanpora.metrics import MetricsRegistry
+from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel
+from bnb_kanpora.writer import DatabaseWriter
+from bnb_kanpora.test.test_backends import sample_rows
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import pytest
+
+@pytest.fixture
+def survey_id(config):
+    search_area = SearchAreaModel.create(name="Gotham City", bb_n_lat=46.9, bb_e_lng=1.8, bb_s_lat=46.7, bb_w_lng=1.5)
+    return SurveyModel.create(search_area_id=search_area).survey_id
+
+def test_concurrent_producers(config, survey_id):
+    insert = lambda rows: config.backend.bulk_insert_rooms(config.database, rows)
+    rows = sample_rows(survey_id, 2000)
+    metrics = MetricsRegistry()
+    with DatabaseWriter(config.database, metrics, batch_size=300, flush_interval=10, queue_size=100) as writer:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda row: writer.put(insert, row), rows + rows[:100]))
+    assert writer.nb_written == 2000
+    assert RoomModel.select().where(RoomModel.survey_id == survey_id).count() == 2000
+    # batches of 300 rows at most
+    assert metrics.value("db_writer_batches_total") >= 7
+    assert metrics.value("db_rows_written_total") == 2000
+
+def test_flush_interval():
+    batches = []
+    class Database():
+        def atomic(self):
+            return threading.Lock()
+        def close(self):
+            pass
+    write = lambda rows: batches.append(len(rows)) or len(rows)
+    writer = DatabaseWriter(Database(), batch_size=1000, flush_interval=0.05).start()
+    writer.put(write, 1)
+    writer.put(write, 2)
+    time.sleep(0.5)
+    # written before close
+    assert batches == [2]
+    writer.put(write, 3)
+    writer.close()
+    assert batches == [2, 1] and writer.nb_written == 3
+
+def test_backpressure_and_errors(config):
+    released = threading.Event()
+    def slow(rows):
+        released.wait()
+        return len(rows)
+    def failing(rows):
+        raise ValueError("bad row")
+
+    metrics = MetricsRegistry()
+    writer = DatabaseWriter(config.database, metrics, batch_size=2, flush_interval=0, queue_size=2).start()
+    producer = threading.Thread(target=lambda: [writer.put(slow, i) for i in range(10)])
+    producer.start()
+    producer.join(0.3)
+    # the queue is full while the writer is stuck
+    assert producer.is_alive() and writer.queue_depth == 2
+    released.set()
+    producer.join()
+    assert metrics.value("db_writer_wait_seconds") > 0
+
+    # a failed batch does not stop the writer, close reports it
+    writer.put(failing, 0)
+    writer.put(slow, 10)
+    with pytest.raises(ValueError):
+        writer.close()
+    assert writer.nb_written == 11
+    assert metrics.value("db_writer_errors_total") == 1
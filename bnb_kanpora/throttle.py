@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# ============================================================================
+# Adaptive request pacing: additive increase of the request rate and of the
+# number of concurrent requests while Airbnb answers, multiplicative decrease
+# on 403s, empty bodies and timeouts (AIMD, as in TCP congestion control)
+# ============================================================================
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+class AdaptiveRateController():
+    """AIMD controller of the request rate (requests/s) and of the number of
+    requests in flight, shared by every crawler thread
+
+    Methods:
+    ---
+        acquire()
+            Block until a request may be sent
+        release(success:bool)
+            Report the outcome of the request sent after acquire(): True
+            when answered, False when refused or overloaded, None when it
+            says nothing about congestion (e.g. a 404)
+    """
+    def __init__(self, initial_rate:float=2.0, min_rate:float=0.2, max_rate:float=20.0,
+                 initial_concurrency:int=2, max_concurrency:int=8,
+                 rate_increase:float=0.1, decrease_factor:float=0.5,
+                 request_sleep:float=0.0, metrics=None) -> None:
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(initial_rate, min_rate), max_rate)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(max(initial_concurrency, 1), max_concurrency))
+        self.rate_increase = rate_increase
+        self.decrease_factor = decrease_factor
+        self.request_sleep = request_sleep
+        self.metrics = metrics
+        self._in_flight = 0
+        self._next_time = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config, metrics=None) -> 'AdaptiveRateController':
+        return cls(
+            initial_rate=config.INITIAL_REQUEST_RATE,
+            min_rate=config.MIN_REQUEST_RATE,
+            max_rate=config.MAX_REQUEST_RATE,
+            initial_concurrency=config.INITIAL_CONCURRENCY,
+            max_concurrency=config.MAX_CONCURRENCY,
+            request_sleep=config.REQUEST_SLEEP,
+            metrics=metrics,
+        )
+
+    @property
+    def concurrency_limit(self) -> int:
+        return int(self.concurrency)
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= self.concurrency_limit:
+                self._condition.wait()
+            self._in_flight += 1
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + 1.0 / self.rate
+        # be nice: request_sleep adds a random pause on top of the pacing
+        delay = start - now + (random.uniform(0, self.request_sleep) if self.request_sleep else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, success:bool) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if success:
+                self._increase()
+            elif success is not None:
+                self._decrease()
+            self._condition.notify_all()
+        if self.metrics:
+            self.metrics.set("request_rate", self.rate)
+            self.metrics.set("concurrency_limit", self.concurrency_limit)
+
+    def _increase(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.rate_increase)
+        # one more request in flight once a full window succeeded
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        # the requests in flight when Airbnb starts refusing fail together:
+        # back off once for all of them
+        if now - self._last_decrease < 1.0 / self.rate:
+            return
+        self._last_decrease = now
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.concurrency = max(1.0, self.concurrency * self.decrease_factor)
+        # do not send the next request before the new interval
+        self._next_time = max(self._next_time, now + 1.0 / self.rate)
+        logger.info(f"Backing off: {round(self.rate, 2)} requests/s, {self.concurrency_limit} concurrent requests")
+        if self.metrics:
+            self.metrics.inc("throttle_decreases_total")
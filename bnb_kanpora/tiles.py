@@ -0,0 +1,306 @@
+#!/usr/bin/python3
+# ============================================================================
+# Vector tile pyramid of the rooms of a survey, for map display: rooms are
+# read once, sorted along a Z-order curve so that the rooms of every tile at
+# every zoom are contiguous, then encoded as Mapbox Vector Tiles (clusters
+# at low zooms, every room at high zooms) into an MBTiles SQLite file
+# ============================================================================
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import struct
+import numpy as np
+
+logger = logging.getLogger()
+
+LAYER_NAME = "rooms"
+EXTENT = 4096
+# a clustered tile has at most 2^CLUSTER_BITS x 2^CLUSTER_BITS clusters
+CLUSTER_BITS = 6
+MAX_ZOOM = 18
+# rooms are sorted at the precision of the tiles of this zoom, deep enough
+# for the clusters of the tiles of MAX_ZOOM
+MORTON_LEVEL = MAX_ZOOM + CLUSTER_BITS
+MAX_LATITUDE = 85.0511287798
+TILE_COLUMNS = (("room_id", np.int64), ("latitude", np.float64), ("longitude", np.float64),
+                ("rate", np.float64), ("reviews", np.float64), ("room_type", str))
+MBTILES_BATCH_SIZE = 1000
+
+
+def mercator(lats, lngs) -> tuple:
+    """Web Mercator (x, y) of points, in [0, 1) from the north west corner of the world"""
+    lats = np.radians(np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lngs, dtype=np.float64) + 180) / 360
+    y = 0.5 - np.log(np.tan(np.pi / 4 + lats / 2)) / (2 * np.pi)
+    return x, y
+
+
+def _spread_bits(values:np.ndarray) -> np.ndarray:
+    """Insert a zero bit before each of the 32 lower bits of values"""
+    v = values.astype(np.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_codes(ix:np.ndarray, iy:np.ndarray) -> np.ndarray:
+    """Z-order codes of tile coordinates: code >> 2 * k is the code of the parent tile k zooms up"""
+    return _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+
+
+# ----------------------------------------------------------------------------
+# Mapbox Vector Tile encoding (protocol buffers, version 2.1 of the spec)
+# ----------------------------------------------------------------------------
+def _encode_varint(value:int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# tags, pixels and lengths are small: their varints are looked up
+_SMALL_VARINTS = [_encode_varint(value) for value in range(1 << 14)]
+
+
+def _varint(value:int) -> bytes:
+    if value < 16384:
+        return _SMALL_VARINTS[value]
+    return _encode_varint(value)
+
+
+def _zigzag(value:int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(number:int, wire_type:int) -> bytes:
+    return _varint(number << 3 | wire_type)
+
+
+def _bytes_field(number:int, payload:bytes) -> bytes:
+    return _key(number, 2) + _varint(len(payload)) + payload
+
+
+def _value(value) -> bytes:
+    if isinstance(value, str):
+        return _bytes_field(1, value.encode("utf-8"))
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(5, 0) + _varint(value) if value >= 0 else _key(6, 0) + _varint(_zigzag(value))
+    return _key(3, 1) + struct.pack("<d", value)
+
+
+# keys of the fields of a feature: id, tags, type (POINT) and geometry with MoveTo(1)
+_FEATURE_ID = _key(1, 0)
+_FEATURE_TAGS = _key(2, 2)
+_FEATURE_POINT = _key(3, 0) + _varint(1)
+_FEATURE_GEOMETRY = _key(4, 2)
+_MOVE_TO_ONE = _varint(9)
+
+
+def encode_tile(features:list, layer_name:str=LAYER_NAME, extent:int=EXTENT) -> bytes:
+    """A vector tile of one layer of point features, (id, x, y, properties)
+    with x, y in tile pixels; None properties are left out"""
+    keys, values = {}, {}
+    encoded = []
+    varint = _varint
+    for feature_id, x, y, properties in features:
+        tags = []
+        for name, value in properties.items():
+            if value is None:
+                continue
+            tags.append(varint(keys.setdefault(name, len(keys))))
+            tags.append(varint(values.setdefault((type(value), value), len(values))))
+        tags = b"".join(tags)
+        # from the origin of the tile
+        geometry = _MOVE_TO_ONE + varint(_zigzag(x)) + varint(_zigzag(y))
+        feature = b"".join((_FEATURE_ID, varint(feature_id), _FEATURE_TAGS, varint(len(tags)), tags,
+                            _FEATURE_POINT, _FEATURE_GEOMETRY, varint(len(geometry)), geometry))
+        encoded.append(_bytes_field(2, feature))
+    layer = (_key(15, 0) + _varint(2) + _bytes_field(1, layer_name.encode("utf-8")) + b"".join(encoded)
+             + b"".join(_bytes_field(3, name.encode("utf-8")) for name in keys)
+             + b"".join(_bytes_field(4, _value(value)) for _, value in values)
+             + _key(5, 0) + _varint(extent))
+    return _bytes_field(3, layer)
+
+
+class TilePyramid():
+    """Rooms sorted along a Z-order curve, tiled from min_zoom to max_zoom
+
+    Below full_zoom, the rooms of each tile are merged into clusters, one per
+    cell of a 2^CLUSTER_BITS grid over the tile, with their number of rooms
+    and average rate; from full_zoom on, every room is a feature.
+
+    Attributes:
+    ---
+        min_zoom:int
+        max_zoom:int
+        full_zoom:int
+            First zoom with every room
+        nb_rooms:int
+
+    Methods:
+    ---
+        from_chunks(chunks) -> TilePyramid
+            From (room_id, lat, lng, rate, reviews, room_type) arrays
+        tiles(zoom) -> generator
+            (zoom, column, row, tile) of the non empty tiles of a zoom, row from the north
+        write_mbtiles(path:str, name:str) -> int
+            Number of tiles written
+    """
+    def __init__(self, room_ids, lats, lngs, rates, reviews, room_types,
+                 min_zoom:int=0, max_zoom:int=14, full_zoom:int=12) -> None:
+        if not 0 <= min_zoom <= max_zoom <= MAX_ZOOM:
+            raise ValueError(f"Zooms must be in 0 <= min_zoom <= max_zoom <= {MAX_ZOOM}")
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.full_zoom = min(max(full_zoom, min_zoom), max_zoom + 1)
+        located = ~(np.isnan(lats) | np.isnan(lngs))
+        x, y = mercator(lats[located], lngs[located])
+        size = 1 << MORTON_LEVEL
+        ix = np.clip(np.floor(x * size), 0, size - 1).astype(np.uint64)
+        iy = np.clip(np.floor(y * size), 0, size - 1).astype(np.uint64)
+        codes = morton_codes(ix, iy)
+        # the spatial sort: the rooms of any tile are a contiguous run
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.ix, self.iy = ix[order], iy[order]
+        self.x, self.y = x[order], y[order]
+        self.room_ids = room_ids[located][order]
+        self.rates = rates[located][order]
+        self.reviews = reviews[located][order]
+        self.room_types = room_types[located][order]
+        self.nb_rooms = len(self.codes)
+
+    @classmethod
+    def from_chunks(cls, chunks, **zooms) -> 'TilePyramid':
+        columns = list(zip(*chunks))
+        if not columns:
+            return cls(*[np.zeros(0, dtype=dtype) for _, dtype in TILE_COLUMNS], **zooms)
+        return cls(*[np.concatenate(arrays) for arrays in columns], **zooms)
+
+    @staticmethod
+    def _runs(codes:np.ndarray) -> tuple:
+        """(starts, ends) of the runs of equal values of sorted codes"""
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        return starts, np.append(starts[1:], len(codes))
+
+    def tiles(self, zoom:int):
+        if not self.nb_rooms:
+            return
+        if zoom >= self.full_zoom:
+            starts = np.arange(self.nb_rooms)
+            x, y = self.x, self.y
+        else:
+            # clusters are the runs of the codes of the tiles CLUSTER_BITS zooms down
+            starts, ends = self._runs(self.codes >> np.uint64(2 * (MORTON_LEVEL - zoom - CLUSTER_BITS)))
+            counts = ends - starts
+            x = np.add.reduceat(self.x, starts) / counts
+            y = np.add.reduceat(self.y, starts) / counts
+            with_rate = ~np.isnan(self.rates)
+            nb_rates = np.add.reduceat(with_rate.astype(np.int64), starts)
+            with np.errstate(invalid="ignore"):
+                avg_rates = np.add.reduceat(np.where(with_rate, self.rates, 0), starts) / nb_rates
+
+        # features (rooms or clusters) of a tile are a run of the tile codes of their first room
+        tile_starts, tile_ends = self._runs(self.codes[starts] >> np.uint64(2 * (MORTON_LEVEL - zoom)))
+        level_shift = np.uint64(MORTON_LEVEL - zoom)
+        columns = (self.ix[starts[tile_starts]] >> level_shift).astype(np.int64).tolist()
+        rows = (self.iy[starts[tile_starts]] >> level_shift).astype(np.int64).tolist()
+        scale = 1 << zoom
+        for column, row, start, end in zip(columns, rows, tile_starts.tolist(), tile_ends.tolist()):
+            px = np.clip(np.floor((x[start:end] * scale - column) * EXTENT), 0, EXTENT - 1).astype(np.int64).tolist()
+            py = np.clip(np.floor((y[start:end] * scale - row) * EXTENT), 0, EXTENT - 1).astype(np.int64).tolist()
+            if zoom >= self.full_zoom:
+                features = self._room_features(start, end, px, py)
+            else:
+                features = self._cluster_features(px, py, counts[start:end].tolist(), avg_rates[start:end].tolist())
+            yield zoom, column, row, encode_tile(features)
+
+    def _room_features(self, start:int, end:int, px:list, py:list) -> list:
+        features = []
+        for room_id, x, y, rate, reviews, room_type in zip(self.room_ids[start:end].tolist(), px, py,
+                self.rates[start:end].tolist(), self.reviews[start:end].tolist(), self.room_types[start:end].tolist()):
+            features.append((room_id, x, y, {
+                # room ids do not fit in the integers of JavaScript
+                "room_id": str(room_id),
+                "room_type": room_type,
+                "rate": None if rate != rate else round(rate, 2),
+                "reviews": None if reviews != reviews else int(reviews),
+            }))
+        return features
+
+    def _cluster_features(self, px:list, py:list, counts:list, avg_rates:list) -> list:
+        features = []
+        for i, (x, y, count, avg_rate) in enumerate(zip(px, py, counts, avg_rates)):
+            features.append((i + 1, x, y, {
+                "cluster": True,
+                "point_count": count,
+                "avg_rate": None if avg_rate != avg_rate else round(avg_rate, 2),
+            }))
+        return features
+
+    def bounds(self) -> tuple:
+        """(w_lng, s_lat, e_lng, n_lat) of the rooms"""
+        if not self.nb_rooms:
+            return -180.0, -MAX_LATITUDE, 180.0, MAX_LATITUDE
+        lngs = self.x * 360 - 180
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * self.y))))
+        return float(lngs.min()), float(lats.min()), float(lngs.max()), float(lats.max())
+
+    def metadata(self, name:str) -> dict:
+        w_lng, s_lat, e_lng, n_lat = self.bounds()
+        center_zoom = min(max(self.full_zoom - 2, self.min_zoom), self.max_zoom)
+        fields = {"room_id": "String", "room_type": "String", "rate": "Number", "reviews": "Number",
+                  "cluster": "Boolean", "point_count": "Number", "avg_rate": "Number"}
+        return {
+            "name": name,
+            "format": "pbf",
+            "type": "overlay",
+            "version": "1",
+            "minzoom": str(self.min_zoom),
+            "maxzoom": str(self.max_zoom),
+            "bounds": ",".join(f"{v:.6f}" for v in (w_lng, s_lat, e_lng, n_lat)),
+            "center": f"{(w_lng + e_lng) / 2:.6f},{(s_lat + n_lat) / 2:.6f},{center_zoom}",
+            "description": f"{self.nb_rooms} rooms, clustered below zoom {self.full_zoom}",
+            "json": json.dumps({"vector_layers": [{"id": LAYER_NAME, "fields": fields,
+                                                   "minzoom": self.min_zoom, "maxzoom": self.max_zoom}]}),
+        }
+
+    def write_mbtiles(self, path:str, name:str) -> int:
+        """Write the pyramid to an MBTiles file, built aside then moved to path"""
+        building = path + ".building"
+        if os.path.exists(building):
+            os.remove(building)
+        nb_tiles = 0
+        connection = sqlite3.connect(building)
+        try:
+            connection.executescript("""
+                PRAGMA journal_mode = OFF;
+                PRAGMA synchronous = OFF;
+                CREATE TABLE metadata (name text, value text);
+                CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);
+            """)
+            connection.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)", self.metadata(name).items())
+            batch = []
+            for zoom in range(self.min_zoom, self.max_zoom + 1):
+                for zoom_level, column, row, tile in self.tiles(zoom):
+                    # MBTiles rows count from the south
+                    batch.append((zoom_level, column, (1 << zoom_level) - 1 - row, gzip.compress(tile, compresslevel=6)))
+                    if len(batch) == MBTILES_BATCH_SIZE:
+                        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+                        nb_tiles += len(batch)
+                        batch = []
+            connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+            nb_tiles += len(batch)
+            connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(building, path)
+        return nb_tiles
@@ -1,16 +1,47 @@
 from dataclasses import dataclass, field
+from datetime import date, timedelta
 from typing import Dict
+from bnb_kanpora.coverage import CoverageEstimator
 
-@dataclass
 class GeoBox():
-    e_lng: float = 0.0
-    s_lat: float = 0.0
-    w_lng: float = 0.0
-    n_lat: float = 0.0
+    """Immutable geographical bounding box, coordinates are floats"""
+    __slots__ = ("e_lng", "s_lat", "w_lng", "n_lat")
+
+    def __init__(self, e_lng:float=0.0, s_lat:float=0.0, w_lng:float=0.0, n_lat:float=0.0) -> None:
+        # coordinates may come as Decimal from the database
+        object.__setattr__(self, "e_lng", float(e_lng))
+        object.__setattr__(self, "s_lat", float(s_lat))
+        object.__setattr__(self, "w_lng", float(w_lng))
+        object.__setattr__(self, "n_lat", float(n_lat))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GeoBox is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("GeoBox is immutable")
+
+    def __reduce__(self):
+        return (GeoBox, (self.e_lng, self.s_lat, self.w_lng, self.n_lat))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, GeoBox):
+            return NotImplemented
+        return (self.e_lng, self.s_lat, self.w_lng, self.n_lat) == (other.e_lng, other.s_lat, other.w_lng, other.n_lat)
+
+    def __hash__(self) -> int:
+        return hash((self.e_lng, self.s_lat, self.w_lng, self.n_lat))
+
+    def __repr__(self) -> str:
+        return f"GeoBox(e_lng={self.e_lng}, s_lat={self.s_lat}, w_lng={self.w_lng}, n_lat={self.n_lat})"
 
     def __str__(self) -> str:
         return f"e_lng:{self.e_lng}, s_lat:{self.s_lat}, w_lng:{self.w_lng}, n_lat:{self.n_lat}"
 
+    def contains(self, lat:float, lng:float) -> bool:
+        if lat is None or lng is None:
+            return False
+        return self.s_lat <= lat < self.n_lat and self.w_lng <= lng < self.e_lng
+
     def get_two_splits(self) -> tuple:
         return (
             #N
@@ -29,51 +60,81 @@ class GeoBox():
         )
 
     def enlarge(self, enlarge_pct:float=0.0) -> 'GeoBox':
-            self.n_lat = self.n_lat + abs(self.n_lat - self.s_lat) * enlarge_pct
-            self.s_lat = self.s_lat - abs(self.s_lat - self.n_lat) * enlarge_pct
-            self.e_lng = self.e_lng + abs(self.e_lng - self.w_lng) * enlarge_pct
-            self.w_lng = self.w_lng - abs(self.w_lng - self.e_lng) * enlarge_pct
+        """A new box, larger by enlarge_pct of its size on every side"""
+        if not enlarge_pct:
             return self
-            
+        lat_margin = abs(self.n_lat - self.s_lat) * enlarge_pct
+        lng_margin = abs(self.e_lng - self.w_lng) * enlarge_pct
+        return GeoBox(
+            n_lat=self.n_lat + lat_margin,
+            s_lat=self.s_lat - lat_margin,
+            e_lng=self.e_lng + lng_margin,
+            w_lng=self.w_lng - lng_margin,
+        )
 
     def get_four_splits(self, enlarge_pct:float=0.0) -> tuple:
+        mid_lat = (self.n_lat + self.s_lat) / 2
+        mid_lng = (self.w_lng + self.e_lng) / 2
         splits = (
             #NE
-            GeoBox(
-                n_lat=self.n_lat,
-                e_lng=self.e_lng,
-                s_lat=(self.n_lat + self.s_lat) / 2,
-                w_lng=(self.w_lng + self.e_lng) / 2
-            ),
+            GeoBox(n_lat=self.n_lat, e_lng=self.e_lng, s_lat=mid_lat, w_lng=mid_lng),
             #NW
-            GeoBox(
-                n_lat=self.n_lat,
-                e_lng=(self.w_lng + self.e_lng) / 2,
-                s_lat=(self.n_lat + self.s_lat) / 2,
-                w_lng=self.w_lng
-            ),
+            GeoBox(n_lat=self.n_lat, e_lng=mid_lng, s_lat=mid_lat, w_lng=self.w_lng),
             #SE
-            GeoBox(
-                n_lat=(self.n_lat + self.s_lat) / 2,
-                e_lng=self.e_lng,
-                s_lat=self.s_lat,
-                w_lng=(self.w_lng + self.e_lng) / 2
-            ),
+            GeoBox(n_lat=mid_lat, e_lng=self.e_lng, s_lat=self.s_lat, w_lng=mid_lng),
             #SW
-            GeoBox(
-                n_lat=(self.n_lat + self.s_lat) / 2,
-                e_lng=(self.w_lng + self.e_lng) / 2,
-                s_lat=self.s_lat,
-                w_lng=self.w_lng
-            )
+            GeoBox(n_lat=mid_lat, e_lng=mid_lng, s_lat=self.s_lat, w_lng=self.w_lng),
         )
-        return (box.enlarge(enlarge_pct) for box in splits)
+        return tuple(box.enlarge(enlarge_pct) for box in splits)
+
+@dataclass(frozen=True)
+class SearchFilters():
+    """Search filters of a node, None for no filter. Prices are inclusive bounds.
+    With checkin and checkout dates, only the rooms available for the stay
+    are returned, see SearchSurveyController.sweep."""
+    room_type:str = None
+    price_min:int = None
+    price_max:int = None
+    checkin:date = None
+    checkout:date = None
+    guests:int = None
+
+    def __str__(self) -> str:
+        stay = "" if self.checkin is None else f", checkin:{self.checkin}, checkout:{self.checkout}"
+        guests = "" if self.guests is None else f", guests:{self.guests}"
+        return f"room_type:{self.room_type}, price_min:{self.price_min}, price_max:{self.price_max}{stay}{guests}"
+
+    @property
+    def label(self) -> str:
+        """Short form, e.g. 'Private room/50-79', '-/80-' or '-@2022-07-14:2022-07-16x2'"""
+        price_min = "" if self.price_min is None else self.price_min
+        price_max = "" if self.price_max is None else self.price_max
+        prices = "" if self.price_min is None and self.price_max is None else f"/{price_min}-{price_max}"
+        stay = "" if self.checkin is None else f"@{self.checkin}:{self.checkout}"
+        guests = "" if self.guests is None else f"x{self.guests}"
+        return f"{self.room_type or '-'}{prices}{stay}{guests}"
+
+    def matches(self, room) -> bool:
+        """True if room (a RoomRecord) is returned by a search with these filters"""
+        if self.room_type is not None and room.room_type != self.room_type:
+            return False
+        if self.price_min is None and self.price_max is None:
+            return True
+        if room.rate is None:
+            return False
+        return (self.price_min is None or room.rate >= self.price_min) and \
+            (self.price_max is None or room.rate <= self.price_max)
 
 @dataclass
 class SearchResults():
+    """Rooms found in a box, as RoomRecord"""
     nb_rooms_expected:int = 0
     rooms:list = field(default_factory=list)
-    geobox: GeoBox = GeoBox()
+    geobox: GeoBox = field(default_factory=GeoBox)
+    filters: SearchFilters = field(default_factory=SearchFilters)
+    # the request gave up or its response could not be parsed: the rooms of
+    # the box are unknown, not absent
+    failed: bool = False
 
     @property
     def nb_rooms(self):
@@ -82,45 +143,73 @@ class SearchResults():
 @dataclass
 class SurveyResults():
     total_nb_saved:int = 0
-    search_results: Dict[str, SearchResults] = field(default_factory=dict)
+    # by crawl node: (quadkey, SearchFilters)
+    search_results: Dict[tuple, SearchResults] = field(default_factory=dict)
+    nb_requests:int = 0
+    elapsed:float = 0.0
+    estimator: CoverageEstimator = field(default_factory=CoverageEstimator)
+    # best-first crawl: budget spent or target coverage reached before the
+    # frontier was exhausted
+    budget_exhausted:bool = False
+    target_reached:bool = False
+    nb_nodes_left:int = 0
+    # searched nodes that were not sliced, they cover the area once
+    leaves: list = field(default_factory=list)
+    # nodes whose search failed, their area is missing from the survey
+    failed: list = field(default_factory=list)
 
     def get_uniques_search_results(self):
         unique_room_ids = set()
         unique_search_results = {}
         for idx_tree, sr in self.search_results.items():
             unique_sr = sr
-            unique_sr.rooms = [room for room in sr.rooms if room['listing']['id'] not in unique_room_ids]
+            unique_sr.rooms = [room for room in sr.rooms if room.room_id not in unique_room_ids]
             unique_search_results[idx_tree] = unique_sr
-            unique_room_ids.update([room['listing']['id'] for room in sr.rooms])
+            unique_room_ids.update([room.room_id for room in sr.rooms])
         self.search_results = unique_search_results
         return self
     
     @property
-    def total_nb_rooms_expected(self, idx_tree='0'):
-        nb_rooms = self.search_results[idx_tree].nb_rooms_expected
-        if nb_rooms == 1001:
-            # Airbnb limits nb_rooms to 1001
-            for level in range(5):
-                try:
-                    nb_rooms = 0
-                    indices = [k for k in self.search_results if len(k) == (level * 2) + 1]
-                    for idx in indices:
-                        _nb_rooms = self.search_results[idx].nb_rooms_expected
-                        if _nb_rooms < 1001:
-                            nb_rooms += _nb_rooms
-                        else:
-                            raise Exception()
-                    return nb_rooms
-                except Exception as e:
-                    continue
-        return nb_rooms
+    def total_nb_rooms_expected(self) -> int:
+        """Estimated number of listings of the area, see CoverageEstimator"""
+        return round(self.estimator.total)
+
+    @property
+    def coverage(self) -> float:
+        """Estimated share of the listings of the area found"""
+        return self.estimator.coverage
 
     @property
     def total_nb_rooms(self):
         return sum([sr.nb_rooms for k, sr in self.search_results.items()])
 
+    def get_stats(self) -> dict:
+        """Survey performance figures, for machine-readable output"""
+        return {
+            "nb_requests": self.nb_requests,
+            "nb_nodes": len(self.search_results),
+            "nb_rooms": self.total_nb_rooms,
+            "nb_saved": self.total_nb_saved,
+            "nb_expected": self.total_nb_rooms_expected,
+            "budget_exhausted": self.budget_exhausted,
+            "target_reached": self.target_reached,
+            "nb_nodes_left": self.nb_nodes_left,
+            "nb_nodes_failed": len(self.failed),
+            "coverage": self.coverage,
+            "elapsed": round(self.elapsed, 3),
+            "rooms_per_sec": round(self.total_nb_rooms / self.elapsed, 3) if self.elapsed else None,
+            "requests_per_sec": round(self.nb_requests / self.elapsed, 3) if self.elapsed else None,
+        }
+
+def stay_dates(first_checkin:date, nb_dates:int=1, nights:int=1) -> list:
+    """(checkin, checkout) of stays of nights nights, checking in on nb_dates consecutive days"""
+    if nb_dates < 1 or nights < 1:
+        raise ValueError("A sweep needs at least one date and one night")
+    return [(first_checkin + timedelta(days=i), first_checkin + timedelta(days=i + nights)) for i in range(nb_dates)]
+
 @dataclass
 class RoomTypes():
     ENTIRE_APT:str = "Entire home/apt"
     PRIVATE_ROOM:str = "Private room"
     SHARED_ROOM:str = "Shared room"
+    HOTEL_ROOM:str = "Hotel room"
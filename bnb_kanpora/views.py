@@ -5,23 +5,44 @@
 # An ABListing represents and individual Airbnb listing
 # ===========================================================================
 
-from bnb_kanpora.models import RoomModel, SurveyModel, SearchAreaModel
+import json
+from playhouse.shortcuts import model_to_dict
+from bnb_kanpora.models import SurveyRoomModel, SurveyModel, SearchAreaModel
 
-class ABDatabaseViewer():
+OUTPUT_FORMATS = ["text", "json", "ndjson"]
+
+class ABViewer():
+    """Print rows and results as text (__str__), a JSON document or NDJSON lines"""
+    def __init__(self, output_format:str="text") -> None:
+        self.output_format = output_format
+
+    def print_rows(self, rows):
+        if self.output_format == "text":
+            for row in rows:
+                print(row)
+        elif self.output_format == "json":
+            print(json.dumps([model_to_dict(row, recurse=False) for row in rows], default=str))
+        else:
+            for row in rows:
+                print(json.dumps(model_to_dict(row, recurse=False), default=str))
+
+    def print_result(self, result:dict, text:str=None):
+        if self.output_format == "text":
+            print(text if text is not None else "\n".join(f"{k}: {v}" for k, v in result.items()))
+        else:
+            print(json.dumps(result, default=str))
+
+class ABDatabaseViewer(ABViewer):
     pass
 
-class ABSearchAreaViewer():
+class ABSearchAreaViewer(ABViewer):
     def print_search_areas(self):
-       for row in SearchAreaModel.select().order_by(SearchAreaModel.search_area_id):
-           print(row)
+        self.print_rows(SearchAreaModel.select().order_by(SearchAreaModel.search_area_id))
 
-class ABSurveyViewer():
+class ABSurveyViewer(ABViewer):
     def print_surveys(self):
-       for row in SurveyModel.select().order_by(SurveyModel.survey_id):
-           print(row)
+        self.print_rows(SurveyModel.select().order_by(SurveyModel.survey_id))
 
-class ABRoomViewer():
+class ABRoomViewer(ABViewer):
     def print_rooms(self):
-       for row in RoomModel.select().order_by(RoomModel.room_id):
-           print(row)
-
+        self.print_rows(SurveyRoomModel.select().order_by(SurveyRoomModel.room_id))
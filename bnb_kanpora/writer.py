@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# ============================================================================
+# Single database writer: crawler threads put rows on a bounded queue, and
+# one thread drains it into grouped transactions, so that concurrent
+# producers never compete for the SQLite write lock
+# ============================================================================
+import logging
+import queue
+import threading
+import time
+from bnb_kanpora.metrics import MetricsRegistry
+
+logger = logging.getLogger()
+
+_STOP = object()
+
+
+class DatabaseWriter():
+    """Write rows put by any thread from a single thread, batch_size rows
+    or flush_interval seconds at a time, whichever comes first
+
+    A row is put with the function writing a list of such rows, write(rows)
+    -> number of rows written. The rows of a batch are grouped by function
+    and written in one transaction. When queue_size rows are waiting,
+    producers block until the writer catches up.
+
+    A failed batch is logged and the writer goes on, so that producers are
+    never blocked by a dead writer; close() raises the first error.
+
+    Attributes:
+    ---
+        database: peewee.Database
+        batch_size:int
+            Maximum number of rows per transaction
+        flush_interval:float
+            Maximum seconds a row waits in the queue
+        nb_written:int
+            Rows written so far, as reported by the write functions
+
+    Methods:
+    ---
+        start() -> DatabaseWriter
+        put(write, row)
+        close()
+    """
+    def __init__(self, database, metrics:MetricsRegistry=None, batch_size:int=500,
+                 flush_interval:float=1.0, queue_size:int=10000) -> None:
+        self.database = database
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.nb_written = 0
+        self._queue = queue.Queue(maxsize=max(queue_size, self.batch_size))
+        self._thread = None
+        self._error = None
+
+    @classmethod
+    def from_config(cls, config, metrics:MetricsRegistry=None) -> 'DatabaseWriter':
+        return cls(config.database, metrics,
+                   batch_size=config.DB_WRITER_BATCH_SIZE,
+                   flush_interval=config.DB_WRITER_FLUSH_INTERVAL,
+                   queue_size=config.DB_WRITER_QUEUE_SIZE)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> 'DatabaseWriter':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def put(self, write, row) -> None:
+        if self._thread is None:
+            raise RuntimeError("The database writer is not started")
+        try:
+            self._queue.put_nowait((write, row))
+        except queue.Full:
+            # backpressure: the producer waits for the writer
+            with self.metrics.timer("db_writer_wait_seconds"):
+                self._queue.put((write, row))
+
+    def close(self) -> None:
+        """Write the rows left in the queue and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __enter__(self) -> 'DatabaseWriter':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            self.close()
+        except Exception:
+            if exc_type is None:
+                raise
+            # do not hide the exception of the producer
+            logger.exception("Database writer failed")
+
+    def _next_batch(self) -> tuple:
+        """(rows, stop): at most batch_size rows, waiting flush_interval
+        seconds at most after the first one"""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                self.metrics.set("db_writer_queue_depth", self._queue.qsize())
+                if batch:
+                    self._write(batch)
+        finally:
+            # the connection of this thread
+            self.database.close()
+
+    def _write(self, batch:list) -> None:
+        by_write = {}
+        for write, row in batch:
+            by_write.setdefault(write, []).append(row)
+        try:
+            with self.metrics.timer("db_write_seconds"):
+                with self.database.atomic():
+                    nb_written = sum(write(rows) for write, rows in by_write.items())
+        except Exception as e:
+            logger.exception(f"Failed to write a batch of {len(batch)} rows")
+            self.metrics.inc("db_writer_errors_total")
+            if self._error is None:
+                self._error = e
+            return
+        self.nb_written += nb_written
+        self.metrics.inc("db_writer_batches_total")
+        self.metrics.inc("db_rows_written_total", nb_written)